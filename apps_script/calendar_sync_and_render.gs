@@ -65,132 +65,297 @@ function parseSlot_(dateIso, slotText) {
 }
 
 /*** ---- MAIN SYNC (Bookings -> Google Calendar) ---- ***/
-function syncBookingsToCalendar() {
-  // Цвета по типу услуги (по желанию)
-  const COLOR = {
-    "Прогулка": CalendarApp.EventColor.GREEN,
-    "Кафе": CalendarApp.EventColor.BLUE,
-    "Кино": CalendarApp.EventColor.PALE_BLUE,
-    "Спорт/зал/активность": CalendarApp.EventColor.SAGE,
-    "Выезд на природу": CalendarApp.EventColor.MAUVE,
-    "Разговор по душам": CalendarApp.EventColor.RED
+// Инкрементальный синк: в колонке CalendarSyncState храним отпечаток строки, с которым она
+// последний раз ушла в календарь. Строки с тем же отпечатком пропускаем без обращений к CalendarApp.
+// Изменённая строка трогает календарь, только если поменялось само событие (CalendarEventHash):
+// правка комментария админа или имени не стоит ни одного вызова CalendarApp.
+// ID событий, хэши и отпечатки копятся в памяти и пишутся в конце одним setValues на колонку.
+// Если время запуска подходит к лимиту Apps Script (6 мин), запоминаем, с какой строки продолжить,
+// и ставим одноразовый триггер на продолжение.
+const SYNC_BUDGET_MS   = 4.5 * 60 * 1000;     // сколько работаем за запуск, с запасом до 6 минут
+const SYNC_CURSOR_PROP = 'SYNC_CURSOR';       // ScriptProperties: строка, с которой продолжить
+const SYNC_TRIGGER_PROP = 'SYNC_TRIGGER';     // ScriptProperties: ID триггера продолжения
+const SYNC_STATE_COL   = 'CalendarSyncState';
+const SYNC_HASH_COL    = 'CalendarEventHash';  // хэш полей события: заголовок, время, место, описание, цвет
+
+// Цвета по типу услуги (по желанию)
+const SERVICE_COLOR = {
+  "Прогулка": CalendarApp.EventColor.GREEN,
+  "Кафе": CalendarApp.EventColor.BLUE,
+  "Кино": CalendarApp.EventColor.PALE_BLUE,
+  "Спорт/зал/активность": CalendarApp.EventColor.SAGE,
+  "Выезд на природу": CalendarApp.EventColor.MAUVE,
+  "Разговор по душам": CalendarApp.EventColor.RED
+};
+
+function hash_(text) {
+  const bytes = Utilities.computeDigest(Utilities.DigestAlgorithm.MD5, text, Utilities.Charset.UTF_8);
+  return Utilities.base64EncodeWebSafe(bytes).slice(0, 12);
+}
+
+// отпечаток строки без служебных колонок синка
+function rowFingerprint_(row, skipCols) {
+  return hash_(row.filter((_, i) => skipCols.indexOf(i+1) < 0).map(String).join('␟'));
+}
+
+function deleteEvent_(cal, eventId) {
+  try {
+    const ev = cal.getEventById(eventId);
+    if (ev) ev.deleteEvent();
+  } catch (e) {}
+}
+
+// что должно оказаться в календаре для подтверждённой заявки + компактный хэш этого
+function eventSpec_(rec) {
+  const allDay = /весь\s*день/i.test(rec.timeSlot);
+  const [start, end] = allDay ? [null, null] : parseSlot_(rec.dateIso, rec.timeSlot);
+  const spec = {
+    title:    `${rec.service}${rec.user ? ' — @'+rec.user : ''}`,
+    desc:     `RequestID: ${rec.requestId}\nПожелания: ${rec.wishes || '—'}`,
+    location: rec.district,
+    color:    SERVICE_COLOR[rec.service] || CalendarApp.EventColor.GRAY,
+    allDay, dateIso: rec.dateIso, start, end,
   };
+  spec.hash = hash_([spec.title, spec.desc, spec.location, spec.color, allDay ? 'D' : '',
+                     rec.dateIso, start ? start.getTime() : '', end ? end.getTime() : ''].join('␟'));
+  return spec;
+}
+
+function createEvent_(cal, spec) {
+  let ev;
+  if (spec.allDay) {
+    const [y,m,d] = spec.dateIso.split('-').map(Number);
+    ev = cal.createAllDayEvent(spec.title, new Date(y, m-1, d), {location: spec.location, description: spec.desc});
+  } else {
+    ev = cal.createEvent(spec.title, spec.start, spec.end, {location: spec.location, description: spec.desc});
+  }
+  try { ev.setColor(spec.color); } catch(e) {}
+  return ev.getId();
+}
+
+// событие есть, но содержимое разошлось: обновляем на месте, а all-day (и переход в/из all-day) —
+// пересоздаём, так проще, чем конвертировать. Возвращает [ID, 'updated' | 'created'].
+function updateEvent_(cal, spec, existingId) {
+  let ev = null;
+  try { ev = cal.getEventById(existingId); } catch(e) {}
+  if (!ev) return [createEvent_(cal, spec), 'created'];
+  if (spec.allDay || ev.isAllDayEvent()) {
+    try { ev.deleteEvent(); } catch(e) {}
+    return [createEvent_(cal, spec), 'updated'];
+  }
+  ev.setTitle(spec.title).setTime(spec.start, spec.end).setLocation(spec.location).setDescription(spec.desc);
+  try { ev.setColor(spec.color); } catch(e) {}
+  return [ev.getId(), 'updated'];
+}
+
+function syncBookingsToCalendar() {
+  const lock = LockService.getScriptLock();
+  if (!lock.tryLock(1000)) return;            // предыдущий запуск (или продолжение) ещё идёт
+  try {
+    const stats = syncBookingsToCalendar_();
+    const msg = `создано ${stats.created}, обновлено ${stats.updated}, удалено ${stats.deleted}, ` +
+                `без изменений ${stats.skipped}` + (stats.more ? ' (продолжение через минуту)' : '');
+    console.log('Calendar sync: ' + msg);
+    try { SpreadsheetApp.getActive().toast(msg, 'Синк календаря', 5); } catch(e) {}
+    return stats;
+  } finally {
+    lock.releaseLock();
+  }
+}
 
+function syncBookingsToCalendar_() {
+  const t0 = Date.now();
+  const stats = {created: 0, updated: 0, deleted: 0, skipped: 0, more: false};
+  const props = PropertiesService.getScriptProperties();
+  dropSyncContinuation_(props);
   const cal = getCalendar_();
   const ws  = getSheet_(SHEET_BOOKINGS);
   const colEventId = ensureColumn_(ws, 'CalendarEventId');
+  const colHash    = ensureColumn_(ws, SYNC_HASH_COL);
+  const colState   = ensureColumn_(ws, SYNC_STATE_COL);
 
   const H = headerMap_(ws);
-  const rng = ws.getRange(2,1, Math.max(ws.getLastRow()-1,0), ws.getLastColumn());
-  const values = rng.getValues();
-
-  for (let i=0; i<values.length; i++) {
+  const n = Math.max(ws.getLastRow()-1, 0);
+  if (!n) return stats;
+  const values = ws.getRange(2,1, n, ws.getLastColumn()).getValues();
+  const ids    = values.map(r => [r[colEventId-1]]);
+  const hashes = values.map(r => [r[colHash-1]]);
+  const states = values.map(r => [r[colState-1]]);
+  let dirty = false;
+
+  let i = Number(props.getProperty(SYNC_CURSOR_PROP) || 0);
+  if (!(i < n)) i = 0;
+  for (; i < n; i++) {
+    if (Date.now() - t0 > SYNC_BUDGET_MS) break;
     const row = values[i];
-    const status    = String(row[H['Status']-1] || '').trim();
-    const requestId = String(row[H['RequestID']-1] || '').trim();
-    const dateIso   = String(row[H['DateISO']-1] || '').trim();
-    if (!requestId || !dateIso) continue;
-
-    const timeSlot  = String(row[H['TimeSlot']-1] || '').trim();
-    const service   = String(row[H['Service']-1]  || '').trim();
-    const user      = String(row[H['Username']-1] || row[H['TelegramID']-1] || '').trim();
-    const district  = String(row[H['District']-1] || '').trim();
-    const wishes    = String(row[H['Wishes']-1]   || '').trim();
-
-    const eventCell  = ws.getRange(i+2, colEventId);
-    const existingId = String(eventCell.getValue() || '').trim();
-
-    if (status === 'Подтверждена') {
-      const title = `${service}${user ? ' — @'+user : ''}`;
-      const desc  = `RequestID: ${requestId}\nПожелания: ${wishes || '—'}`;
-      const color = COLOR[service] || CalendarApp.EventColor.GRAY;
-
-      // All-day?
-      if (/весь\s*день/i.test(timeSlot)) {
-        const [y,m,d] = dateIso.split('-').map(Number);
-        const startDay = new Date(y, m-1, d);
-
-        // Проще пересоздать all-day, чем конвертировать обычное событие
-        if (existingId) {
-          try {
-            const oldEv = cal.getEventById(existingId);
-            if (oldEv) oldEv.deleteEvent();
-          } catch (e) {}
-        }
-        const ev = cal.createAllDayEvent(title, startDay, {location: district, description: desc});
-        try { ev.setColor(color); } catch(e) {}
-        eventCell.setValue(ev.getId());
-        continue;
-      }
+    const fp = rowFingerprint_(row, [colEventId, colHash, colState]);
+    if (String(states[i][0]) === fp) {          // строка не менялась с прошлого синка
+      stats.skipped++;
+      continue;
+    }
 
-      // Обычный интервал
-      const [start, end] = parseSlot_(dateIso, timeSlot);
-      let ev;
-      if (existingId) {
-        try {
-          ev = cal.getEventById(existingId);
-          if (ev) {
-            ev.setTitle(title).setTime(start, end).setLocation(district).setDescription(desc);
-          } else {
-            ev = cal.createEvent(title, start, end, {location: district, description: desc});
-          }
-        } catch(e) {
-          ev = cal.createEvent(title, start, end, {location: district, description: desc});
-        }
-      } else {
-        ev = cal.createEvent(title, start, end, {location: district, description: desc});
-      }
-      try { ev.setColor(color); } catch(e) {}
-      eventCell.setValue(ev.getId());
-
-    } else if (status === 'Отклонена' || status === 'Отменена') {
-      if (existingId) {
-        try {
-          const ev = cal.getEventById(existingId);
-          if (ev) ev.deleteEvent();
-        } catch(e) {}
-        eventCell.setValue('');
+    const rec = {
+      status:    String(row[H['Status']-1]    || '').trim(),
+      requestId: String(row[H['RequestID']-1] || '').trim(),
+      dateIso:   String(row[H['DateISO']-1]   || '').trim(),
+      timeSlot:  String(row[H['TimeSlot']-1]  || '').trim(),
+      service:   String(row[H['Service']-1]   || '').trim(),
+      user:      String(row[H['Username']-1]  || row[H['TelegramID']-1] || '').trim(),
+      district:  String(row[H['District']-1]  || '').trim(),
+      wishes:    String(row[H['Wishes']-1]    || '').trim(),
+    };
+    const existingId = String(ids[i][0] || '').trim();
+    let action = 'skipped';
+
+    if (rec.requestId && rec.dateIso && rec.status === 'Подтверждена') {
+      const spec = eventSpec_(rec);
+      if (!existingId) {
+        ids[i][0] = createEvent_(cal, spec);
+        action = 'created';
+      } else if (String(hashes[i][0]) !== spec.hash) {
+        // поменялось то, что видно в событии (не комментарий админа и т.п.)
+        [ids[i][0], action] = updateEvent_(cal, spec, existingId);
       }
+      hashes[i][0] = spec.hash;
+    } else if ((rec.status === 'Отклонена' || rec.status === 'Отменена') && existingId) {
+      deleteEvent_(cal, existingId);
+      ids[i][0] = hashes[i][0] = '';
+      action = 'deleted';
     }
+    stats[action]++;
+    states[i][0] = fp;
+    dirty = true;
+  }
+
+  // все изменения — одной записью на колонку
+  if (dirty) {
+    ws.getRange(2, colEventId, n, 1).setValues(ids);
+    ws.getRange(2, colHash, n, 1).setValues(hashes);
+    ws.getRange(2, colState, n, 1).setValues(states);
+    props.setProperty(GRID_GEN_PROP, String(Date.now()));  // заявки поменялись — кэш сетки месяца устарел
   }
+
+  if (i < n) {
+    // не уложились: продолжим с этой строки отдельным запуском через минуту
+    props.setProperty(SYNC_CURSOR_PROP, String(i));
+    scheduleSyncContinuation_(props);
+    stats.more = true;
+  } else {
+    props.deleteProperty(SYNC_CURSOR_PROP);
+  }
+  return stats;
 }
 
-/*** ---- MONTH GRID RENDER (optional, for sheet "Календарь-Месяц") ---- ***/
-function renderMonthGrid() {
-  const ws = getSheet_('Календарь-Месяц');
-  const year  = Number(ws.getRange('A1').getValue());
-  const month = Number(ws.getRange('B1').getValue());
-  if (!year || !month) return;
+// одноразовый триггер продолжения; его ID храним, чтобы убрать отработавший
+function scheduleSyncContinuation_(props) {
+  const trig = ScriptApp.newTrigger('syncBookingsToCalendar').timeBased().after(60 * 1000).create();
+  props.setProperty(SYNC_TRIGGER_PROP, trig.getUniqueId());
+}
 
-  const map = {};
+function dropSyncContinuation_(props) {
+  const id = props.getProperty(SYNC_TRIGGER_PROP);
+  if (!id) return;
+  ScriptApp.getProjectTriggers().filter(t => t.getUniqueId() === id).forEach(t => ScriptApp.deleteTrigger(t));
+  props.deleteProperty(SYNC_TRIGGER_PROP);
+}
+
+/*** ---- MONTH GRID RENDER (optional, for sheet "Календарь-Месяц") ---- ***/
+// На листе: A1 — год, B1 — месяц, C1 — сколько месяцев подряд (по умолчанию 1).
+// Заявки читаются одним проходом и раскладываются по (год-месяц, день); разложенное кладём
+// в CacheService, так что повторные запуски (триггер, соседние месяцы) «Заявки» не читают.
+// Кэш сбрасывается, когда синк календаря что-то поменял (GRID_GEN), и сам — через GRID_CACHE_TTL_S.
+// Каждый месяц — блок 8×7 (название, дни недели, 6 недель), пишется одним setValues.
+const GRID_SHEET = 'Календарь-Месяц';
+const GRID_SHEET_PER_MONTH = false;           // true — каждый месяц на свой лист «Календарь-Месяц YYYY-MM»
+const GRID_CACHE_TTL_S = 30 * 60;
+const GRID_GEN_PROP = 'GRID_GEN';
+const MONTH_NAMES = ['Январь','Февраль','Март','Апрель','Май','Июнь',
+                     'Июль','Август','Сентябрь','Октябрь','Ноябрь','Декабрь'];
+const WEEKDAY_NAMES = ['Пн','Вт','Ср','Чт','Пт','Сб','Вс'];
+
+// один проход по «Заявкам»: {'YYYY-MM': {день: [строки]}} для подтверждённых
+function groupBookings_() {
   const bws = getSheet_(SHEET_BOOKINGS);
   const H = headerMap_(bws);
-  const data = bws.getRange(2,1, Math.max(bws.getLastRow()-1,0), bws.getLastColumn()).getValues();
-
+  const n = Math.max(bws.getLastRow()-1, 0);
+  const data = n ? bws.getRange(2,1, n, bws.getLastColumn()).getValues() : [];
+  const out = {};
   data.forEach(r => {
     const status = String(r[H['Status']-1]||'').trim();
     if (status !== 'Подтверждена') return;
     const iso = String(r[H['DateISO']-1]||'').trim();
-    if (!iso || iso.slice(0,7)!==Utilities.formatString('%04d-%02d', year, month)) return;
+    if (!/^\d{4}-\d{2}-\d{2}/.test(iso)) return;
     const slot = String(r[H['TimeSlot']-1]||'').trim();
     const svc  = String(r[H['Service']-1] ||'').trim();
     const user = String(r[H['Username']-1]|| r[H['TelegramID']-1]||'').trim();
-    const d = Number(iso.slice(8,10));
-    const line = `${slot||''} ${svc}${user ? ' — @'+user : ''}`.trim();
-    if (!map[d]) map[d] = [];
-    map[d].push(line);
+    const ym = iso.slice(0,7), d = Number(iso.slice(8,10));
+    const byDay = out[ym] || (out[ym] = {});
+    (byDay[d] || (byDay[d] = [])).push(`${slot||''} ${svc}${user ? ' — @'+user : ''}`.trim());
+  });
+  Object.values(out).forEach(byDay => Object.values(byDay).forEach(lines => lines.sort()));
+  return out;
+}
+
+// {'YYYY-MM': {день: [строки]}} для нужных месяцев: из кэша скрипта, иначе одним проходом по заявкам
+function groupedMonths_(keys) {
+  const cache = CacheService.getScriptCache();
+  const gen = PropertiesService.getScriptProperties().getProperty(GRID_GEN_PROP) || '0';
+  const ck = ym => `grid:${gen}:${ym}`;
+  const hit = cache.getAll(keys.map(ck));
+  if (keys.every(ym => ck(ym) in hit)) {
+    const out = {};
+    keys.forEach(ym => out[ym] = JSON.parse(hit[ck(ym)]));
+    return out;
+  }
+  const grouped = groupBookings_();
+  const put = {};
+  Object.keys(grouped).concat(keys).forEach(ym => {
+    const json = JSON.stringify(grouped[ym] || {});
+    if (json.length < 90 * 1024) put[ck(ym)] = json;   // лимит CacheService — 100 КБ на значение
+  });
+  cache.putAll(put, GRID_CACHE_TTL_S);
+  return grouped;
+}
+
+// блок месяца 8×7: название, дни недели, 6 недель (Пн–Вс)
+function monthBlock_(y, m, byDay) {
+  const block = [[`${MONTH_NAMES[m-1]} ${y}`, '', '', '', '', '', ''], WEEKDAY_NAMES.slice()];
+  const lead = (new Date(y, m-1, 1).getDay() + 6) % 7;
+  const daysInMonth = new Date(y, m, 0).getDate();
+  for (let w = 0; w < 6; w++) {
+    const row = [];
+    for (let wd = 0; wd < 7; wd++) {
+      const day = w*7 + wd - lead + 1;
+      if (day < 1 || day > daysInMonth) { row.push(''); continue; }
+      const list = byDay[day] ? '\n' + byDay[day].join('\n') : '';
+      row.push(`${day}${list}`);
+    }
+    block.push(row);
+  }
+  return block;
+}
+
+function renderMonthGrids(year, month, count) {
+  const keys = [];
+  for (let k = 0; k < Math.max(count || 1, 1); k++) {
+    const t = year*12 + (month-1) + k;
+    keys.push(Utilities.formatString('%04d-%02d', Math.floor(t/12), t%12 + 1));
+  }
+  const grouped = groupedMonths_(keys);
+  keys.forEach((ym, k) => {
+    const [y, m] = ym.split('-').map(Number);
+    const ws  = getSheet_(GRID_SHEET_PER_MONTH ? `${GRID_SHEET} ${ym}` : GRID_SHEET);
+    const rng = ws.getRange(GRID_SHEET_PER_MONTH ? 3 : 3 + k*9, 1, 8, 7);
+    rng.setValues(monthBlock_(y, m, grouped[ym] || {}));
+    rng.setWrap(true);
   });
+}
 
-  const rng = ws.getRange(4,1,6,7);
-  const vals = rng.getValues();
-  const out = vals.map(row => row.map(cell => {
-    if (!cell) return '';
-    const day = new Date(cell).getDate();
-    const list = map[day] ? '\n' + map[day].join('\n') : '';
-    return `${day}${list}`;
-  }));
-  rng.setValues(out);
-  rng.setWrap(true);
+function renderMonthGrid() {
+  const ws = getSheet_(GRID_SHEET);
+  const [year, month, count] = ws.getRange(1,1,1,3).getValues()[0].map(Number);
+  if (!year || !month) return;
+  renderMonthGrids(year, month, count || 1);
 }
 
 /*** ---- ONE-TIME BEAUTY FOR SHEET "Календарь" ---- ***/
@@ -254,6 +419,66 @@ function bootstrapSheets() {
   SpreadsheetApp.getActive().toast('Листы и шапки готовы ✅', 'Qwesade', 5);
 }
 
+/*** ---- CHANGE FEED FOR THE BOT ---- ***/
+// Бот держит индексы листов в памяти и сам ручных правок не видит. onEdit пишет в скрытый лист «Правки»
+// [Seq, Sheet, FromRow, ToRow, At], бот раз в несколько секунд дочитывает хвост лога и перечитывает
+// только эти строки (src/change_feed.py). Вставку/удаление строк и колонок ловит onChange
+// (ставится из меню, installChangeFeed) — тогда Sheet='*', и бот перечитывает листы целиком.
+// Записи самого бота и скриптов триггеров не вызывают.
+const FEED_SHEET  = 'Правки';
+const FEED_WATCH  = ['Заявки', 'Календарь'];
+const FEED_SEQ_PROP = 'FEED_SEQ';             // DocumentProperties: номер последней записи
+const FEED_KEEP   = 1000;                     // сколько записей держать; отставший сильнее бот перечитает всё
+const FEED_STRUCTURAL = ['INSERT_ROW', 'REMOVE_ROW', 'INSERT_COLUMN', 'REMOVE_COLUMN', 'INSERT_GRID', 'REMOVE_GRID', 'OTHER'];
+
+function feedSheet_() {
+  const ss = SpreadsheetApp.getActive();
+  let sh = ss.getSheetByName(FEED_SHEET);
+  if (!sh) {
+    sh = ss.insertSheet(FEED_SHEET);
+    sh.getRange(1, 1, 1, 5).setValues([['Seq', 'Sheet', 'FromRow', 'ToRow', 'At']]);
+    sh.hideSheet();
+  }
+  return sh;
+}
+
+function logChange_(sheetName, fromRow, toRow) {
+  const lock = LockService.getDocumentLock();
+  if (!lock.tryLock(10000)) return;
+  try {
+    const props = PropertiesService.getDocumentProperties();
+    const seq = Number(props.getProperty(FEED_SEQ_PROP) || 0) + 1;
+    const sh = feedSheet_();
+    sh.appendRow([seq, sheetName, fromRow, toRow, new Date()]);
+    props.setProperty(FEED_SEQ_PROP, String(seq));
+    // подрезаем сверху пачкой, а не по строке на правку
+    const extra = sh.getLastRow() - 1 - FEED_KEEP;
+    if (extra >= FEED_KEEP / 5) sh.deleteRows(2, extra);
+  } finally {
+    lock.releaseLock();
+  }
+}
+
+// simple trigger: работает без установки
+function onEdit(e) {
+  if (!e || !e.range) return;
+  const name = e.range.getSheet().getName();
+  if (FEED_WATCH.indexOf(name) < 0) return;
+  logChange_(name, e.range.getRow(), e.range.getLastRow());
+}
+
+function onFeedChange_(e) {
+  if (e && FEED_STRUCTURAL.indexOf(e.changeType) >= 0) logChange_('*', 0, 0);
+}
+
+function installChangeFeed() {
+  const ss = SpreadsheetApp.getActive();
+  feedSheet_();
+  const exists = ScriptApp.getProjectTriggers().some(t => t.getHandlerFunction() === 'onFeedChange_');
+  if (!exists) ScriptApp.newTrigger('onFeedChange_').forSpreadsheet(ss).onChange().create();
+  ss.toast('Лента правок для бота включена ✅', 'Qwesade', 5);
+}
+
 /*** ---- CUSTOM MENU IN SHEET ---- ***/
 function onOpen() {
   SpreadsheetApp.getUi().createMenu('Qwesade')
@@ -261,6 +486,7 @@ function onOpen() {
     .addItem('Синхронизация → Google Calendar', 'syncBookingsToCalendar')
     .addItem('Оформить лист «Календарь»', 'formatCalendarSheet')
     .addItem('Обновить «Календарь-Месяц»', 'renderMonthGrid')
+    .addItem('Включить ленту правок для бота', 'installChangeFeed')
     .addToUi();
 }
 
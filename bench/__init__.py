@@ -0,0 +1,2 @@
+# bench/__init__.py
+"""Офлайн-бенчмарк бота: фейковые Google Sheets и Bot API, см. bench/run.py."""
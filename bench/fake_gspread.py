@@ -0,0 +1,207 @@
+# bench/fake_gspread.py
+"""
+gspread без сети: клиент -> таблица -> листы в памяти, с той же поверхностью, что использует src/sheets.py
+(get_values, get_all_values, get_all_records, batch_get, batch_update, update, update_cell,
+row_values, append_rows, cell). Семантика как у Sheets API: хвостовые пустые строки/ячейки
+не возвращаются, append пишет после последней непустой строки и отдаёт updatedRange.
+
+Каждый вызов:
+  - считается в calls (метод -> число) и api_seconds (метод -> суммарное время);
+  - если задан op_calls (ContextVar, см. bench/run.py) — ещё и в счётчик текущей операции;
+  - ждёт latency_ms (+ jitter) — имитация сети; вызовы идут из пула AsyncSheets, так что
+    медленный «Google» занимает воркеры так же, как настоящий.
+"""
+from __future__ import annotations
+import contextvars
+import random
+import threading
+import time
+from collections import Counter
+from typing import List
+
+import gspread
+from gspread.utils import a1_range_to_grid_range, rowcol_to_a1
+
+# счётчик вызовов текущей операции бенчмарка (Counter) — переезжает в поток пула вместе с контекстом
+op_calls: contextvars.ContextVar[Counter | None] = contextvars.ContextVar("op_calls", default=None)
+
+calls: Counter = Counter()
+api_seconds: Counter = Counter()
+_stats_lock = threading.Lock()
+
+
+def reset_stats():
+    with _stats_lock:
+        calls.clear()
+        api_seconds.clear()
+
+
+def _numericise(v: str):
+    # get_all_records в gspread по умолчанию превращает числа-строки в int/float
+    if v.isdigit():
+        return int(v)
+    try:
+        return float(v) if v.replace(".", "", 1).isdigit() else v
+    except ValueError:
+        return v
+
+
+class FakeWorksheet:
+    def __init__(self, title: str, rows: int = 1000, cols: int = 26, latency_ms: float = 0.0, jitter: float = 0.0):
+        self.title = title
+        self.row_count, self.col_count = rows, cols
+        self.data: List[List[str]] = []
+        self.latency_ms, self.jitter = latency_ms, jitter
+        self._lock = threading.Lock()
+
+    # --------------------- helpers ---------------------
+
+    def _call(self, name: str):
+        t0 = time.perf_counter()
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000 * (1 + random.uniform(-self.jitter, self.jitter)))
+        with _stats_lock:
+            calls[name] += 1
+            api_seconds[name] += time.perf_counter() - t0
+        op = op_calls.get()
+        if op is not None:
+            op[f"sheets.{name}"] += 1
+
+    @staticmethod
+    def _grid(rng: str):
+        rng = rng.split("!")[-1]
+        g = a1_range_to_grid_range(rng)
+        return g.get("startRowIndex", 0), g.get("endRowIndex"), g.get("startColumnIndex", 0), g.get("endColumnIndex")
+
+    def _read(self, rng: str) -> List[List[str]]:
+        r0, r1, c0, c1 = self._grid(rng)
+        out = [list(r[c0:c1]) for r in self.data[r0:r1]]
+        for r in out:
+            while r and r[-1] == "":
+                r.pop()
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+    def _write(self, r0: int, c0: int, values):
+        for i, row in enumerate(values):
+            while len(self.data) <= r0 + i:
+                self.data.append([])
+            dst = self.data[r0 + i]
+            for j, v in enumerate(row):
+                while len(dst) <= c0 + j:
+                    dst.append("")
+                dst[c0 + j] = "" if v is None else str(v)
+
+    def _last_row(self) -> int:
+        n = len(self.data)
+        while n and not any(self.data[n - 1]):
+            n -= 1
+        return n
+
+    # --------------------- gspread surface ---------------------
+
+    def get_values(self, range_name: str | None = None, **kw):
+        self._call("get_values")
+        with self._lock:
+            return self._read(range_name or f"1:{max(len(self.data), 1)}")
+
+    def get(self, range_name: str | None = None, **kw):
+        self._call("get")
+        with self._lock:
+            return self._read(range_name or f"1:{max(len(self.data), 1)}")
+
+    def get_all_values(self, **kw):
+        self._call("get_all_values")
+        with self._lock:
+            return self._read(f"1:{max(len(self.data), 1)}")
+
+    def get_all_records(self, **kw):
+        self._call("get_all_records")
+        with self._lock:
+            if not self.data:
+                return []
+            head = self.data[0]
+            return [{h: _numericise(r[i] if i < len(r) else "") for i, h in enumerate(head)}
+                    for r in self.data[1:self._last_row()]]
+
+    def row_values(self, row: int, **kw):
+        self._call("row_values")
+        with self._lock:
+            got = self._read(f"{row}:{row}")
+            return got[0] if got else []
+
+    def cell(self, row: int, col: int, **kw):
+        self._call("cell")
+        with self._lock:
+            got = self._read(rowcol_to_a1(row, col))
+            return gspread.Cell(row, col, got[0][0] if got and got[0] else None)
+
+    def batch_get(self, ranges, **kw):
+        self._call("batch_get")
+        with self._lock:
+            return [self._read(r) for r in ranges]
+
+    def update(self, *args, **kw):
+        self._call("update")
+        # gspread 6: update(values, range_name); старый порядок (range, values) тоже принимает
+        values, rng = (args + (None, None))[:2]
+        values, rng = kw.get("values", values), kw.get("range_name", rng)
+        if isinstance(values, str):
+            values, rng = rng, values
+        r0, _, c0, _ = self._grid(rng or "A1")
+        with self._lock:
+            self._write(r0, c0, values)
+
+    def update_cell(self, row: int, col: int, value):
+        self._call("update_cell")
+        with self._lock:
+            self._write(row - 1, col - 1, [[value]])
+
+    def batch_update(self, data, **kw):
+        self._call("batch_update")
+        with self._lock:
+            for d in data:
+                r0, _, c0, _ = self._grid(d["range"])
+                self._write(r0, c0, d["values"])
+
+    def append_rows(self, values, **kw):
+        self._call("append_rows")
+        with self._lock:
+            start = self._last_row() + 1
+            self._write(start - 1, 0, values)
+            end = rowcol_to_a1(start + len(values) - 1, max(len(r) for r in values))
+            return {"updates": {"updatedRange": f"'{self.title}'!A{start}:{end}"}}
+
+    def append_row(self, values, **kw):
+        return self.append_rows([values], **kw)
+
+
+class FakeSpreadsheet:
+    def __init__(self, latency_ms: float = 0.0, jitter: float = 0.0):
+        self.latency_ms, self.jitter = latency_ms, jitter
+        self.sheets: dict[str, FakeWorksheet] = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        if title not in self.sheets:
+            raise gspread.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kw) -> FakeWorksheet:
+        self.sheets[title] = FakeWorksheet(title, rows, cols, self.latency_ms, self.jitter)
+        return self.sheets[title]
+
+
+class FakeClient:
+    def __init__(self, latency_ms: float = 0.0, jitter: float = 0.0):
+        self.spreadsheet = FakeSpreadsheet(latency_ms, jitter)
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        return self.spreadsheet
+
+
+def install(client: FakeClient):
+    """Подменить gspread.authorize и разбор ключа сервисного аккаунта: src.sheets подключится к client."""
+    from google.oauth2 import service_account
+    gspread.authorize = lambda *a, **kw: client
+    service_account.Credentials.from_service_account_info = staticmethod(lambda *a, **kw: object())
@@ -0,0 +1,54 @@
+# bench/fake_telegram.py
+"""
+Сессия aiogram без сети: Bot API отвечает из памяти (send_message -> Message с новым id,
+edit/delete/answer -> True), с задержкой latency_ms. Вызовы считаются по методам и в счётчик
+текущей операции (bench.fake_gspread.op_calls).
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, AsyncGenerator
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message
+
+from bench.fake_gspread import op_calls
+
+
+class FakeSession(BaseSession):
+    def __init__(self, latency_ms: float = 0.0):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.calls: Counter = Counter()
+        self.api_seconds: Counter = Counter()
+        self._ids = itertools.count(1000)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: int | None = None) -> Any:
+        name = type(method).__name__
+        t0 = time.perf_counter()
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        self.calls[name] += 1
+        self.api_seconds[name] += time.perf_counter() - t0
+        op = op_calls.get()
+        if op is not None:
+            op[f"telegram.{name}"] += 1
+
+        returning = method.__returning__
+        if returning is bool or name.startswith(("Delete", "Answer", "Set")):
+            return True
+        chat_id = getattr(method, "chat_id", None) or 0
+        return Message(message_id=next(self._ids), date=int(time.time()),
+                       chat=Chat(id=int(chat_id), type="private"),
+                       text=getattr(method, "text", None)).as_(bot)
+
+    async def stream_content(self, url: str, headers: dict | None = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
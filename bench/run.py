@@ -0,0 +1,341 @@
+# bench/run.py
+"""
+Бенчмарк хендлеров бота без сети.
+
+Поднимает настоящий Dispatcher с роутером из src.main, подменяет Google Sheets на bench.fake_gspread,
+а Bot API — на bench.fake_telegram, заполняет «Заявки» N синтетическими строками и прогоняет через
+dp.feed_update сценарии пользователей (услуга -> календарь -> время -> район -> подтверждение ->
+«Мои заявки») и админов (/agenda, ✅, /avail 30) с заданной параллельностью.
+
+Отчёт: p50/p99 латентности по операциям, вызовы Sheets/Telegram на операцию, фоновые вызовы
+(слив очереди записи), память (пиковый RSS, опционально tracemalloc).
+
+  python -m bench.run --rows 1000 --users 200 --concurrency 50
+  python -m bench.run --rows 1000,10000,100000 --api-latency-ms 80 --json bench_output.json
+
+Несколько размеров таблицы гоняются в отдельных процессах: у бота синглтоны на уровне модулей.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from bench.fake_gspread import FakeClient, install, op_calls, reset_stats
+from bench import fake_gspread
+
+ADMIN_ID = 1
+USER_BASE = 10_000
+SERVICES = ["Прогулка", "Кафе", "Кино", "Другое"]
+STATUSES = ["Новая", "Подтверждена", "Подтверждена", "Отклонена"]
+DAYS_BACK, DAYS_AHEAD = 60, 60
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _setup_env(store: str):
+    # до импорта src: Config читает окружение при импорте
+    os.environ["STORE"] = store
+    if store == "sqlite":
+        os.environ["STORE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench-"), "store.sqlite3")
+    os.environ.setdefault("BOT_TOKEN", "42:bench")
+    os.environ.setdefault("SPREADSHEET_ID", "bench")
+    os.environ.setdefault("GOOGLE_CREDS_JSON", json.dumps({"private_key": ""}))
+    os.environ.setdefault("ADMIN_IDS", str(ADMIN_ID))
+    os.environ.setdefault("FSM_STORAGE", "memory")
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))] if s else 0.0
+
+
+# --------------------- синтетическая таблица ---------------------
+
+def populate(client: FakeClient, rows: int, users: int, busy: float, rnd: random.Random) -> list[str]:
+    """
+    «Заявки» на rows строк (даты ±60 дней) и «Календарь» на те же дни, где занята доля busy слотов
+    (не зависит от rows, иначе на больших таблицах все слоты заняты и меряется только конфликт).
+    Возвращает RequestID «Новых» заявок (для ✅ админа).
+    """
+    from src.config import cfg
+    from src.sheets import HEADERS_BOOK
+
+    sh = client.spreadsheet
+    book = sh.add_worksheet(cfg.sheet_bookings, rows=rows + 1000, cols=len(HEADERS_BOOK))
+    cal = sh.add_worksheet(cfg.sheet_calendar, rows=1000, cols=1 + len(cfg.time_slots))
+    slots = cfg.time_slots
+    today = date.today()
+
+    book.data = [list(HEADERS_BOOK)]
+    pending = []
+    for i in range(rows):
+        d = (today + timedelta(days=rnd.randint(-DAYS_BACK, DAYS_AHEAD))).isoformat()
+        slot, status = rnd.choice(slots[1:]), rnd.choice(STATUSES)
+        rid, uid = f"RQ-BENCH-{i:07d}", USER_BASE + rnd.randrange(users * 2)
+        svc = rnd.choice(SERVICES)
+        book.data.append([f"{d}T09:00:00", rid, str(uid), f"user{uid}", "Bench", svc, d, d, slot,
+                          "Центр", "", status, ""])
+        if status == "Новая":
+            pending.append(rid)
+    cal.data = [["Date"] + slots]
+    for k in range(-DAYS_BACK, DAYS_AHEAD + 1):
+        d = (today + timedelta(days=k)).isoformat()
+        # «Весь день» (первая колонка) не ставим: он закрыл бы весь день
+        cal.data.append([d, ""] + [f"{rnd.choice(SERVICES)} (@bench)" if rnd.random() < busy else ""
+                                   for _ in slots[1:]])
+    return pending
+
+
+# --------------------- апдейты ---------------------
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}", "username": f"user{uid}"}
+
+
+def _msg(uid: int, text: str) -> dict:
+    return {"update_id": next(_update_ids), "message": {
+        "message_id": next(_message_ids), "date": int(time.time()),
+        "chat": {"id": uid, "type": "private"}, "from": _user(uid), "text": text}}
+
+
+def _cb(uid: int, data: str) -> dict:
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "from": _user(uid), "chat_instance": "bench", "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": uid, "type": "private"},
+                    "from": {"id": 42, "is_bot": True, "first_name": "bot"}, "text": "."}}}
+
+
+class Recorder:
+    def __init__(self, dp, bot):
+        self.dp, self.bot = dp, bot
+        self.samples: dict[str, list[float]] = defaultdict(list)
+        self.counters: dict[str, list[Counter]] = defaultdict(list)
+        self.errors: Counter = Counter()
+
+    @property
+    def calls(self) -> dict[str, Counter]:
+        # счётчики шагов суммируем в конце: фоновые задачи шага (удаление старых сообщений) досчитываются позже
+        return {op: sum(cs, Counter()) for op, cs in self.counters.items()}
+
+    async def step(self, op: str, update: dict):
+        from aiogram.types import Update
+        upd = Update.model_validate(update, context={"bot": self.bot})
+        counter: Counter = Counter()
+        self.counters[op].append(counter)
+        token = op_calls.set(counter)
+        t0 = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, upd)
+        except Exception as e:
+            self.errors[f"{op}: {type(e).__name__}: {e}"] += 1
+        finally:
+            self.samples[op].append(time.perf_counter() - t0)
+            op_calls.reset(token)
+
+
+# шаги одной записи (user_session) — для «вызовов Bot API на запись»
+FLOW_OPS = ("start", "new", "service", "cal_open", "cal_nav", "cal_pick", "time", "district", "wishes",
+            "confirm", "mine")
+
+
+async def user_session(rec: Recorder, uid: int, rnd: random.Random):
+    from src.config import cfg
+    day = date.today() + timedelta(days=rnd.randint(1, 28))
+    nxt = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    await rec.step("start", _msg(uid, "/start"))
+    await rec.step("new", _cb(uid, "new"))
+    await rec.step("service", _cb(uid, f"svc:{rnd.choice(SERVICES)}"))
+    await rec.step("cal_open", _cb(uid, "date:Выбрать дату"))
+    await rec.step("cal_nav", _cb(uid, f"cal:nav:{nxt.year}-{nxt.month}"))
+    await rec.step("cal_pick", _cb(uid, f"cal:pick:{day.isoformat()}"))
+    await rec.step("time", _cb(uid, f"time:{rnd.choice(cfg.time_slots[1:])}"))
+    await rec.step("district", _msg(uid, "Центр"))
+    await rec.step("wishes", _msg(uid, "нет"))
+    await rec.step("confirm", _cb(uid, "confirm"))
+    await rec.step("mine", _cb(uid, "mine"))
+
+
+async def admin_session(rec: Recorder, pending: list[str], rnd: random.Random):
+    await rec.step("agenda", _msg(ADMIN_ID, "/agenda"))
+    await rec.step("avail_grid", _msg(ADMIN_ID, "/avail 30"))
+    if pending:
+        await rec.step("admin_ok", _cb(ADMIN_ID, f"adm:ok:{pending.pop(rnd.randrange(len(pending)))}"))
+
+
+# --------------------- прогон ---------------------
+
+async def run_bench(args) -> dict:
+    _setup_env(args.store)
+    client = FakeClient(latency_ms=args.api_latency_ms, jitter=args.jitter)
+    install(client)
+
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+    import src.main as app
+    from src.config import cfg
+    from src.fsm_storage import build_storage
+    from src.sheets import asheets, sheets
+    from bench.fake_telegram import FakeSession
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rnd = random.Random(args.seed)
+    t0 = time.perf_counter()
+    pending = populate(client, args.rows, args.users, args.busy, rnd)
+    populate_s = time.perf_counter() - t0
+
+    session = FakeSession(latency_ms=args.tg_latency_ms)
+    bot = Bot(cfg.bot_token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    if args.tg_limits:
+        from src.tg_outbox import outbox
+        bot.session.middleware(outbox)
+    dp = Dispatcher(storage=build_storage())
+    dp.include_router(app.router)
+    rec = Recorder(dp, bot)
+
+    if args.trace_mem:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    await asheets.run(sheets.warmup, timeout=600)
+    warmup_s = time.perf_counter() - t0
+    reset_stats()
+
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int):
+        async with sem:
+            if args.admin_every and i % args.admin_every == 0:
+                await admin_session(rec, pending, rnd)
+            else:
+                await user_session(rec, USER_BASE + i, rnd)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.users)))
+    wall_s = time.perf_counter() - t0
+    await asyncio.gather(*list(app._background))  # фоновые удаления сообщений
+    await asheets.run(sheets.stop, timeout=600)
+
+    calls = rec.calls
+    op_sheets = sum(n for c in calls.values() for k, n in c.items() if k.startswith("sheets."))
+    ops = {}
+    for op, samples in rec.samples.items():
+        c = calls[op]
+        ops[op] = {
+            "n": len(samples),
+            "p50_ms": round(_percentile(samples, 0.5) * 1000, 2),
+            "p99_ms": round(_percentile(samples, 0.99) * 1000, 2),
+            "sheets_per_op": round(sum(v for k, v in c.items() if k.startswith("sheets.")) / len(samples), 2),
+            "telegram_per_op": round(sum(v for k, v in c.items() if k.startswith("telegram.")) / len(samples), 2),
+            "calls": dict(c),
+        }
+    result = {
+        "rows": args.rows, "store": args.store, "users": args.users, "concurrency": args.concurrency,
+        "busy": args.busy, "api_latency_ms": args.api_latency_ms, "tg_latency_ms": args.tg_latency_ms,
+        "populate_s": round(populate_s, 3), "warmup_s": round(warmup_s, 3), "wall_s": round(wall_s, 3),
+        "updates_per_s": round(sum(len(s) for s in rec.samples.values()) / wall_s, 1) if wall_s else 0,
+        "ops": ops,
+        "telegram_per_flow": round(sum(ops[op]["telegram_per_op"] for op in FLOW_OPS if op in ops), 2),
+        "sheets_calls": dict(fake_gspread.calls),
+        "sheets_ms": {k: round(v * 1000, 1) for k, v in fake_gspread.api_seconds.items()},
+        "background_sheets_calls": sum(fake_gspread.calls.values()) - op_sheets,
+        "telegram_calls": dict(session.calls),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "errors": dict(rec.errors),
+    }
+    if args.trace_mem:
+        result["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        tracemalloc.stop()
+    await bot.session.close()
+    asheets.shutdown()
+    return result
+
+
+def render(r: dict) -> str:
+    lines = [
+        f"rows={r['rows']} store={r.get('store', 'sheets')} users={r['users']} concurrency={r['concurrency']} "
+        f"api={r['api_latency_ms']}ms tg={r['tg_latency_ms']}ms",
+        f"populate {r['populate_s']}s, warmup {r['warmup_s']}s, run {r['wall_s']}s ({r['updates_per_s']} updates/s)",
+        f"{'op':<12}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'sheets/op':>11}{'tg/op':>8}",
+    ]
+    for op, o in r["ops"].items():
+        lines.append(f"{op:<12}{o['n']:>6}{o['p50_ms']:>10}{o['p99_ms']:>10}{o['sheets_per_op']:>11}{o['telegram_per_op']:>8}")
+    lines.append("sheets calls: " + ", ".join(f"{k}={v} ({r['sheets_ms'].get(k, 0)}ms)"
+                                              for k, v in sorted(r["sheets_calls"].items())))
+    lines.append(f"telegram calls per booking flow: {r.get('telegram_per_flow')}")
+    lines.append(f"background sheets calls (write queue / replication): {r['background_sheets_calls']}")
+    mem = f"memory: max RSS {r['max_rss_mb']} MB"
+    if "tracemalloc_peak_mb" in r:
+        mem += f", tracemalloc peak {r['tracemalloc_peak_mb']} MB"
+    lines.append(mem)
+    for err, n in r["errors"].items():
+        lines.append(f"ERROR x{n}: {err}")
+    return "\n".join(lines)
+
+
+def _parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Офлайн-бенчмарк хендлеров бота (фейковые Sheets и Bot API)")
+    p.add_argument("--rows", default="1000", help="строк в «Заявках»; через запятую — несколько прогонов")
+    p.add_argument("--users", type=int, default=200, help="сколько сессий прогнать")
+    p.add_argument("--concurrency", type=int, default=20, help="сколько сессий одновременно")
+    p.add_argument("--busy", type=float, default=0.3, help="доля занятых слотов в «Календаре»")
+    p.add_argument("--admin-every", type=int, default=10, help="каждая N-я сессия — админская (0 — без админов)")
+    p.add_argument("--api-latency-ms", type=float, default=0.0, help="задержка одного вызова Sheets")
+    p.add_argument("--jitter", type=float, default=0.2, help="разброс задержки Sheets, доля")
+    p.add_argument("--tg-latency-ms", type=float, default=0.0, help="задержка одного вызова Bot API")
+    p.add_argument("--store", choices=["sheets", "sqlite"], default="sheets", help="хранилище заявок (STORE)")
+    p.add_argument("--tg-limits", action="store_true",
+                   help="пропускать Bot API через лимиты Telegram (src/tg_outbox.py); сессии кликают без пауз")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--trace-mem", action="store_true", help="пик памяти через tracemalloc (медленнее)")
+    p.add_argument("--json", help="записать результаты в файл")
+    p.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    sizes = [s.strip() for s in args.rows.split(",") if s.strip()]
+    if args.child or len(sizes) == 1:
+        args.rows = int(sizes[0])
+        result = asyncio.run(run_bench(args))
+        if args.child:
+            print(json.dumps(result, ensure_ascii=False))
+            return
+        results = [result]
+        print(render(result))
+    else:
+        results = []
+        for size in sizes:
+            # каждый размер — в своём процессе, с теми же настройками
+            child = [sys.executable, "-m", "bench.run", "--rows", size, "--child",
+                     "--users", str(args.users), "--concurrency", str(args.concurrency),
+                     "--busy", str(args.busy), "--admin-every", str(args.admin_every),
+                     "--api-latency-ms", str(args.api_latency_ms), "--jitter", str(args.jitter),
+                     "--tg-latency-ms", str(args.tg_latency_ms), "--seed", str(args.seed), "--store", args.store]
+            if args.trace_mem:
+                child.append("--trace-mem")
+            if args.tg_limits:
+                child.append("--tg-limits")
+            out = subprocess.run(child, capture_output=True, text=True, check=True)
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            print(render(results[-1]), end="\n\n", flush=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 # src/calendar_kb.py
+import asyncio
+import logging
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import date
 from calendar import monthrange
 
 # берём данные из таблицы, чтобы подсветить занятые дни
-from src.sheets import sheets
+from src.config import cfg
+from src.sheets import sheets, asheets
+from src.ratelimit import background
+
+log = logging.getLogger("qwesade.bot")
 
 RU_MONTHS = ["Янв","Фев","Мар","Апр","Май","Июн","Июл","Авг","Сен","Окт","Ноя","Дек"]
 
@@ -17,28 +23,36 @@ def _next_month(y: int, m: int) -> tuple[int, int]:
     return (y + 1, 1) if m == 12 else (y, m + 1)
 
 
-def _busy_days_for_month(y: int, m: int) -> set[int]:
-    """
-    Собираем дни месяца, где уже есть заявки (Новая/Подтверждена/Ожидает связи).
-    Если хочешь подсвечивать только подтверждённые — оставь лишь 'Подтверждена'.
-    """
-    month_prefix = f"{y:04d}-{m:02d}"
-    busy: set[int] = set()
-    for r in sheets.ws_book.get_all_records():
-        iso = str(r.get("DateISO") or "")
-        if not iso.startswith(month_prefix):
-            continue
-        status = str(r.get("Status") or "").strip()
-        if status not in {"Новая", "Подтверждена", "Ожидает связи"}:
-            continue
+# какие заявки делают день «занятым» (хочешь только подтверждённые — оставь лишь 'Подтверждена')
+BUSY_STATUSES = frozenset({"Новая", "Подтверждена", "Ожидает связи"})
+
+# ссылки на фоновые подгрузки, чтобы задачи не собрал GC
+_prefetching: set[asyncio.Task] = set()
+
+
+async def _busy_days_for_month(y: int, m: int) -> set[int]:
+    """Дни месяца, где уже есть заявки (кэшируется в sheets, см. booked_days_for_month)."""
+    return await asheets.booked_days_for_month(y, m, BUSY_STATUSES)
+
+
+def _prefetch_month(y: int, m: int):
+    """Фоном прогреть кэш соседнего месяца, чтобы «/» рендерились без похода в таблицу."""
+    if not cfg.calendar_prefetch or sheets.month_cached(y, m, BUSY_STATUSES):
+        return
+
+    async def run():
         try:
-            busy.add(int(iso[8:10]))
-        except Exception:
-            pass
-    return busy
+            with background():
+                await _busy_days_for_month(y, m)
+        except Exception as e:
+            log.debug("Calendar prefetch %04d-%02d failed: %s", y, m, e)
+
+    task = asyncio.create_task(run())
+    _prefetching.add(task)
+    task.add_done_callback(_prefetching.discard)
 
 
-def build_month_kb(year: int, month: int) -> InlineKeyboardBuilder:
+async def build_month_kb(year: int, month: int) -> InlineKeyboardBuilder:
     """
     Компактный календарь:
       ┌ ‹  Авг 2025  › ┐
@@ -61,7 +75,7 @@ def build_month_kb(year: int, month: int) -> InlineKeyboardBuilder:
 
     # сетка дат: просто 1..N, без «дней недели»
     days = monthrange(year, month)[1]
-    busy = _busy_days_for_month(year, month)
+    busy = await _busy_days_for_month(year, month)
 
     for d in range(1, days + 1):
         text = f"{d}•" if d in busy else str(d)
@@ -78,4 +92,6 @@ def build_month_kb(year: int, month: int) -> InlineKeyboardBuilder:
     layout = [3] + [7] * rows_for_days + [2]
     kb.adjust(*layout)
 
+    _prefetch_month(py, pm)
+    _prefetch_month(ny, nm)
     return kb
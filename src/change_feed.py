@@ -0,0 +1,127 @@
+# src/change_feed.py
+"""
+Лента ручных правок таблицы (её ведёт Apps Script, см. apps_script/calendar_sync_and_render.gs).
+
+onEdit на «Заявках»/«Календаре» дописывает в скрытый лист «Правки» строку
+[Seq, Sheet, FromRow, ToRow, At]; структурные правки (вставка/удаление строк, колонок, листов)
+ловит onChange и пишет Sheet='*'. Правки самого бота через API триггеров не вызывают.
+
+Читатель держит курсор (seq последней прочитанной записи, её строка в логе) и дочитывает
+лог с этой строки — обычно это одно чтение из пары ячеек. Дальше fetch() забирает только
+изменённые строки листов одним batch_get на лист. Когда догнать нельзя (лог подрезали дальше
+курсора, была структурная правка, правок слишком много), read() возвращает None — читатель
+перечитывает листы целиком.
+
+Если листа «Правки» нет (скрипт не установлен) — available=False, и всё работает по-старому (CACHE_TTL).
+"""
+from __future__ import annotations
+import logging
+import threading
+from typing import Dict, List, Set, Tuple, TYPE_CHECKING
+
+import gspread
+
+from .config import cfg
+
+if TYPE_CHECKING:
+    from .sheets import Sheets
+
+log = logging.getLogger("qwesade.sheets")
+
+MAX_ROWS = 500  # больше изменённых строк за раз — дешевле перечитать листы целиком
+
+Cursor = Tuple[int, int]               # (seq, строка в логе)
+Changes = Dict[str, Set[int]]          # лист -> номера изменённых строк
+
+
+def _int(v) -> int:
+    try:
+        return int(str(v).strip())
+    except ValueError:
+        return 0
+
+
+def _spans(rows: List[int]) -> List[Tuple[int, int]]:
+    """[2, 3, 4, 9] -> [(2, 4), (9, 9)]"""
+    spans: List[Tuple[int, int]] = []
+    for r in sorted(rows):
+        if spans and r == spans[-1][1] + 1:
+            spans[-1] = (spans[-1][0], r)
+        else:
+            spans.append((r, r))
+    return spans
+
+
+class ChangeFeed:
+    def __init__(self, sheets: "Sheets"):
+        self._sheets = sheets
+        self._ws = None
+        self._lock = threading.Lock()
+        self.available = False
+
+    def _log_ws(self):
+        with self._lock:
+            if self._ws is None:
+                try:
+                    self._ws = self._sheets.sh.worksheet(cfg.sheet_changes)
+                    self.available = True
+                except gspread.WorksheetNotFound:
+                    log.info("Change feed off: no «%s» sheet (install the Apps Script feed)", cfg.sheet_changes)
+            return self._ws
+
+    def _entries(self, start_row: int) -> List[tuple]:
+        vals = self._ws.get_values(f"A{start_row}:D")
+        return [(_int(v[0]), v[1] if len(v) > 1 else "", _int(v[2]) if len(v) > 2 else 0,
+                 _int(v[3]) if len(v) > 3 else 0, start_row + i) for i, v in enumerate(vals) if v and v[0]]
+
+    def head(self) -> Cursor | None:
+        """Курсор на конец лога (None — ленты нет). Берём до полного чтения листов: правки во время чтения не потеряются."""
+        if not self._log_ws():
+            return None
+        entries = self._entries(2)
+        return (entries[-1][0], entries[-1][4]) if entries else (0, 1)
+
+    def read(self, cursor: Cursor) -> tuple[Cursor, Changes | None]:
+        """Новые записи после cursor: (новый курсор, {лист: строки}) или (курсор, None) — надо перечитать всё."""
+        seq, row = cursor
+        entries = self._entries(max(row, 2))
+        if row >= 2 and (not entries or entries[0][0] != seq):
+            # лог подрезали сверху — ищем своё место во всём логе
+            entries = self._entries(2)
+        entries = [e for e in entries if e[0] > seq]
+        if not entries:
+            return cursor, {}
+        new_cursor = (entries[-1][0], entries[-1][4])
+        if entries[0][0] > seq + 1:
+            return new_cursor, None  # часть записей уже подрезана — не догнать
+        changes: Changes = {}
+        for _, sheet, a, b, _ in entries:
+            if sheet == "*":
+                return new_cursor, None
+            if a > 0:
+                changes.setdefault(sheet, set()).update(range(a, max(a, b) + 1))
+        if sum(len(r) for r in changes.values()) > MAX_ROWS:
+            return new_cursor, None
+        return new_cursor, changes
+
+    def fetch(self, changes: Changes) -> tuple[Dict[int, List[str]], List[str] | None, Dict[int, List[str]]]:
+        """
+        Изменённые строки: («Заявки» row -> значения, шапка «Календаря» или None, «Календарь» row -> значения).
+        Строка, которую очистили, приходит пустым списком.
+        """
+        out = []
+        for ws, header in ((self._sheets.ws_book, False), (self._sheets.ws_cal, True)):
+            rows = sorted(r for r in changes.get(ws.title, ()) if r > 1)
+            if not rows and not (header and changes.get(ws.title)):
+                out.append((None, {}))
+                continue
+            spans = _spans(rows)
+            got = ws.batch_get((["1:1"] if header else []) + [f"{a}:{b}" for a, b in spans])
+            head = (list(got[0][0]) if got[0] else []) if header else None
+            vals: Dict[int, List[str]] = {}
+            for (a, b), block in zip(spans, got[1:] if header else got):
+                for r in range(a, b + 1):
+                    vals[r] = list(block[r - a]) if r - a < len(block) else []
+            out.append((head, vals))
+        (_, book), (cal_headers, cal) = out
+        return book, cal_headers, cal
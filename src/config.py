@@ -33,26 +33,83 @@ class Config:
     google_creds_json: str = os.getenv("GOOGLE_CREDS_JSON", "")
     google_creds_path: str = os.getenv("GOOGLE_CREDS_JSON_PATH", "")
 
+    # пул потоков для вызовов Google Sheets (gspread синхронный) и таймаут одного вызова, сек
+    sheets_workers: int = int(os.getenv("SHEETS_WORKERS", "4") or "4")
+    sheets_timeout: float = float(os.getenv("SHEETS_TIMEOUT", "20") or "20")
+    # квоты Google Sheets API (запросов в минуту) и число повторов на 429/5xx, см. src/ratelimit.py
+    sheets_read_per_min: float = float(os.getenv("SHEETS_READ_PER_MIN", "60") or "60")
+    sheets_write_per_min: float = float(os.getenv("SHEETS_WRITE_PER_MIN", "60") or "60")
+    sheets_retries: int = int(os.getenv("SHEETS_RETRIES", "5") or "5")
+    # сколько секунд доверяем локальным индексам листов, потом перечитываем (ручные правки админа)
+    cache_ttl: float = float(os.getenv("CACHE_TTL", "300") or "300")
+    # лента ручных правок от Apps Script (лист SHEET_CHANGES, см. src/change_feed.py): опрос раз в N сек
+    # (0 — выключить); пока она читается, индексы целиком перечитываются не чаще раза в CHANGES_RESYNC_S
+    sheet_changes: str = os.getenv("SHEET_CHANGES", "Правки")
+    changes_poll_s: float = float(os.getenv("CHANGES_POLL_S", "5") or "5")
+    changes_resync_s: float = float(os.getenv("CHANGES_RESYNC_S", "3600") or "3600")
+    # write-behind для «Заявок»: сливать раз в N мс или по M накопленным операциям (0 мс — писать сразу)
+    write_flush_ms: int = int(os.getenv("WRITE_FLUSH_MS", "500") or "500")
+    write_batch_max: int = int(os.getenv("WRITE_BATCH_MAX", "50") or "50")
+    # календарик: сколько месяцев держать в кэше и подгружать ли соседние месяцы фоном
+    month_cache_size: int = int(os.getenv("MONTH_CACHE_SIZE", "24") or "24")
+    calendar_prefetch: bool = os.getenv("CALENDAR_PREFETCH", "1") not in {"0", "false", "no", ""}
+    # сколько последних заявок на пользователя держать в памяти для «📋 Мои заявки»
+    user_recent_max: int = int(os.getenv("USER_RECENT_MAX", "10") or "10")
+    # подсказки при занятом слоте: сколько дней вперёд смотреть, сколько кнопок, рабочие часы и шаг, мин
+    suggest_days: int = int(os.getenv("SUGGEST_DAYS", "7") or "7")
+    suggest_limit: int = int(os.getenv("SUGGEST_LIMIT", "6") or "6")
+    suggest_hours: str = os.getenv("SUGGEST_HOURS", "09:00–22:00")
+    suggest_step: int = int(os.getenv("SUGGEST_STEP", "30") or "30")
+
+    # исходящие в Telegram (см. src/tg_outbox.py): сообщений в секунду на бота и на чат (+запас подряд),
+    # сколько раз повторять после flood control и сколько максимум ждать retry_after, сек
+    tg_global_per_s: float = float(os.getenv("TG_GLOBAL_PER_S", "30") or "30")
+    tg_chat_per_s: float = float(os.getenv("TG_CHAT_PER_S", "1") or "1")
+    tg_chat_burst: float = float(os.getenv("TG_CHAT_BURST", "5") or "5")
+    tg_retries: int = int(os.getenv("TG_RETRIES", "3") or "3")
+    tg_max_wait_s: float = float(os.getenv("TG_MAX_WAIT_S", "60") or "60")
+
+    # GET /metrics (Prometheus) на вебхук-сервере; если задан токен — только с ?token=... или Bearer
+    metrics_token: str = os.getenv("METRICS_TOKEN", "")
+
+    # хранилище заявок: sheets — прямо в таблицу; sqlite — локальная база + зеркалирование в таблицу
+    # (см. src/local_store.py): отправка изменений раз в STORE_PUSH_MS мс, забор ручных правок раз в STORE_PULL_S сек
+    store: str = (os.getenv("STORE", "sheets") or "sheets").lower()
+    store_path: str = os.getenv("STORE_PATH", "store.sqlite3") or "store.sqlite3"
+    store_push_ms: int = int(os.getenv("STORE_PUSH_MS", "500") or "500")
+    store_pull_s: float = float(os.getenv("STORE_PULL_S", "60") or "60")
+
+    # хранилище FSM: memory | sqlite | redis (см. src/fsm_storage.py); брошенный диалог живёт FSM_TTL сек
+    fsm_storage: str = os.getenv("FSM_STORAGE", "memory").strip().lower()
+    fsm_sqlite_path: str = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+    fsm_ttl: float = float(os.getenv("FSM_TTL", "86400") or "86400")
+    redis_url: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    # межпроцессная блокировка даты при подтверждении заявки: "" (только внутри процесса) | redis
+    slot_lease: str = os.getenv("SLOT_LEASE", "").strip().lower()
+
     @property
     def time_slots(self):
         return [s.strip() for s in self.time_slots_env.split(",") if s.strip()]
 
-cfg = Config()
+    def validate(self):
+        """Подгрузить ключ из файла (если задан путём) и проверить обязательные настройки.
+        Не на импорте: модули должны импортироваться офлайн (тесты, быстрый старт)."""
+        # ---- загрузка ключа из файла, если нужно ----
+        raw = self.google_creds_json.strip()
+        if not raw and self.google_creds_path:
+            self.google_creds_json = Path(self.google_creds_path).read_text(encoding="utf-8")
+        elif raw.startswith("@"):
+            self.google_creds_json = Path(raw[1:]).read_text(encoding="utf-8")
+
+        # ---- валидация ----
+        assert self.bot_token, "BOT_TOKEN is required in .env"
+        assert self.spreadsheet_id, "SPREADSHEET_ID is required in .env"
+        assert self.google_creds_json, "GOOGLE_CREDS_JSON* обязательно (см. README)"
 
-# ---- загрузка ключа из файла, если нужно ----
-raw = cfg.google_creds_json.strip()
-if not raw and cfg.google_creds_path:
-    cfg.google_creds_json = Path(cfg.google_creds_path).read_text(encoding="utf-8")
-elif raw.startswith("@"):
-    path = raw[1:]
-    cfg.google_creds_json = Path(path).read_text(encoding="utf-8")
-
-# ---- валидация ----
-assert cfg.bot_token, "BOT_TOKEN is required in .env"
-assert cfg.spreadsheet_id, "SPREADSHEET_ID is required in .env"
-assert cfg.google_creds_json, "GOOGLE_CREDS_JSON* обязательно (см. README)"
-
-try:
-    json.loads(cfg.google_creds_json)
-except Exception as e:
-    raise AssertionError(f"GOOGLE_CREDS_JSON не парсится как JSON: {e}")
+        try:
+            json.loads(self.google_creds_json)
+        except Exception as e:
+            raise AssertionError(f"GOOGLE_CREDS_JSON не парсится как JSON: {e}")
+        return self
+
+cfg = Config()
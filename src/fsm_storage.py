@@ -0,0 +1,164 @@
+# src/fsm_storage.py
+"""
+Хранилище FSM (шаг диалога + data: step_msg_id, reply_msg_id, выбранные услуга/дата/...).
+
+По умолчанию aiogram держит всё в памяти процесса — рестарт на Render теряет недозаполненные
+заявки, а второй инстанс за вебхуком не видит чужие диалоги. Выбор через FSM_STORAGE:
+  memory — как раньше;
+  sqlite — файл FSM_SQLITE_PATH, переживает рестарт (один хост, несколько воркеров — через WAL);
+  redis  — REDIS_URL (Redis/Valkey/KeyDB), для нескольких инстансов.
+Брошенные диалоги живут FSM_TTL секунд с последнего изменения.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from src.config import cfg
+
+PURGE_EVERY = 500  # раз в столько записей чистим протухшие строки
+
+
+def dumps(data: Mapping[str, Any]) -> str:
+    """Компактный JSON: без пробелов, кириллица как есть, None не храним (пустая строка — ответ, её храним)."""
+    return json.dumps({k: v for k, v in data.items() if v is not None},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+def _state_str(state: StateType) -> str | None:
+    return state.state if isinstance(state, State) else state
+
+
+def _key(key: StorageKey) -> str:
+    parts = [key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny]
+    return ":".join("" if p is None else str(p) for p in parts)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM в SQLite: одна строка на (бот, чат, юзер); sqlite3 синхронный — ходим в него через поток."""
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', expires REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(*args)
+        return asyncio.to_thread(locked)
+
+    # --------------------- sync part (под локом) ---------------------
+
+    def _load(self, k: str) -> tuple[str | None, dict]:
+        row = self._db.execute("SELECT state, data FROM fsm WHERE key=? AND expires>?", (k, time.time())).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, {})
+
+    def _save(self, k: str, state: str | None, data: Mapping[str, Any]):
+        if state is None and not data:
+            self._db.execute("DELETE FROM fsm WHERE key=?", (k,))
+        else:
+            self._db.execute(
+                "INSERT INTO fsm (key, state, data, expires) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data, expires=excluded.expires",
+                (k, state, dumps(data), time.time() + self.ttl),
+            )
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self._db.execute("DELETE FROM fsm WHERE expires<=?", (time.time(),))
+
+    def _set_state(self, k: str, state: str | None):
+        _, data = self._load(k)
+        self._save(k, state, data)
+
+    def _set_data(self, k: str, data: Mapping[str, Any]):
+        state, _ = self._load(k)
+        self._save(k, state, data)
+
+    def _update_data(self, k: str, patch: Mapping[str, Any]) -> dict:
+        state, data = self._load(k)
+        data.update(patch)
+        self._save(k, state, data)
+        return data
+
+    def _set_state_data(self, k: str, state: str | None, data: Mapping[str, Any], replace: bool):
+        if not replace:
+            data = {**self._load(k)[1], **data}
+        self._save(k, state, data)
+
+    # --------------------- BaseStorage ---------------------
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._run(self._set_state, _key(key), _state_str(state))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._run(self._load, _key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._run(self._set_data, _key(key), dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._run(self._load, _key(key)))[1]
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> dict[str, Any]:
+        # чтение и запись одним заходом в БД, а не get_data + set_data
+        return await self._run(self._update_data, _key(key), dict(data))
+
+    async def get_state_data(self, key: StorageKey) -> tuple[str | None, dict[str, Any]]:
+        return await self._run(self._load, _key(key))
+
+    async def set_state_data(self, key: StorageKey, state: StateType, data: Mapping[str, Any],
+                             replace: bool = False) -> None:
+        # шаг и data одним заходом в БД; replace=False — data дописываются к сохранённым, как update_data
+        await self._run(self._set_state_data, _key(key), _state_str(state), dict(data), replace)
+
+    async def close(self) -> None:
+        await self._run(self._db.close)
+
+
+async def load(ctx: FSMContext) -> tuple[str | None, dict[str, Any]]:
+    """Прочитать шаг и data разом: SQLite — одним SELECT, остальные хранилища — get_state + get_data."""
+    if isinstance(ctx.storage, SQLiteStorage):
+        return await ctx.storage.get_state_data(ctx.key)
+    return await ctx.get_state(), await ctx.get_data()
+
+
+async def save(ctx: FSMContext, state: StateType, data: Mapping[str, Any], replace: bool = False) -> None:
+    """
+    Записать шаг и data разом: SQLite — одной записью, остальные хранилища — set_state + update_data.
+    По умолчанию data — только изменённые поля (чужие параллельные правки не затираются);
+    replace=True — data заменяются целиком (сброс заявки).
+    """
+    if isinstance(ctx.storage, SQLiteStorage):
+        return await ctx.storage.set_state_data(ctx.key, state, data, replace)
+    await ctx.set_state(state)
+    await (ctx.set_data(data) if replace else ctx.update_data(data))
+
+
+def build_storage() -> BaseStorage:
+    kind = cfg.fsm_storage
+    if kind == "sqlite":
+        return SQLiteStorage(cfg.fsm_sqlite_path, ttl=cfg.fsm_ttl)
+    if kind == "redis":
+        # опциональная зависимость: pip install redis
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(cfg.redis_url, state_ttl=int(cfg.fsm_ttl), data_ttl=int(cfg.fsm_ttl),
+                                     json_dumps=dumps)
+    if kind != "memory":
+        raise RuntimeError(f"FSM_STORAGE={kind!r}: ожидается memory, sqlite или redis")
+    return MemoryStorage()
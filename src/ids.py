@@ -0,0 +1,70 @@
+# src/ids.py
+"""
+Генератор RequestID: RQ-<ГГГГММДДччммсс>-<мс><инстанс><счётчик>, напр. RQ-20261017155415-1230k7p0a.
+
+- время в UTC: перевод часов (летнее/зимнее время) не откатывает и не повторяет метку,
+  порядок не зависит от пояса сервера (старые RQ-<ГГГГММДДччммсс> — в местном времени);
+- упорядочен по времени (лексикографически сортируется);
+- монотонный: время не откатывается назад, внутри одной миллисекунды растёт счётчик
+  (36² = 1296 id/мс на инстанс, дальше ждём следующую мс);
+- инстанс — 4 символа base36 из INSTANCE_ID (или RENDER_INSTANCE_ID / hostname+pid): числовой
+  INSTANCE_ID < 36⁴ даёт гарантированно разные теги, хэш имени — совпадение у пары инстансов
+  с вероятностью 1/36⁴ (≈1/1.7 млн), так что несколько ботов за вебхуком не пересекаются;
+- короткий: с префиксом кнопок админа «adm:ok:» / «adm:no:» (main.admin_kb) — 34 байта,
+  укладывается в 64 байта callback_data.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+_B36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+SEQ_MAX = 36 ** 2
+TAG_WIDTH = 4
+
+
+def _b36(n: int, width: int) -> str:
+    out = ""
+    for _ in range(width):
+        n, r = divmod(n, 36)
+        out = _B36[r] + out
+    return out
+
+
+def _instance_tag() -> str:
+    raw = os.getenv("INSTANCE_ID") or os.getenv("RENDER_INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+    if raw.isdigit():
+        return _b36(int(raw) % 36 ** TAG_WIDTH, TAG_WIDTH)
+    digest = hashlib.blake2b(raw.encode(), digest_size=8).digest()
+    return _b36(int.from_bytes(digest, "big") % 36 ** TAG_WIDTH, TAG_WIDTH)
+
+
+class RequestIdGenerator:
+    def __init__(self, prefix: str = "RQ", instance: str | None = None):
+        self.prefix = prefix
+        self.instance = instance or _instance_tag()
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._seq = 0
+
+    def next(self) -> str:
+        with self._lock:
+            now_ms = max(int(time.time() * 1000), self._last_ms)
+            if now_ms == self._last_ms:
+                self._seq += 1
+                if self._seq >= SEQ_MAX:
+                    # счётчик миллисекунды исчерпан — «занимаем» следующую
+                    now_ms += 1
+                    self._seq = 0
+            else:
+                self._seq = 0
+            self._last_ms = now_ms
+            sec, ms = divmod(now_ms, 1000)
+            stamp = datetime.fromtimestamp(sec, timezone.utc).strftime("%Y%m%d%H%M%S")
+            return f"{self.prefix}-{stamp}-{ms:03d}{self.instance}{_b36(self._seq, 2)}"
+
+
+request_ids = RequestIdGenerator()
@@ -1,3 +1,4 @@
+from datetime import date
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
@@ -66,6 +67,29 @@ def kb_confirm():
     kb.adjust(2)
     return kb
 
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+def kb_suggestions(items: list[tuple[str, str]]):
+    """Кнопки «ближайшее свободное»: [(date_iso, slot)] -> «Пн 20.10 · 10:00–12:00»."""
+    kb = InlineKeyboardBuilder()
+    for iso, slot in items:
+        d = date.fromisoformat(iso)
+        kb.button(text=f"{WEEKDAYS[d.weekday()]} {d:%d.%m} · {slot}", callback_data=f"sug:{iso}:{slot}")
+    kb.button(text="✏️ Исправить", callback_data="edit")
+    kb.adjust(1)
+    return kb
+
+def kb_agenda_pages(page: int, pages: int, days: int) -> InlineKeyboardMarkup | None:
+    if pages <= 1:
+        return None
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="‹", callback_data=f"agenda:{page - 1}:{days}"))
+    row.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data="noop"))
+    if page + 1 < pages:
+        row.append(InlineKeyboardButton(text="›", callback_data=f"agenda:{page + 1}:{days}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
 def admin_booking_kb(request_id: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [
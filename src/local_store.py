@@ -0,0 +1,498 @@
+# src/local_store.py
+"""
+SQLite как основное хранилище заявок и слотов, Google Sheets — зеркало для людей (STORE=sqlite).
+
+LocalStore повторяет методы Sheets, которыми пользуется бот (mark_slot, append_booking, set_status,
+user_recent, agenda, booked_days_for_month, ...), но отвечает из локальной базы:
+  bookings — строки «Заявок»; индексы по TelegramID, DateISO, Status;
+  slots    — занятые ячейки «Календаря», UNIQUE(date_iso, slot): один слот не займут дважды
+             даже мимо проверки пересечений.
+Изменения помечаются dirty; фоновый поток-репликатор раз в STORE_PUSH_MS отправляет их в таблицу
+через обычный Sheets (write-behind очередь «Заявок», пакетная запись дня в «Календаре»;
+dirty снимается, только когда запись в таблицу подтверждена),
+а ручные правки админа забирает из таблицы — для строк без неотправленных локальных изменений:
+по ленте правок (src/change_feed.py) раз в CHANGES_POLL_S только изменённые строки, курсор ленты
+хранится в meta и переживает рестарт; без ленты — целиком раз в STORE_PULL_S.
+Удалённые руками строки «Заявок» из базы не удаляются.
+
+При первом старте с пустой базой всё содержимое таблицы импортируется.
+"""
+from __future__ import annotations
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+from .config import cfg
+from .occupancy import DayOccupancy
+from .ratelimit import background
+from .sheets import HEADERS_BOOK, Sheets, _agenda_dt, _day_availability, rank_suggestions, suggest_dates
+from .write_queue import WriteOp
+
+log = logging.getLogger("qwesade.store")
+
+# колонка «Заявок» -> колонка таблицы bookings
+COLS = dict(zip(HEADERS_BOOK, [
+    "timestamp", "request_id", "telegram_id", "username", "name", "service", "date_iso", "date_text",
+    "time_slot", "district", "wishes", "status", "admin_comment",
+]))
+# какие поля меняет set_status (их и отправляем в таблицу точечно)
+MUTABLE = {"Status": "status", "AdminComment": "admin_comment", "DateISO": "date_iso", "TimeSlot": "time_slot"}
+MUTABLE_H = {c: h for h, c in MUTABLE.items()}
+ALL_MUTABLE = ",".join(sorted(MUTABLE.values()))
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS bookings (
+    {", ".join(f"{c} TEXT NOT NULL DEFAULT ''" for c in COLS.values() if c != "request_id")},
+    request_id TEXT PRIMARY KEY,
+    in_sheet INTEGER NOT NULL DEFAULT 0,   -- строка уже есть в «Заявках»
+    dirty TEXT NOT NULL DEFAULT '',        -- неотправленные поля через запятую, '*' — вся строка
+    rev INTEGER NOT NULL DEFAULT 0         -- номер последней локальной правки
+);
+CREATE INDEX IF NOT EXISTS bookings_user ON bookings(telegram_id, timestamp);
+CREATE INDEX IF NOT EXISTS bookings_date ON bookings(date_iso);
+CREATE INDEX IF NOT EXISTS bookings_status ON bookings(status, date_iso);
+CREATE INDEX IF NOT EXISTS bookings_dirty ON bookings(dirty) WHERE dirty != '';
+
+CREATE TABLE IF NOT EXISTS slots (
+    date_iso TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    text TEXT NOT NULL DEFAULT '',         -- '' — слот освобождён, но это ещё не ушло в таблицу
+    dirty INTEGER NOT NULL DEFAULT 0,
+    rev INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (date_iso, slot)
+);
+CREATE INDEX IF NOT EXISTS slots_dirty ON slots(dirty) WHERE dirty = 1;
+
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def _row(r: sqlite3.Row) -> Dict:
+    return {h: r[c] for h, c in COLS.items()}
+
+
+class LocalStore:
+    def __init__(self, remote: Sheets, path: str, push_ms: int, pull_s: float):
+        self.remote = remote
+        self.push_interval = max(push_ms, 50) / 1000
+        self.pull_interval = pull_s
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        # одно соединение на все потоки пула — под локом; транзакции короткие
+        self._lock = threading.RLock()
+        self._rev = max(self._scalar("SELECT MAX(rev) FROM bookings") or 0,
+                        self._scalar("SELECT MAX(rev) FROM slots") or 0)
+        self._ready = threading.Event()
+        self._ready_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pulled_at = 0.0
+        self._feed_cursor = None
+        self._feed_pending = False  # курсор ленты ещё надо получить из таблицы (делает репликатор)
+        self._backlog = self._count_backlog()  # для /quota и метрик: event loop в базу не ходит
+        # отправленные, но ещё не подтверждённые очередью записи: RequestID -> (WriteOp, rev, это append)
+        self._sent: Dict[str, tuple] = {}
+        self._push_lock = threading.Lock()  # push из репликатора и из stop() не должны пересекаться
+
+    def __getattr__(self, name: str):
+        # всё, чего нет локально (writes, ws_book, invalidate_*...), — у таблицы
+        return getattr(self.remote, name)
+
+    # --------------------- db helpers ---------------------
+
+    def _scalar(self, sql: str, *args):
+        row = self._db.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    @contextmanager
+    def _tx(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _meta(self, key: str) -> str | None:
+        with self._lock:
+            return self._scalar("SELECT value FROM meta WHERE key=?", key)
+
+    def _meta_set(self, key: str, value: str):
+        with self._tx() as db:
+            db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def _next_rev(self) -> int:
+        self._rev += 1
+        return self._rev
+
+    # --------------------- lifecycle ---------------------
+
+    def warmup(self):
+        """Подключиться к таблице, при пустой базе — импортировать её, запустить репликатор."""
+        t0 = time.monotonic()
+        self._ensure_ready()
+        log.info("Store warmup %.2fs", time.monotonic() - t0)
+
+    def _ensure_ready(self):
+        if self._ready.is_set():
+            return
+        with self._ready_lock:
+            if self._ready.is_set():
+                return
+            stored = self._meta("feed_cursor") if cfg.changes_poll_s > 0 else None
+            if not self._meta("imported"):
+                # первый старт: таблица — единственный источник, без неё отвечать нельзя;
+                # конец ленты правок — до импорта, чтобы правки во время чтения таблицы не потерялись
+                head = self.remote.feed.head() if cfg.changes_poll_s > 0 else None
+                self.pull()
+                self._meta_set("imported", datetime.now().isoformat())
+                log.info("Store: imported %s bookings, %s slots from Google Sheets",
+                         self._scalar("SELECT COUNT(*) FROM bookings"), self._scalar("SELECT COUNT(*) FROM slots"))
+                if head:
+                    self._set_feed_cursor(head)
+            elif stored:
+                # после рестарта продолжаем с сохранённого места: правки, сделанные пока бот лежал, тоже приедут
+                self._feed_cursor = tuple(map(int, stored.split(":")))
+            else:
+                # база уже есть — отвечаем сразу, а есть ли лента, выяснит репликатор (Google может лежать)
+                self._feed_pending = cfg.changes_poll_s > 0
+            self._thread = threading.Thread(target=self._loop, name="store-replicator", daemon=True)
+            self._thread.start()
+            self._ready.set()
+
+    def _resolve_feed(self):
+        """Есть ли лента правок (в потоке репликатора): появилась — один раз догоняем таблицу целиком."""
+        head = self.remote.feed.head()
+        if head:
+            self.pull()
+            self._set_feed_cursor(head)
+        self._feed_pending = False
+
+    def _set_feed_cursor(self, cursor: tuple):
+        self._feed_cursor = cursor
+        self._meta_set("feed_cursor", "%d:%d" % cursor)
+
+    def stop(self):
+        """Остановить репликатор, отправить всё неотправленное и дописать очередь таблицы."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(60)
+        try:
+            self.push()
+        except Exception as e:
+            log.error("Store: final push failed, %s changes stay in %s: %s", self._count_backlog(), cfg.store_path, e)
+        self.remote.stop()
+
+    def backlog(self) -> int:
+        """Сколько изменений ещё не дошло до таблицы — на момент последнего прохода репликатора
+        (зовётся из event loop, поэтому без базы и её лока)."""
+        return self._backlog
+
+    def _count_backlog(self) -> int:
+        # строки в очереди записи тоже остаются dirty
+        with self._lock:
+            n = self._scalar("SELECT COUNT(*) FROM bookings WHERE dirty != ''")
+            n += self._scalar("SELECT COUNT(*) FROM slots WHERE dirty = 1")
+        return n
+
+    # --------------------- replication ---------------------
+
+    def _loop(self):
+        with background():  # репликация уступает квоту интерактивным запросам
+            while not self._stopping.is_set():
+                self._wake.wait(self.push_interval)
+                self._wake.clear()
+                try:
+                    self.push()
+                    if self._feed_pending:
+                        self._resolve_feed()
+                    since = time.monotonic() - self._pulled_at
+                    if self._feed_cursor is not None:
+                        if since > cfg.changes_poll_s:
+                            self.pull_changes()
+                    elif self.pull_interval and since > self.pull_interval:
+                        self.pull()
+                except Exception as e:
+                    log.warning("Store replication failed, will retry: %s", e)
+                self._backlog = self._count_backlog()
+
+    def push(self):
+        """
+        Локальные изменения -> таблица. Строка считается отправленной, только когда очередь записи
+        «Заявок» её реально записала (WriteOp.ok): до этого она остаётся dirty в базе и переживает
+        падение процесса, а выброшенная очередью операция уйдёт заново при следующем push.
+        """
+        with self._push_lock:
+            with self._lock:
+                books = self._db.execute("SELECT * FROM bookings WHERE dirty != '' ORDER BY rev").fetchall()
+                slots = self._db.execute("SELECT * FROM slots WHERE dirty = 1 ORDER BY date_iso").fetchall()
+
+            for b in books:
+                if b["request_id"] in self._sent:
+                    continue  # прошлая отправка ещё в очереди — дождёмся её, иначе строка задвоится
+                row = _row(b)
+                appended = not b["in_sheet"] or b["dirty"] == "*"
+                if appended:
+                    op = self.remote.append_booking(row)
+                else:
+                    fields = {MUTABLE_H[c]: b[c] for c in b["dirty"].split(",") if c in MUTABLE_H}
+                    try:
+                        op = self.remote.set_status(row["RequestID"], fields.get("Status", row["Status"]),
+                                                    admin_comment=fields.get("AdminComment"),
+                                                    date_iso=fields.get("DateISO"), time_slot=fields.get("TimeSlot"))
+                    except ValueError:
+                        log.warning("Store: %s is gone from «%s», local copy kept", row["RequestID"], cfg.sheet_bookings)
+                        op = None
+                self._sent[b["request_id"]] = (op, b["rev"], appended)
+            if self._sent:
+                self.remote.writes.flush()
+            self._settle()
+
+            by_day: Dict[str, List[sqlite3.Row]] = {}
+            for s in slots:
+                by_day.setdefault(s["date_iso"], []).append(s)
+            for day, items in by_day.items():
+                self.remote.put_slots(day, {s["slot"]: s["text"] for s in items})
+                with self._tx() as db:
+                    db.executemany("UPDATE slots SET dirty=0 WHERE date_iso=? AND slot=? AND rev=?",
+                                   [(s["date_iso"], s["slot"], s["rev"]) for s in items])
+                    db.execute("DELETE FROM slots WHERE date_iso=? AND text='' AND dirty=0", (day,))
+
+    def _settle(self):
+        """Снять dirty со строк, чьи операции очередь уже записала (ok) или выбросила (остаются dirty)."""
+        done = [(rid, sent) for rid, sent in self._sent.items() if sent[0] is None or sent[0].ok is not None]
+        if not done:
+            return
+        with self._tx() as db:
+            for rid, (op, rev, appended) in done:
+                del self._sent[rid]
+                if op is not None and not op.ok:
+                    continue
+                if appended:
+                    # строка уже в таблице при любом rev; правки, сделанные после снимка, — отдельными полями
+                    db.execute("UPDATE bookings SET in_sheet=1, dirty=CASE WHEN rev=? THEN '' ELSE ? END"
+                               " WHERE request_id=?", (rev, ALL_MUTABLE, rid))
+                else:
+                    db.execute("UPDATE bookings SET dirty='' WHERE request_id=? AND rev=?", (rid, rev))
+
+    def pull(self):
+        """
+        Таблица -> база: ручные правки админа. Строки, изменённые локально после начала чтения
+        (rev новее) или ещё не отправленные (dirty), не трогаем.
+        """
+        with self._lock:
+            since = self._rev
+        records = self.remote._all_bookings()
+        cal = self.remote.ws_cal.get_all_values()
+        self._pulled_at = time.monotonic()
+        self.apply_remote(records, cal, since)
+
+    def pull_changes(self):
+        """Таблица -> база по ленте правок: только изменённые руками строки."""
+        with self._lock:
+            since = self._rev
+        feed = self.remote.feed
+        cursor, changes = feed.read(self._feed_cursor)
+        if changes is None:
+            log.info("Store: structural edit or gap in change feed, full pull")
+            self.pull()
+        elif changes:
+            book, cal_headers, cal = feed.fetch(changes)
+            records = []
+            for vals in book.values():
+                rec = dict(zip(HEADERS_BOOK, list(vals) + [""] * (len(HEADERS_BOOK) - len(vals))))
+                rid = str(rec["RequestID"]).strip()
+                if rid:
+                    records.append(self.remote._with_pending(rid, rec))
+            self.apply_remote(records, [cal_headers or []] + list(cal.values()) if cal else None, since,
+                              partial=True)
+            self.remote.apply_book_rows(book)
+            self.remote.apply_cal_rows(cal_headers, cal)
+        self._pulled_at = time.monotonic()
+        if cursor != self._feed_cursor:
+            self._set_feed_cursor(cursor)
+
+    def apply_remote(self, records: List[Dict] | None, cal: List[List[str]] | None, since: int,
+                     partial: bool = False):
+        """Записи «Заявок» и строки «Календаря» (с шапкой) -> база; partial — пришли не все дни, а только эти."""
+        cols = list(COLS.values())
+        with self._tx() as db:
+            for r in records or ():
+                rid = str(r.get("RequestID") or "").strip()
+                if not rid:
+                    continue
+                vals = [str(r.get(h, "") if r.get(h) is not None else "") for h in COLS]
+                db.execute(
+                    f"INSERT INTO bookings ({', '.join(cols)}, in_sheet) VALUES ({', '.join('?' * len(cols))}, 1)"
+                    f" ON CONFLICT(request_id) DO UPDATE SET"
+                    f" {', '.join(f'{c}=excluded.{c}' for c in cols if c != 'request_id')}, in_sheet=1"
+                    f" WHERE bookings.dirty='' AND bookings.rev<=?",
+                    (*vals, since),
+                )
+            if cal:
+                headers = cal[0]
+                remote = {(row[0], h): row[i] for row in cal[1:] if row and row[0]
+                          for i, h in enumerate(headers[:len(row)]) if i and h and row[i].strip()}
+                db.executemany(
+                    "INSERT INTO slots (date_iso, slot, text) VALUES (?, ?, ?)"
+                    " ON CONFLICT(date_iso, slot) DO UPDATE SET text=excluded.text"
+                    " WHERE slots.dirty=0 AND slots.rev<=? AND slots.text!=excluded.text",
+                    [(d, h, text, since) for (d, h), text in remote.items()],
+                )
+                # очищенные руками ячейки
+                days = {row[0] for row in cal[1:] if row and row[0]}
+                gone = [(r["date_iso"], r["slot"]) for r in
+                        db.execute("SELECT date_iso, slot FROM slots WHERE dirty=0 AND rev<=?", (since,))
+                        if (r["date_iso"], r["slot"]) not in remote and (not partial or r["date_iso"] in days)]
+                db.executemany("DELETE FROM slots WHERE date_iso=? AND slot=? AND dirty=0", gone)
+
+    # --------------------- calendar ---------------------
+
+    def _day(self, date_iso: str) -> tuple[List[str], List[str]]:
+        """Шапка (стандартные слоты + кастомные занятые) и ячейки дня — как строка «Календаря»."""
+        rows = self._db.execute("SELECT slot, text FROM slots WHERE date_iso=? AND text != ''", (date_iso,)).fetchall()
+        taken = {r["slot"]: r["text"] for r in rows}
+        headers = ["Date"] + cfg.time_slots + [s for s in taken if s not in cfg.time_slots]
+        return headers, [date_iso] + [taken.get(h, "") for h in headers[1:]]
+
+    def mark_slot(self, date_iso: str, slot: str, text: str) -> bool:
+        self._ensure_ready()
+        with self._tx() as db:
+            headers, cells = self._day(date_iso)
+            if DayOccupancy(headers, cells).conflicts(slot):
+                return False
+            cur = db.execute(
+                "INSERT INTO slots (date_iso, slot, text, dirty, rev) VALUES (?, ?, ?, 1, ?)"
+                " ON CONFLICT(date_iso, slot) DO UPDATE SET text=excluded.text, dirty=1, rev=excluded.rev"
+                " WHERE slots.text=''",
+                (date_iso, slot, text, self._next_rev()),
+            )
+            if not cur.rowcount:
+                return False
+        self._wake.set()
+        return True
+
+    def clear_slot(self, date_iso: str, slot: str) -> bool:
+        self._ensure_ready()
+        with self._tx() as db:
+            cur = db.execute("UPDATE slots SET text='', dirty=1, rev=? WHERE date_iso=? AND slot=? AND text != ''",
+                             (self._next_rev(), date_iso, slot))
+        if cur.rowcount:
+            self._wake.set()
+        return bool(cur.rowcount)
+
+    def is_occupied(self, date_iso: str, slot: str) -> bool:
+        self._ensure_ready()
+        with self._lock:
+            return DayOccupancy(*self._day(date_iso)).conflicts(slot)
+
+    def get_availability(self, date_iso: str) -> Dict[str, str]:
+        self._ensure_ready()
+        with self._lock:
+            return _day_availability(*self._day(date_iso))
+
+    def availability_range(self, start_iso: str, days: int) -> Dict[str, Dict[str, str]]:
+        self._ensure_ready()
+        with self._lock:
+            return {d: _day_availability(*self._day(d)) for d in suggest_dates(start_iso, days - 1)}
+
+    def suggest_slots(self, date_iso: str, slot: str, days: int | None = None,
+                      limit: int | None = None) -> List[tuple[str, str]]:
+        self._ensure_ready()
+        dates = suggest_dates(date_iso, cfg.suggest_days if days is None else days)
+        with self._lock:
+            day_occ = [(d, DayOccupancy(*self._day(d))) for d in dates]
+        return rank_suggestions(date_iso, slot, day_occ, cfg.suggest_limit if limit is None else limit)
+
+    # --------------------- bookings ---------------------
+
+    def append_booking(self, row: Dict) -> WriteOp:
+        """Как Sheets.append_booking; операция сразу ok — заявка уже в базе, в таблицу её отправит репликатор."""
+        self._ensure_ready()
+        vals = [str(row.get(h, "")) for h in COLS]
+        cols = list(COLS.values())
+        with self._tx() as db:
+            db.execute(f"INSERT INTO bookings ({', '.join(cols)}, dirty, rev) VALUES ({', '.join('?' * len(cols))}, '*', ?)",
+                       (*vals, self._next_rev()))
+        self._wake.set()
+        return WriteOp("append", str(row.get("RequestID", "")), values=vals, ok=True)
+
+    def set_status(self, request_id: str, status: str,
+                   admin_comment: str | None = None,
+                   date_iso: str | None = None,
+                   time_slot: str | None = None) -> WriteOp:
+        self._ensure_ready()
+        fields = {"status": status, "admin_comment": admin_comment, "date_iso": date_iso, "time_slot": time_slot}
+        changed = {c: v for c, v in fields.items() if v is not None}
+        with self._tx() as db:
+            old = db.execute("SELECT dirty FROM bookings WHERE request_id=?", (str(request_id),)).fetchone()
+            if not old:
+                raise ValueError("RequestID not found")
+            dirty = old["dirty"] if old["dirty"] == "*" else ",".join(sorted(set(filter(None, old["dirty"].split(","))) | set(changed)))
+            db.execute(f"UPDATE bookings SET {', '.join(f'{c}=?' for c in changed)}, dirty=?, rev=? WHERE request_id=?",
+                       (*changed.values(), dirty, self._next_rev(), str(request_id)))
+        self._wake.set()
+        return WriteOp("update", str(request_id), fields={MUTABLE_H[c]: v for c, v in changed.items()}, ok=True)
+
+    def update_status(self, request_id: str, status: str, admin_comment: str = "") -> bool:
+        try:
+            self.set_status(request_id, status, admin_comment=admin_comment or None)
+        except ValueError:
+            return False
+        return True
+
+    def get_by_request_id(self, request_id: str) -> dict | None:
+        self._ensure_ready()
+        with self._lock:
+            r = self._db.execute("SELECT * FROM bookings WHERE request_id=?", (str(request_id),)).fetchone()
+        return _row(r) if r else None
+
+    def user_recent(self, telegram_id: int, limit: int = 5) -> List[Dict]:
+        self._ensure_ready()
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM bookings WHERE telegram_id=? ORDER BY timestamp DESC LIMIT ?",
+                                    (str(telegram_id), limit)).fetchall()
+        return [_row(r) for r in rows]
+
+    def agenda(self, start: datetime, end: datetime, offset: int = 0, limit: int = 20) -> tuple[List[tuple], int]:
+        self._ensure_ready()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM bookings WHERE status='Подтверждена' AND date_iso BETWEEN ? AND ?",
+                (start.date().isoformat(), end.date().isoformat()),
+            ).fetchall()
+        items = sorted(((dt, r) for r in map(_row, rows) if (dt := _agenda_dt(r)) and start <= dt <= end),
+                       key=lambda x: (x[0], x[1]["RequestID"]))
+        return items[offset: offset + limit], len(items)
+
+    def booked_days_for_month(self, year: int, month: int, statuses) -> set[int]:
+        self._ensure_ready()
+        statuses = list(statuses)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT DISTINCT date_iso FROM bookings WHERE date_iso BETWEEN ? AND ?"
+                f" AND status IN ({', '.join('?' * len(statuses))})",
+                (f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-31", *statuses),
+            ).fetchall()
+        days = set()
+        for r in rows:
+            try:
+                days.add(int(r[0][8:10]))
+            except ValueError:
+                pass
+        return days
+
+    def month_cached(self, year: int, month: int, statuses) -> bool:
+        return True  # месяц — один запрос по индексу, подгружать заранее нечего
+
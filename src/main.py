@@ -1,7 +1,11 @@
 # src/main.py
 import os
 import asyncio
+import hmac
+import html
 import logging
+import time
+import zlib
 from datetime import datetime, date, timedelta
 
 from aiohttp import web
@@ -10,6 +14,7 @@ from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_applicati
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.types import (
     Message, CallbackQuery,
@@ -20,14 +25,41 @@ from aiogram.types import (
 from src.config import cfg
 from src.states import BookingFSM
 from src.parsing import parse_date_human, normalize_range, parse_hhmm
-from src.sheets import sheets
+from src.sheets import sheets, asheets
 from src import keyboards as kb
 from src.calendar_kb import build_month_kb
+from src.fsm_storage import build_storage, load as fsm_load, save as fsm_save
+from src.slot_locks import slot_locks
+from src.ids import request_ids
+from src.ratelimit import background, limiter
+from src.tg_outbox import outbox
+from src.metrics import HandlerMetrics, registry
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 log = logging.getLogger("qwesade.bot")
 
 router = Router()
+router.message.middleware(HandlerMetrics())         # bot_handler_seconds{handler=...} в /metrics
+router.callback_query.middleware(HandlerMetrics())
+
+# фоновые задачи (прогрев Sheets и т.п.) — держим ссылки, чтобы их не собрал GC
+_background: set[asyncio.Task] = set()
+
+registry.register_gauge("bot_background_tasks", "Фоновые задачи бота (прогрев, удаление якорей...)",
+                        lambda: len(_background))
+registry.register_gauge("sheets_backlog", "Изменения, ещё не записанные в таблицу", lambda: sheets.backlog())
+registry.register_gauge("sheets_pool_queued", "Вызовы Sheets, ждущие потока пула", lambda: asheets.queued())
+registry.register_gauge("sheets_quota", "Квоты Sheets API: запросы, ожидания, повторы, токены",
+                        lambda: limiter.stats(), label="stat")
+registry.register_gauge("telegram_outbox", "Исходящие в Telegram: отправлено, задержано, схлопнуто, отброшено",
+                        lambda: outbox.stats(), label="stat")
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
 
 # Невидимый символ как «якорь» для reply-клавы
 ANCHOR_TEXT = "\u2063"
@@ -58,61 +90,106 @@ async def _delete_msg_by_id(bot, chat_id: int, msg_id: int | None):
         return
     try:
         await bot.delete_message(chat_id, msg_id)
-    except Exception:
-        pass
+    except Exception as e:
+        # сообщение уже удалено/слишком старое — не страшно, но молча не глотаем
+        log.debug("Delete %s/%s failed: %s", chat_id, msg_id, e)
 
 
-async def _set_reply_mode(bot: Bot, chat_id: int, state: FSMContext, mode: str):
-    data = await state.get_data()
+async def _set_reply_mode(bot: Bot, chat_id: int, data: dict, mode: str) -> dict:
+    """Якорь reply-клавиатуры нужного режима. Возвращает, что записать в FSM (пусто — якорь уже тот)."""
     if data.get("reply_mode") == mode and data.get("reply_msg_id"):
-        return
-    # удалить старый якорь
-    if data.get("reply_msg_id"):
-        try:
-            await bot.delete_message(chat_id, data["reply_msg_id"])
-        except Exception:
-            pass
+        return {}
     m = await bot.send_message(chat_id, ANCHOR_TEXT, reply_markup=_reply_markup(mode))
-    await state.update_data(reply_msg_id=m.message_id, reply_mode=mode)
+    # старый якорь убираем после нового и фоном: клавиатура не мигает, ответ не ждёт удаления
+    if data.get("reply_msg_id"):
+        _spawn(_delete_msg_by_id(bot, chat_id, data["reply_msg_id"]))
+    return {"reply_msg_id": m.message_id, "reply_mode": mode}
+
+
+async def _edit_step(bot: Bot, chat_id: int, msg_id: int, text: str, markup) -> bool:
+    try:
+        await bot.edit_message_text(chat_id=chat_id, message_id=msg_id, text=text, reply_markup=markup)
+        return True
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return True  # уже показано ровно это
+        log.debug("Edit %s/%s failed, resending: %s", chat_id, msg_id, e)
+    except Exception as e:
+        log.debug("Edit %s/%s failed, resending: %s", chat_id, msg_id, e)
+    return False
+
+
+_SAME = object()  # send_step(new_state=_SAME) — шаг FSM не меняется
 
 
-async def send_step(bot: Bot, chat_id: int, state: FSMContext, text: str, inline_markup=None, reply_mode: str = "flow"):
+def _step_sig(msg_id: int, text: str, markup) -> str:
+    """Отпечаток показанного шага: id сообщения + crc32 текста и инлайн-клавиатуры."""
+    raw = text + "\0" + (markup.model_dump_json(exclude_none=True) if markup else "")
+    return f"{msg_id}:{zlib.crc32(raw.encode())}"
+
+
+async def send_step(bot: Bot, chat_id: int, state: FSMContext, text: str, inline_markup=None,
+                    reply_mode: str = "flow", data: dict | None = None, fields: dict | None = None,
+                    new_state=_SAME, final: bool = False, replace: bool = False, force: bool = False) -> dict:
+    """
+    Шаг диалога — одно сообщение бота, которое правится на месте. FSM читается один раз (или data
+    от хендлера, если он их уже получил), а ответы хендлера (fields), новый шаг (new_state) и id
+    сообщений пишутся одной записью — только изменённые поля (update_data), чтобы не затереть
+    параллельную правку; replace=True — data заменяются целиком (сброс заявки).
+    Шаг, который уже показан ровно таким (step_sig), не правится вовсе; force — всё равно
+    перепоказать (команды входа: сообщение могли удалить руками).
+    final — сообщение остаётся в чате (квитанция), следующий шаг придёт новым. Возвращает data.
+    """
     if not (text or "").strip():
         text = "."
-    await _set_reply_mode(bot, chat_id, state, reply_mode)
+    if data is None:
+        data = await state.get_data()
+    data = {**data, **(fields or {})}
+    updates = await _set_reply_mode(bot, chat_id, data, reply_mode)
 
-    data = await state.get_data()
     old_id = data.get("step_msg_id")
+    if old_id and not force and data.get("step_sig") == _step_sig(old_id, text, inline_markup):
+        pass  # уже показано ровно это — ни правки, ни «message is not modified»
+    elif old_id and await _edit_step(bot, chat_id, old_id, text, inline_markup):
+        updates["step_sig"] = _step_sig(old_id, text, inline_markup)
+    else:
+        # редактировать нечего или не удалось — шлём новое, старое удаляем фоном
+        m = await bot.send_message(chat_id, text, reply_markup=inline_markup)
+        if old_id:
+            _spawn(_delete_msg_by_id(bot, chat_id, old_id))
+        updates.update(step_msg_id=m.message_id, step_sig=_step_sig(m.message_id, text, inline_markup))
+    if final:
+        updates.update(step_msg_id=None, step_sig=None)
+    data.update(updates)
+    patch = {**(fields or {}), **updates}
+    if new_state is not _SAME:
+        await fsm_save(state, new_state, data if replace else patch, replace=replace)
+    elif replace:
+        await state.set_data(data)
+    elif patch:
+        await state.update_data(patch)
+    return data
 
-    # быстрее: пытаемся редактировать старое сообщение
-    if old_id:
-        try:
-            await bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=old_id,
-                text=text,
-                reply_markup=inline_markup,
-            )
-            return  # id шага не меняется
-        except Exception:
-            # если редактирование не удалось — удаляем и шлём новое
-            try:
-                await bot.delete_message(chat_id, old_id)
-            except Exception:
-                pass
 
-    m = await bot.send_message(chat_id, text, reply_markup=inline_markup)
-    await state.update_data(step_msg_id=m.message_id)
+# ключи FSM про сообщения бота в чате (а не про заявку): переживают сброс заявки
+UI_KEYS = ("reply_msg_id", "reply_mode", "step_msg_id", "step_sig")
 
 
-async def goto_menu(bot: Bot, chat_id: int, state: FSMContext, title: str | None = None):
-    await state.set_state()  # сброс на None
-    await send_step(bot, chat_id, state, title or "Выбери действие:", kb.kb_main_menu().as_markup(), reply_mode="menu")
+def _ui(data: dict) -> dict:
+    """Data после сброса заявки: якорь и шаг остаются — следующий шаг их переиспользует."""
+    return {k: data[k] for k in UI_KEYS if k in data}
 
 
-async def goto_flow(bot: Bot, chat_id: int, state: FSMContext):
-    await state.set_state(BookingFSM.choosing_service)
-    await send_step(bot, chat_id, state, "Что хочется?", kb.kb_services().as_markup(), reply_mode="flow")
+async def goto_menu(bot: Bot, chat_id: int, state: FSMContext, title: str | None = None, data: dict | None = None,
+                    replace: bool = False, force: bool = False):
+    await send_step(bot, chat_id, state, title or "Выбери действие:", kb.kb_main_menu().as_markup(),
+                    reply_mode="menu", data=data, new_state=None, replace=replace, force=force)
+
+
+async def goto_flow(bot: Bot, chat_id: int, state: FSMContext, data: dict | None = None,
+                    replace: bool = False, force: bool = False):
+    await send_step(bot, chat_id, state, "Что хочется?", kb.kb_services().as_markup(), reply_mode="flow",
+                    data=data, new_state=BookingFSM.choosing_service, replace=replace, force=force)
 
 
 def admin_kb(row: dict) -> InlineKeyboardMarkup:
@@ -136,7 +213,7 @@ async def cmd_start(message: Message, state: FSMContext):
         await message.delete()
     except Exception:
         pass
-    await goto_menu(message.bot, message.chat.id, state, "Привет! Это запись на активности @qwesade.")
+    await goto_menu(message.bot, message.chat.id, state, "Привет! Это запись на активности @qwesade.", force=True)
 
 
 # кнопка реплай "🆕 Новая заявка"
@@ -146,7 +223,7 @@ async def msg_new(message: Message, state: FSMContext):
         await message.delete()
     except Exception:
         pass
-    await goto_flow(message.bot, message.chat.id, state)
+    await goto_flow(message.bot, message.chat.id, state, force=True)
 
 
 # /new и инлайн-кнопка "new"
@@ -161,7 +238,7 @@ async def cmd_new(evt, state: FSMContext):
             await evt.delete()
         except Exception:
             pass
-    await goto_flow(bot, chat_id, state)
+    await goto_flow(bot, chat_id, state, force=True)
 
 
 @router.message(F.text == "/help")
@@ -170,13 +247,13 @@ async def cmd_help(message: Message):
         await message.delete()
     except Exception:
         pass
-    await message.answer("/start — меню\n/new — новая запись\n/avail — доступность\n/mine — мои заявки\n/agenda — ближайшие подтверждённые")
+    await message.answer("/start — меню\n/new — новая запись\n/avail — доступность\n/mine — мои заявки\n/avail N — сетка занятости на N дней\n/agenda [стр] [дней] — ближайшие подтверждённые")
 
 
 # ---------- Инфо-разделы ----------
 @router.callback_query(F.data == "mine")
 async def cb_mine(cb: CallbackQuery, state: FSMContext):
-    rows = sheets.user_recent(cb.from_user.id, limit=5)
+    rows = await asheets.user_recent(cb.from_user.id, limit=5)
     if not rows:
         return await cb.answer("Заявок нет", show_alert=True)
     text = "Ваши последние заявки:\n\n" + "\n\n".join(
@@ -190,41 +267,40 @@ async def cb_mine(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
 
 
-@router.message(F.text == "/agenda")
-async def cmd_agenda(message: Message):
-    rows = sheets.ws_book.get_all_records()
-    now = datetime.now()
-    until = now + timedelta(days=60)
+AGENDA_PAGE = 20
+AGENDA_DAYS = 60
 
-    def parse_dt(r):
-        iso = r.get("DateISO", "")
-        slot = str(r.get("TimeSlot", ""))
-        try:
-            dt = datetime.fromisoformat(iso)
-        except Exception:
-            return None
-        import re
-        m = re.search(r"(\d{1,2}):(\d{2})", slot)
-        if m:
-            dt = dt.replace(hour=int(m.group(1)), minute=int(m.group(2)))
-        return dt
-
-    items = []
-    for r in rows:
-        if r.get("Status") != "Подтверждена":
-            continue
-        dt = parse_dt(r)
-        if not dt or dt < now or dt > until:
-            continue
-        items.append((dt, r))
-    items.sort(key=lambda x: x[0])
-
-    if not items:
-        return await message.answer("Ближайших подтверждённых записей нет.")
-    lines = ["Ближайшие записи:\n"]
-    for dt, r in items[:20]:
+
+async def _render_agenda(page: int, days: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    now = datetime.now()
+    with background():  # первая сборка ленты читает всю таблицу — не в ущерб записи клиентов
+        items, total = await asheets.agenda(now, now + timedelta(days=days),
+                                            offset=page * AGENDA_PAGE, limit=AGENDA_PAGE)
+    if not total:
+        return f"Ближайших подтверждённых записей на {days} дн. нет.", None
+    pages = (total + AGENDA_PAGE - 1) // AGENDA_PAGE
+    lines = [f"Ближайшие записи ({days} дн., стр. {page + 1}/{pages}):\n"]
+    for dt, r in items:
         lines.append(f"{dt:%d.%m %H:%M} — {r.get('Service')} (@{r.get('Username') or r.get('TelegramID')})")
-    await message.answer("\n".join(lines))
+    return "\n".join(lines), kb.kb_agenda_pages(page, pages, days)
+
+
+# /agenda [страница] [дней вперёд], напр. «/agenda 2 90»
+@router.message(F.text.regexp(r"^/agenda(\s+\d+){0,2}\s*$"))
+async def cmd_agenda(message: Message):
+    args = [int(x) for x in message.text.split()[1:]]
+    page = max((args[0] if args else 1) - 1, 0)
+    days = min(max(args[1] if len(args) > 1 else AGENDA_DAYS, 1), 366)
+    text, markup = await _render_agenda(page, days)
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(F.data.startswith("agenda:"))
+async def cb_agenda_page(cb: CallbackQuery):
+    await cb.answer()
+    _, page, days = cb.data.split(":")
+    text, markup = await _render_agenda(int(page), int(days))
+    await cb.message.edit_text(text, reply_markup=markup)
 
 
 # ---------- Сценарий записи ----------
@@ -232,26 +308,25 @@ async def cmd_agenda(message: Message):
 async def on_service(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     service = cb.data.split(":", 1)[1]
-    await state.update_data(service=service)
-    await state.set_state(BookingFSM.choosing_date)
-    await send_step(cb.bot, cb.message.chat.id, state, "Когда удобно?", kb.kb_dates().as_markup())
+    await send_step(cb.bot, cb.message.chat.id, state, "Когда удобно?", kb.kb_dates().as_markup(),
+                    fields={"service": service}, new_state=BookingFSM.choosing_date)
 
 
 # Календарь (компактный)
 @router.callback_query(BookingFSM.choosing_date, F.data.startswith("cal:nav:"))
-async def cal_nav(cb: CallbackQuery):
+async def cal_nav(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     y, m = map(int, cb.data.split(":")[2].split("-"))
-    await cb.message.edit_reply_markup(reply_markup=build_month_kb(y, m).as_markup())
+    # через send_step, а не edit_reply_markup: step_sig должен знать, что показано
+    await send_step(cb.bot, cb.message.chat.id, state, "Когда удобно?", (await build_month_kb(y, m)).as_markup())
 
 
 @router.callback_query(BookingFSM.choosing_date, F.data.startswith("cal:pick:"))
 async def cal_pick(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     iso = cb.data.split(":")[2]
-    await state.update_data(date_iso=iso, date_text=iso)
-    await state.set_state(BookingFSM.choosing_time)
-    await send_step(cb.bot, cb.message.chat.id, state, "Во сколько?", kb.kb_times().as_markup())
+    await send_step(cb.bot, cb.message.chat.id, state, "Во сколько?", kb.kb_times().as_markup(),
+                    fields={"date_iso": iso, "date_text": iso}, new_state=BookingFSM.choosing_time)
 
 
 @router.callback_query(BookingFSM.choosing_date, F.data.startswith("date:"))
@@ -260,11 +335,11 @@ async def on_date_preset(cb: CallbackQuery, state: FSMContext):
     val = cb.data.split(":", 1)[1]
     if val == "Выбрать дату":
         today = date.today()
-        return await cb.message.edit_reply_markup(reply_markup=build_month_kb(today.year, today.month).as_markup())
+        return await send_step(cb.bot, cb.message.chat.id, state, "Когда удобно?",
+                               (await build_month_kb(today.year, today.month)).as_markup())
     iso = parse_date_human(val)
-    await state.update_data(date_iso=iso, date_text=val)
-    await state.set_state(BookingFSM.choosing_time)
-    await send_step(cb.bot, cb.message.chat.id, state, "Во сколько?", kb.kb_times().as_markup())
+    await send_step(cb.bot, cb.message.chat.id, state, "Во сколько?", kb.kb_times().as_markup(),
+                    fields={"date_iso": iso, "date_text": val}, new_state=BookingFSM.choosing_time)
 
 
 # Кнопки времени
@@ -273,12 +348,11 @@ async def on_time_button(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     val = cb.data.split(":", 1)[1]
     if val == "__interval__":
-        await state.set_state(BookingFSM.getting_time_start)
         return await send_step(cb.bot, cb.message.chat.id, state,
-                               "Напиши интервал: <b>HH:MM–HH:MM</b>\nНапр.: <code>11:23–14:45</code>")
-    await state.update_data(time_slot=val)
-    await state.set_state(BookingFSM.getting_district)
-    await send_step(cb.bot, cb.message.chat.id, state, "Какой район/локация? (можно 'без разницы')")
+                               "Напиши интервал: <b>HH:MM–HH:MM</b>\nНапр.: <code>11:23–14:45</code>",
+                               new_state=BookingFSM.getting_time_start)
+    await send_step(cb.bot, cb.message.chat.id, state, "Какой район/локация? (можно 'без разницы')",
+                    fields={"time_slot": val}, new_state=BookingFSM.getting_district)
 
 
 # Ввод времени текстом (одним сообщением — интервал или «весь день»)
@@ -297,9 +371,8 @@ async def on_time_text_one(message: Message, state: FSMContext):
 
     low = txt.lower().replace("ё", "е")
     if low in {"весь день", "весьдень"}:
-        await state.update_data(time_slot="Весь день")
-        await state.set_state(BookingFSM.getting_district)
-        return await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')")
+        return await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')",
+                               fields={"time_slot": "Весь день"}, new_state=BookingFSM.getting_district)
 
     import re
     # допускаем 11.23-19.45 и разные тире
@@ -307,15 +380,13 @@ async def on_time_text_one(message: Message, state: FSMContext):
     if re.fullmatch(r"\d{1,2}:\d{2}-\d{1,2}:\d{2}", norm):
         a, b = norm.split("-")
         slot = f"{a}–{b}"
-        await state.update_data(time_slot=slot)
-        await state.set_state(BookingFSM.getting_district)
-        return await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')")
+        return await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')",
+                               fields={"time_slot": slot}, new_state=BookingFSM.getting_district)
 
     if parse_hhmm(txt):
         # ввели только начало — попросим конец
-        await state.update_data(_t_start=txt)
-        await state.set_state(BookingFSM.getting_time_end)
-        return await send_step(message.bot, message.chat.id, state, "Конец: <b>HH:MM</b>")
+        return await send_step(message.bot, message.chat.id, state, "Конец: <b>HH:MM</b>",
+                               fields={"_t_start": txt}, new_state=BookingFSM.getting_time_end)
 
     await send_step(message.bot, message.chat.id, state,
                     "Не понял время. Введи, например: <code>11:30–17:45</code> или <b>Весь день</b>.")
@@ -341,16 +412,14 @@ async def on_time_start(message: Message, state: FSMContext):
     if re.fullmatch(r"\d{1,2}:\d{2}-\d{1,2}:\d{2}", norm):
         a, b = norm.split("-")
         slot = f"{a}–{b}"
-        await state.update_data(time_slot=slot)
-        await state.set_state(BookingFSM.getting_district)
-        return await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')")
+        return await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')",
+                               fields={"time_slot": slot}, new_state=BookingFSM.getting_district)
 
     # иначе ждём начало как HH:MM
     if not parse_hhmm(txt):
         return await send_step(message.bot, message.chat.id, state, "Не понял время. Пример: <code>11:30–17:45</code>")
-    await state.update_data(_t_start=txt)
-    await state.set_state(BookingFSM.getting_time_end)
-    await send_step(message.bot, message.chat.id, state, "Конец: <b>HH:MM</b>")
+    await send_step(message.bot, message.chat.id, state, "Конец: <b>HH:MM</b>",
+                    fields={"_t_start": txt}, new_state=BookingFSM.getting_time_end)
 
 
 @router.message(BookingFSM.getting_time_end)
@@ -369,10 +438,9 @@ async def on_time_end(message: Message, state: FSMContext):
     data = await state.get_data()
     slot = normalize_range(data.get("_t_start", ""), txt)
     if not slot:
-        return await send_step(message.bot, message.chat.id, state, "Интервал некорректный. Пример: 11:30–17:45")
-    await state.update_data(time_slot=slot)
-    await state.set_state(BookingFSM.getting_district)
-    await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')")
+        return await send_step(message.bot, message.chat.id, state, "Интервал некорректный. Пример: 11:30–17:45", data=data)
+    await send_step(message.bot, message.chat.id, state, "Какой район/локация? (можно 'без разницы')",
+                    data=data, fields={"time_slot": slot}, new_state=BookingFSM.getting_district)
 
 
 # Район
@@ -389,9 +457,8 @@ async def on_district(message: Message, state: FSMContext):
     except Exception:
         pass
 
-    await state.update_data(district=txt)
-    await state.set_state(BookingFSM.getting_wishes)
-    await send_step(message.bot, message.chat.id, state, "Пожелания/детали? (можно написать 'нет')")
+    await send_step(message.bot, message.chat.id, state, "Пожелания/детали? (можно написать 'нет')",
+                    fields={"district": txt}, new_state=BookingFSM.getting_wishes)
 
 
 # Пожелания -> подтверждение
@@ -405,18 +472,32 @@ async def on_wishes(message: Message, state: FSMContext):
 
     if wishes_text.lower() in {"нет", "-", "—"}:
         wishes_text = ""
-    await state.update_data(wishes=wishes_text)
-    data = await state.get_data()
-    text = (
+    fields = {"wishes": wishes_text}
+    data = {**await state.get_data(), **fields}
+    await send_step(message.bot, message.chat.id, state, _confirm_text(data), kb.kb_confirm().as_markup(),
+                    data=data, fields=fields, new_state=BookingFSM.confirming)
+
+
+def _confirm_text(data: dict) -> str:
+    return (
         f"Проверь заявку:\n\n"
         f"• Услуга: {data.get('service')}\n"
         f"• Когда: {data.get('date_text')}\n"
         f"• Время: {data.get('time_slot')}\n"
         f"• Район: {data.get('district')}\n"
-        f"• Пожелания: {wishes_text or '—'}\n"
+        f"• Пожелания: {data.get('wishes') or '—'}\n"
     )
-    await state.set_state(BookingFSM.confirming)
-    await send_step(message.bot, message.chat.id, state, text, kb.kb_confirm().as_markup())
+
+
+# Подсказка «ближайшее свободное» после конфликта -> снова подтверждение с новой датой/временем
+@router.callback_query(BookingFSM.confirming, F.data.startswith("sug:"))
+async def on_suggestion(cb: CallbackQuery, state: FSMContext):
+    await cb.answer()
+    _, iso, slot = cb.data.split(":", 2)
+    fields = {"date_iso": iso, "date_text": iso, "time_slot": slot}
+    data = {**await state.get_data(), **fields}
+    await send_step(cb.bot, cb.message.chat.id, state, _confirm_text(data), kb.kb_confirm().as_markup(),
+                    data=data, fields=fields)
 
 
 @router.callback_query(BookingFSM.confirming, F.data == "edit")
@@ -437,6 +518,19 @@ async def _notify_admins(bot: Bot, text: str, markup: InlineKeyboardMarkup | Non
             log.warning("Admin notify failed (%s): %s", aid, e)
 
 
+def _alert_write_failures(bot: Bot):
+    """Застрявшие и выброшенные записи очереди «Заявок» — админам (хук зовётся из потока записи)."""
+    loop = asyncio.get_running_loop()
+
+    def on_failure(op):
+        what = "выброшена" if op.ok is False else "пока не записана, повторяю"
+        text = (f"⚠️ Запись в «{cfg.sheet_bookings}» {what} после {op.attempts} попыток: {op.request_id}\n"
+                f"{html.escape(str(op.values or op.fields))}\nОшибка: {html.escape(str(op.error))}")
+        asyncio.run_coroutine_threadsafe(_notify_admins(bot, text), loop)
+
+    sheets.writes.on_failure = on_failure
+
+
 @router.callback_query(BookingFSM.confirming, F.data == "confirm")
 async def on_confirm(cb: CallbackQuery, state: FSMContext, bot: Bot):
     await cb.answer()
@@ -444,25 +538,10 @@ async def on_confirm(cb: CallbackQuery, state: FSMContext, bot: Bot):
     date_iso = data.get("date_iso") or parse_date_human(data.get("date_text", "") or "")
     slot = data.get("time_slot", "")
     if not date_iso:
-        await state.clear()
-        return await goto_menu(bot, cb.message.chat.id, state, "Не распознал дату, начнём заново.")
-
-    if sheets.is_occupied(date_iso, slot):
-        avail = sheets.get_availability(date_iso)
-        free_list = [s for s, v in avail.items() if not (v or "").strip()]
-        text = "Этот слот занят."
-        if free_list:
-            text += "\nСвободно:\n" + "\n".join(f"• {s}" for s in free_list)
-
-        # удалить старые сервисные сообщения бота
-        data = await state.get_data()
-        await _delete_msg_by_id(cb.bot, cb.message.chat.id, data.get("step_msg_id"))
-        await _delete_msg_by_id(cb.bot, cb.message.chat.id, data.get("reply_msg_id"))
-
-        await state.clear()
-        return await goto_menu(bot, cb.message.chat.id, state, text)
+        return await goto_menu(bot, cb.message.chat.id, state, "Не распознал дату, начнём заново.", data=_ui(data),
+                               replace=True)
 
-    req_id = f"RQ-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    req_id = request_ids.next()
     row = {
         "Timestamp": datetime.now().isoformat(timespec="seconds"),
         "RequestID": req_id,
@@ -478,25 +557,54 @@ async def on_confirm(cb: CallbackQuery, state: FSMContext, bot: Bot):
         "Status": "Новая",
         "AdminComment": "",
     }
+    cell_text = f"{row['Service']} (@{row['Username'] or row['TelegramID']})\n{row['District'] or ''}".strip()
 
     try:
-        sheets.append_booking(row)
-        cell_text = f"{row['Service']} (@{row['Username'] or row['TelegramID']})\n{row['District'] or ''}".strip()
-        ok = sheets.mark_slot(date_iso, slot, cell_text)
-        if not ok:
-            await state.clear()
-            return await goto_menu(bot, cb.message.chat.id, state, "Ой, слот только что заняли. Попробуй другой.")
+        # проверка и запись слота атомарны: пересекающиеся подтверждения ждут друг друга,
+        # заявка пишется только после того, как слот наш — без «осиротевших» строк «Новая»
+        async with slot_locks.hold(date_iso, slot):
+            ok = await asheets.mark_slot(date_iso, slot, cell_text)
+            if ok:
+                try:
+                    # write-through (WRITE_FLUSH_MS=0): ошибка записи приходит сюда; write-behind — заявка
+                    # ждёт в очереди, пока не запишется (застрявшие — админам, см. _alert_write_failures)
+                    await asheets.append_booking(row)
+                except Exception:
+                    await asheets.clear_slot(date_iso, slot)
+                    raise
     except Exception as e:
+        # удалить старые сервисные сообщения бота; заявка сбрасывается той же записью, что и новый шаг
+        await _delete_msg_by_id(cb.bot, cb.message.chat.id, data.get("step_msg_id"))
+        await _delete_msg_by_id(cb.bot, cb.message.chat.id, data.get("reply_msg_id"))
+
+        reason = str(e) or "таблица не ответила вовремя, попробуй ещё раз"  # asyncio.TimeoutError без текста
+        return await goto_menu(bot, cb.message.chat.id, state, f"Не удалось записать в таблицу: {reason}",
+                               data={}, replace=True)
+
+    if not ok:
+        # ближайшее свободное время той же длины — из индекса календаря, без чтений таблицы;
+        # заявка остаётся в «подтверждении», выбранная кнопка подставит дату и время
+        suggestions = await asheets.suggest_slots(date_iso, slot)
+        if suggestions:
+            return await send_step(bot, cb.message.chat.id, state, "Этот слот занят. Ближайшее свободное:",
+                                   kb.kb_suggestions(suggestions).as_markup(), data=data)
+
+        avail = await asheets.get_availability(date_iso)
+        free_list = [s for s, v in avail.items() if not (v or "").strip()]
+        text = "Этот слот занят."
+        if free_list:
+            text += "\nСвободно:\n" + "\n".join(f"• {s}" for s in free_list)
+
         # удалить старые сервисные сообщения бота
-        data = await state.get_data()
         await _delete_msg_by_id(cb.bot, cb.message.chat.id, data.get("step_msg_id"))
         await _delete_msg_by_id(cb.bot, cb.message.chat.id, data.get("reply_msg_id"))
 
-        await state.clear()
-        return await goto_menu(bot, cb.message.chat.id, state, f"Не удалось записать в таблицу: {e}")
+        return await goto_menu(bot, cb.message.chat.id, state, text, data={}, replace=True)
 
+    # квитанция с ID остаётся в чате, якорь меню переиспользуем; заявка сбрасывается той же записью
     await send_step(bot, cb.message.chat.id, state, f"Заявка отправлена ✅\nID: {req_id}",
-                    kb.kb_main_menu().as_markup(), reply_mode="menu")
+                    kb.kb_main_menu().as_markup(), reply_mode="menu", data=_ui(data), new_state=None, final=True,
+                    replace=True)
 
     text = (
         f"Новая заявка: {req_id}\n"
@@ -506,7 +614,6 @@ async def on_confirm(cb: CallbackQuery, state: FSMContext, bot: Bot):
         f"ДатаISO: {row['DateISO']}"
     )
     await _notify_admins(bot, text, markup=admin_kb(row))
-    await state.clear()
 
 
 # ---------- Reply-кнопки Назад/Отмена ----------
@@ -520,16 +627,10 @@ async def on_cancel(message: Message, state: FSMContext):
     except Exception:
         pass
 
-    # удалить прошлые сообщения бота (шаг и якорь)
-    data = await state.get_data()
-    await _delete_msg_by_id(bot, chat_id, data.get("step_msg_id"))
-    await _delete_msg_by_id(bot, chat_id, data.get("reply_msg_id"))
-
-    # очистить стейт
-    await state.clear()
-
-    # показать меню
-    await send_step(bot, chat_id, state, "Отменено.", kb.kb_main_menu().as_markup(), reply_mode="menu")
+    # очистить заявку; шаг правится в «Отменено.», якорь меняется на меню
+    data = _ui(await state.get_data())
+    await send_step(bot, chat_id, state, "Отменено.", kb.kb_main_menu().as_markup(), reply_mode="menu",
+                    data=data, new_state=None, replace=True)
 
 
 @router.message(F.text == "⬅ Назад")
@@ -540,25 +641,25 @@ async def on_back(message: Message, state: FSMContext):
     except Exception:
         pass
 
-    st = await state.get_state()
+    st, data = await fsm_load(state)
     bot, chat_id = message.bot, message.chat.id
 
     if st == BookingFSM.getting_wishes.state:
-        await state.set_state(BookingFSM.getting_district)
-        return await send_step(bot, chat_id, state, "Какой район/локация? (можно 'без разницы')")
+        return await send_step(bot, chat_id, state, "Какой район/локация? (можно 'без разницы')",
+                               data=data, new_state=BookingFSM.getting_district)
 
     if st == BookingFSM.getting_district.state:
-        await state.set_state(BookingFSM.choosing_time)
-        return await send_step(bot, chat_id, state, "Во сколько?", kb.kb_times().as_markup())
+        return await send_step(bot, chat_id, state, "Во сколько?", kb.kb_times().as_markup(),
+                               data=data, new_state=BookingFSM.choosing_time)
 
     if st in (BookingFSM.getting_time_end.state, BookingFSM.getting_time_start.state, BookingFSM.choosing_time.state):
-        await state.set_state(BookingFSM.choosing_date)
-        return await send_step(bot, chat_id, state, "Когда удобно?", kb.kb_dates().as_markup())
+        return await send_step(bot, chat_id, state, "Когда удобно?", kb.kb_dates().as_markup(),
+                               data=data, new_state=BookingFSM.choosing_date)
 
     if st in (BookingFSM.choosing_date.state, BookingFSM.choosing_service.state, BookingFSM.confirming.state):
-        return await goto_flow(bot, chat_id, state)
+        return await goto_flow(bot, chat_id, state, data=data)
 
-    await goto_menu(bot, chat_id, state)
+    await goto_menu(bot, chat_id, state, data=data)
 
 
 # ---------- Доступность ----------
@@ -570,12 +671,13 @@ async def cmd_avail(evt, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("adv_date:"))
-async def on_avail_date(cb: CallbackQuery):
+async def on_avail_date(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     val = cb.data.split(":", 1)[1]
     if val == "Выбрать дату":
         today = date.today()
-        return await cb.message.edit_reply_markup(reply_markup=build_month_kb(today.year, today.month).as_markup())
+        await cb.message.edit_reply_markup(reply_markup=(await build_month_kb(today.year, today.month)).as_markup())
+        return await state.update_data(step_sig=None)  # шаг мог быть поправлен мимо send_step
     iso = parse_date_human(val)
     await _show_availability(cb.message, iso, val)
 
@@ -591,13 +693,39 @@ async def on_avail_date_text(message: Message):
 async def _show_availability(dst_msg: Message, date_iso: str | None, label: str):
     if not date_iso:
         return await dst_msg.answer("Не распознал дату")
-    avail = sheets.get_availability(date_iso)
+    avail = await asheets.get_availability(date_iso)
     lines = [f"📅 Доступность на {label} ({date_iso}):"]
     for s in cfg.time_slots:
         lines.append(f"• {s} — {'❌ занято' if (avail.get(s, '') or '').strip() else '✅ свободно'}")
     await dst_msg.answer("\n".join(lines))
 
 
+AVAIL_MAX_DAYS = 62
+
+
+def _render_avail_grid(start: date, avail: dict) -> str:
+    """Компактная сетка: строка на день, колонка на слот из TIME_SLOTS (моноширинно, в <pre>)."""
+    slots = cfg.time_slots
+    heads = ["ВД" if s == "Весь день" else (s.split(":")[0] if ":" in s else s[:2]) for s in slots]
+    lines = [f"📅 Занятость с {start:%d.%m} ({len(avail)} дн.)  ■ занято · свободно", "<pre>",
+             " " * 9 + " ".join(f"{h:>2}" for h in heads)]
+    for iso, day in avail.items():
+        d = date.fromisoformat(iso)
+        marks = " ".join(" ■" if (day.get(s, "") or "").strip() else " ·" for s in slots)
+        lines.append(f"{kb.WEEKDAYS[d.weekday()]} {d:%d.%m} {marks}")
+    lines.append("</pre>")
+    return "\n".join(lines)
+
+
+# /avail N — занятость на N дней вперёд одним запросом к таблице, напр. «/avail 30»
+@router.message(F.text.regexp(r"^/avail\s+\d+\s*$"))
+async def cmd_avail_grid(message: Message):
+    days = min(max(int(message.text.split()[1]), 1), AVAIL_MAX_DAYS)
+    today = date.today()
+    avail = await asheets.availability_range(today.isoformat(), days)
+    await message.answer(_render_avail_grid(today, avail))
+
+
 def _is_admin(user_id: int) -> bool:
     ids = set(getattr(cfg, "admin_ids", []) or [])
     if getattr(cfg, "admin_chat_id", 0):
@@ -613,29 +741,29 @@ async def on_admin_action(cb: CallbackQuery):
     _, action, req_id = cb.data.split(":", 2)
 
     # Требуются методы в sheets: get_by_request_id/set_status/clear_slot
-    row = sheets.get_by_request_id(req_id)
+    row = await asheets.get_by_request_id(req_id)
     if not row:
         return await cb.answer("Заявка не найдена", show_alert=True)
 
     try:
         if action == "ok":
-            sheets.set_status(req_id, "Подтверждена")
+            await asheets.set_status(req_id, "Подтверждена")
             try:
                 await cb.bot.send_message(
                     row["TelegramID"],
                     f"Ваша заявка {req_id} подтверждена ✅\n"
                     f"{row['Service']} — {row['DateText']} {row['TimeSlot']}"
                 )
-            except Exception:
-                pass
+            except Exception as e:
+                log.warning("User notify failed (%s, %s): %s", row["TelegramID"], req_id, e)
 
             await cb.message.edit_text(cb.message.text + "\n\n✅ Подтверждено", reply_markup=None)
             await cb.answer("Подтверждено")
 
         elif action == "no":
-            sheets.set_status(req_id, "Отклонена")
+            await asheets.set_status(req_id, "Отклонена")
             try:
-                sheets.clear_slot(row["DateISO"], row["TimeSlot"])
+                await asheets.clear_slot(row["DateISO"], row["TimeSlot"])
             except Exception:
                 pass
             try:
@@ -644,8 +772,8 @@ async def on_admin_action(cb: CallbackQuery):
                     f"К сожалению, заявка {req_id} отклонена ❌.\n"
                     "Можно выбрать другой слот."
                 )
-            except Exception:
-                pass
+            except Exception as e:
+                log.warning("User notify failed (%s, %s): %s", row["TelegramID"], req_id, e)
 
             await cb.message.edit_text(cb.message.text + "\n\n❌ Отклонено", reply_markup=None)
             await cb.answer("Отклонено")
@@ -657,6 +785,17 @@ async def on_admin_action(cb: CallbackQuery):
         await cb.answer("Ошибка при изменении статуса", show_alert=True)
 
 
+@router.message(F.text == "/quota")
+async def cmd_quota(message: Message):
+    if not _is_admin(message.from_user.id):
+        return
+    st = limiter.stats()
+    lines = ["Google Sheets API:"] + [f"• {k}: {round(v, 1)}" for k, v in sorted(st.items())]
+    lines.append(f"• не записано в таблицу: {sheets.backlog()}")
+    lines += ["Telegram:"] + [f"• {k}: {round(v, 1)}" for k, v in sorted(outbox.stats().items())]
+    await message.answer("\n".join(lines))
+
+
 # ---------- Fallback на любой текст (в конце, после всех хендлеров!) ----------
 @router.message(F.text)
 async def fallback_text(message: Message):
@@ -665,28 +804,70 @@ async def fallback_text(message: Message):
 
 
 # ---------- Launcher (polling + webhook) ----------
+async def metrics_view(request: web.Request) -> web.Response:
+    """GET /metrics — текстовый формат Prometheus (см. src/metrics.py)."""
+    if cfg.metrics_token:
+        given = request.query.get("token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(given.encode(), cfg.metrics_token.encode()):  # время сравнения не выдаёт токен
+            raise web.HTTPUnauthorized()
+    return web.Response(text=registry.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def _warmup_sheets():
+    """Подключение к Google и индексы — фоном: вебхук уже отвечает 200, первые апдейты
+    просто подождут готовности Sheets внутри своих хендлеров."""
+    t0 = time.monotonic()
+    try:
+        with background():
+            await asheets.run(sheets.warmup, timeout=120)
+        log.info("Startup: sheets warm in %.2fs", time.monotonic() - t0)
+    except Exception as e:
+        log.warning("Startup: sheets warmup failed (%s), will connect on first use", e)
+
+
+async def _stop_sheets():
+    """Хук остановки (polling и webhook): дописать отложенные записи в «Заявки», пока пул ещё жив, и закрыть пул."""
+    try:
+        await asheets.run(sheets.stop, timeout=60)
+    except Exception as e:
+        log.error("Shutdown: sheets stop failed, %s writes left: %s", sheets.backlog(), e)
+    finally:
+        asheets.shutdown()
+
+
 async def _build_dp_and_bot():
     bot = Bot(cfg.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    bot.session.middleware(outbox)
+    dp = Dispatcher(storage=build_storage())
     dp.include_router(router)
     return dp, bot
 
 
 async def main_polling():
+    cfg.validate()
     dp, bot = await _build_dp_and_bot()
-    await dp.start_polling(bot)
+    _alert_write_failures(bot)
+    _spawn(_warmup_sheets())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await _stop_sheets()
 
 
 def main_webhook():
+    t_start = time.monotonic()
+    cfg.validate()
     app = web.Application()
 
     # healthcheck
     app.router.add_get("/", lambda r: web.Response(text="ok"))
     app.router.add_get("/ping", lambda r: web.Response(text="ok"))
+    app.router.add_get("/metrics", metrics_view)
 
     # соберём dp/bot заранее (НЕ в on_startup)
     bot = Bot(cfg.bot_token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
+    bot.session.middleware(outbox)  # лимиты Telegram и повторы после flood control
+    dp = Dispatcher(storage=build_storage())
     dp.include_router(router)
 
     # регистрируем вебхуковый хендлер и интеграцию с aiohttp
@@ -694,14 +875,21 @@ def main_webhook():
         dp, bot, secret_token=WEBHOOK_SECRET, handle_in_background=True  # быстрый ответ 200
     ).register(app, WEBHOOK_PATH)
     setup_application(app, dp, bot=bot)
+    log.info("Startup: app built in %.2fs", time.monotonic() - t_start)
 
     async def on_startup(_):
         if not WEBHOOK_URL:
             raise RuntimeError("WEBHOOK_BASE/RENDER_EXTERNAL_URL не задан. См. переменные окружения Render.")
+        t0 = time.monotonic()
         await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        log.info("Startup: webhook set in %.2fs (%.2fs since launch)", time.monotonic() - t0, time.monotonic() - t_start)
+        # Google Sheets не держит старт: подключаемся фоном
+        _alert_write_failures(bot)
+        _spawn(_warmup_sheets())
 
     async def on_shutdown(_):
         await bot.delete_webhook(drop_pending_updates=True)
+        await _stop_sheets()
 
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
@@ -0,0 +1,144 @@
+# src/metrics.py
+"""
+Метрики в текстовом формате Prometheus (GET /metrics на вебхук-сервере), без сторонних зависимостей.
+
+Дёшево настолько, чтобы не выключать в проде:
+- серия (имя + значения меток) создаётся один раз при первом наблюдении, дальше observe/inc —
+  это bisect по границам корзин и пара сложений int/float в готовом списке, без локов
+  (под GIL гонка потоков пула может потерять единичный инкремент — для метрик это приемлемо);
+- gauge'и (очереди, квоты) не хранятся, а считаются колбэком в момент скрейпа.
+
+Что собираем:
+  bot_handler_seconds{handler}        — время хендлеров aiogram (HandlerMetrics, middleware роутера);
+  sheets_call_seconds{method}         — вызовы Sheets через AsyncSheets (с ожиданием пула);
+  sheets_call_errors_total{method}
+  sheets_cache_total{cache, result}   — попадания/промахи кэшей Sheets;
+  telegram_request_seconds{method}    — запросы к Bot API (через Outbox);
+  telegram_request_errors_total{method}
+  + gauge'и из register_gauge (см. main.py): очередь записи, токены квот, счётчики лимитера.
+"""
+from __future__ import annotations
+import bisect
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+from aiogram import BaseMiddleware
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = ['%s="%s"' % (n, _esc(v)) for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._series: Dict[tuple, list] = {}
+
+    def inc(self, *values: str, n: float = 1):
+        s = self._series.get(values)
+        if s is None:
+            s = self._series.setdefault(values, [0])
+        s[0] += n
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for values, s in list(self._series.items()):
+            yield f"{self.name}{_labels(self.labels, values)} {s[0]}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self._le = ['le="%s"' % b for b in self.buckets] + ['le="+Inf"']
+        self._series: Dict[tuple, list] = {}  # значения меток -> [по корзинам..., +Inf, сумма]
+
+    def observe(self, value: float, *values: str):
+        s = self._series.get(values)
+        if s is None:
+            s = self._series.setdefault(values, [0] * (len(self.buckets) + 1) + [0.0])
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, s in list(self._series.items()):
+            acc = 0
+            for le, n in zip(self._le, s):
+                acc += n
+                yield f"{self.name}_bucket{_labels(self.labels, values, le)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {round(s[-1], 6)}"
+            yield f"{self.name}_count{_labels(self.labels, values)} {acc}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+        self._gauges: list = []
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        m = Counter(name, help, labels)
+        self._metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        m = Histogram(name, help, labels, buckets)
+        self._metrics.append(m)
+        return m
+
+    def register_gauge(self, name: str, help: str, fn: Callable[[], float | Dict[str, float]], label: str = ""):
+        """Gauge, который считается при скрейпе: fn() -> число или {значение метки label: число}."""
+        self._gauges.append((name, help, fn, label))
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        for name, help, fn, label in self._gauges:
+            try:
+                val = fn()
+            except Exception:
+                continue  # источник ещё не готов (Sheets не подключены и т.п.) — пропускаем
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            if isinstance(val, dict):
+                lines += [f"{name}{_labels((label,), (k,))} {v}" for k, v in sorted(val.items())]
+            else:
+                lines.append(f"{name} {val}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram("bot_handler_seconds", "Время обработки апдейта хендлером", ("handler",))
+sheets_seconds = registry.histogram("sheets_call_seconds", "Вызовы Sheets через AsyncSheets, с ожиданием пула",
+                                    ("method",))
+sheets_errors = registry.counter("sheets_call_errors_total", "Вызовы Sheets, закончившиеся ошибкой", ("method",))
+sheets_cache = registry.counter("sheets_cache_total", "Обращения к кэшам Sheets", ("cache", "result"))
+telegram_seconds = registry.histogram("telegram_request_seconds", "Запросы к Bot API (с ожиданием лимитов)",
+                                      ("method",))
+telegram_errors = registry.counter("telegram_request_errors_total", "Запросы к Bot API с ошибкой", ("method",))
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner-middleware роутера: к этому моменту фильтры пройдены и хендлер известен (data["handler"])."""
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any,
+                       data: Dict[str, Any]) -> Any:
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", "unknown")
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_seconds.observe(time.perf_counter() - t0, name)
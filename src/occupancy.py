@@ -0,0 +1,146 @@
+# src/occupancy.py
+"""
+Занятость дня в «Календаре» как битовая маска минут.
+
+Шапка листа разбирается один раз (HeaderTable, кэш по самой шапке): для каждой колонки —
+интервал [start, end) в минутах, флаг «Весь день» или «не распознан». День (DayOccupancy) —
+1440-битное число, где занятые минуты = 1. Дальше всё — пара битовых операций над int:
+  is_free / conflicts — пересечение с маской интервала;
+  free_gaps           — пробеги нулей;
+  first_free(n)       — первая свободная дыра длиной n (log n сдвигов);
+  nearest_free(n, t)  — ближайшие к t дыры длиной n (до и после), для подсказок при конфликте.
+Правила совпадают с прежним is_occupied: «Весь день» конфликтует с любым занятым слотом,
+нераспознанная колонка — только сама с собой.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from .parsing import slot_to_minutes
+
+ALL_DAY = "Весь день"
+DAY_MINUTES = 24 * 60
+
+
+def interval_mask(start: int, end: int) -> int:
+    return ((1 << (end - start)) - 1) << start
+
+
+def fmt_minutes(start: int, end: int) -> str:
+    return f"{start // 60:02d}:{start % 60:02d}–{end // 60:02d}:{end % 60:02d}"
+
+
+@dataclass(frozen=True)
+class HeaderTable:
+    headers: Tuple[str, ...]
+    intervals: Tuple[Optional[Tuple[int, int]], ...]  # None — «Весь день» или не распознано
+    all_day_col: Optional[int]
+
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def parse(headers: Tuple[str, ...]) -> "HeaderTable":
+        intervals = []
+        all_day_col = None
+        for i, h in enumerate(headers):
+            m = slot_to_minutes(h) if i else None
+            if m and m[0] == "all_day":
+                if h == ALL_DAY:
+                    all_day_col = i
+                m = None
+            intervals.append(m)
+        return HeaderTable(headers, tuple(intervals), all_day_col)
+
+
+class DayOccupancy:
+    def __init__(self, headers: Sequence[str], cells: Sequence[str]):
+        self.table = HeaderTable.parse(tuple(headers))
+        self.mask = 0
+        self.all_day = False
+        self.any_busy = False
+        self.busy_labels: set[str] = set()
+        for i, h in enumerate(self.table.headers):
+            val = cells[i] if i < len(cells) else ""
+            if not i or not (val or "").strip():
+                continue
+            self.any_busy = True
+            self.busy_labels.add(h)
+            if i == self.table.all_day_col:
+                self.all_day = True
+            elif self.table.intervals[i]:
+                self.mask |= interval_mask(*self.table.intervals[i])
+
+    def conflicts(self, slot: str) -> bool:
+        req = slot_to_minutes(slot)
+        # день целиком: занято, если что-то уже стоит в любом слоте
+        if slot == ALL_DAY or (req and req[0] == "all_day"):
+            return self.any_busy
+        # если в дне уже «Весь день» — любой слот занят
+        if self.all_day:
+            return True
+        if not req:
+            # нераспознанный слот конфликтует только сам с собой
+            return slot in self.busy_labels
+        return bool(self.mask & interval_mask(*req))
+
+    def is_free(self, slot: str) -> bool:
+        return not self.conflicts(slot)
+
+    def free_gaps(self, start: int = 0, end: int = DAY_MINUTES) -> List[Tuple[int, int]]:
+        """Свободные промежутки [s, e) внутри [start, end)."""
+        if self.all_day:
+            return []
+        free = ~self.mask & interval_mask(start, end)
+        gaps = []
+        while free:
+            s = (free & -free).bit_length() - 1
+            t = free >> s
+            n = (t ^ (t + 1)).bit_length() - 1  # длина пробега единиц с позиции s
+            gaps.append((s, s + n))
+            free &= ~interval_mask(s, s + n)
+        return gaps
+
+    def _fits(self, length: int, start: int, end: int, step: int) -> int:
+        """Бит i стоит, если минуты [i, i+length) свободны, лежат в [start, end) и i кратно step."""
+        if self.all_day or length <= 0 or end - start < length:
+            return 0
+        x, n = ~self.mask & interval_mask(start, end), 1
+        while n < length:
+            k = min(n, length - n)
+            x &= x >> k
+            n += k
+        x &= interval_mask(start, end - length + 1)
+        if step > 1:
+            x &= _grid_mask(step)
+        return x
+
+    def first_free(self, length: int, start: int = 0, end: int = DAY_MINUTES, step: int = 1) -> Optional[Tuple[int, int]]:
+        """Первый свободный интервал длиной length минут внутри [start, end), начало кратно step."""
+        x = self._fits(length, start, end, step)
+        if not x:
+            return None
+        s = (x & -x).bit_length() - 1
+        return s, s + length
+
+    def nearest_free(self, length: int, target: int, start: int = 0, end: int = DAY_MINUTES,
+                     step: int = 1) -> List[Tuple[int, int]]:
+        """Ближайшие к target свободные интервалы длиной length: первый с началом >= target и последний до него."""
+        x = self._fits(length, start, end, step)
+        out = []
+        after = x >> target << target
+        if after:
+            s = (after & -after).bit_length() - 1
+            out.append((s, s + length))
+        before = x & ((1 << target) - 1)
+        if before:
+            s = before.bit_length() - 1
+            out.append((s, s + length))
+        return out
+
+
+@lru_cache(maxsize=8)
+def _grid_mask(step: int) -> int:
+    m = 0
+    for i in range(0, DAY_MINUTES, step):
+        m |= 1 << i
+    return m
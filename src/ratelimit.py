@@ -0,0 +1,151 @@
+# src/ratelimit.py
+"""
+Лимитер запросов к Google Sheets API.
+
+Все HTTP-вызовы gspread идут через LimitedHTTPClient (передаётся в gspread.authorize):
+- два token bucket под квоты Sheets — чтение (GET) и запись (всё остальное), в минуту;
+- приоритеты: интерактивные вызовы (подтверждение, доступность) берут токен сразу,
+  фоновые (agenda, подгрузка календаря, слив очереди) — только если в ведре остаётся резерв;
+- 429/5xx/сетевые сбои — повтор с экспоненциальной паузой и джиттером; values:append
+  (не идемпотентен — после 5xx/обрыва строки могли уже лечь) повторяется только на 429;
+- общий бюджет ожиданий и повторов — до sheets_deadline (его ставит AsyncSheets.run чуть раньше
+  своего таймаута): вызов падает сам, а не доживает в потоке после того, как хендлер сдался;
+- счётчики (stats()) — сколько запросов, ожиданий, повторов и ошибок.
+При пиках пользователь получает чуть большую задержку, а не «Не удалось записать в таблицу».
+"""
+from __future__ import annotations
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import gspread
+import requests
+from gspread.http_client import HTTPClient
+
+from .config import cfg
+
+log = logging.getLogger("qwesade.sheets")
+
+RETRYABLE = {408, 429, 500, 502, 503, 504}
+
+INTERACTIVE, BACKGROUND = "interactive", "background"
+sheets_priority: contextvars.ContextVar[str] = contextvars.ContextVar("sheets_priority", default=INTERACTIVE)
+# time.monotonic(), после которого ждать токен или повторять уже нельзя (None — без ограничения)
+sheets_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("sheets_deadline", default=None)
+
+
+@contextmanager
+def background():
+    """Все вызовы Sheets внутри блока считаются фоновыми (уступают интерактивным)."""
+    token = sheets_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        sheets_priority.reset(token)
+
+
+def api_status(e: Exception) -> int | None:
+    """HTTP-код из gspread.APIError (None, если это не ошибка API)."""
+    if not isinstance(e, gspread.exceptions.APIError):
+        return None
+    code = getattr(e, "code", None)
+    if code is None and getattr(e, "response", None) is not None:
+        code = e.response.status_code
+    return code
+
+
+def idempotent(method: str, endpoint: str) -> bool:
+    """Можно ли повторить запрос после 5xx/обрыва: values:append мог уже дописать строки."""
+    return not endpoint.split("?", 1)[0].endswith(":append")
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, reserve: float):
+        self.rate = per_minute / 60
+        self.capacity = max(per_minute, 1)
+        self.reserve = self.capacity * reserve  # столько токенов фоновые вызовы не трогают
+        self.tokens = float(self.capacity)
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, priority: str, deadline: float | None = None) -> float:
+        """Взять токен (ждём, если нужно). Возвращает, сколько секунд прождали;
+        TimeoutError — если токена не дождаться до deadline."""
+        need = 1 + (self.reserve if priority == BACKGROUND else 0)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                if self.tokens >= need:
+                    self.tokens -= 1
+                    return waited
+                pause = (need - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + pause > deadline:
+                raise TimeoutError("Google Sheets: квота исчерпана, не успеваем до таймаута")
+            time.sleep(pause)
+            waited += pause
+
+
+class SheetsLimiter:
+    def __init__(self, read_per_min: float, write_per_min: float, retries: int, reserve: float = 0.25):
+        self.buckets = {"read": TokenBucket(read_per_min, reserve), "write": TokenBucket(write_per_min, reserve)}
+        self.retries = retries
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def count(self, *key, n: float = 1):
+        with self._lock:
+            self._counts[key] += n
+
+    def stats(self) -> dict:
+        """Живые счётчики: {"read.requests": .., "write.retries": .., "read.wait_seconds": .., ...}."""
+        with self._lock:
+            out = {".".join(k): v for k, v in self._counts.items()}
+        for kind, b in self.buckets.items():
+            out[f"{kind}.tokens"] = round(b.tokens, 1)
+        return out
+
+
+limiter = SheetsLimiter(cfg.sheets_read_per_min, cfg.sheets_write_per_min, retries=cfg.sheets_retries)
+
+
+class LimitedHTTPClient(HTTPClient):
+    """HTTP-клиент gspread с квотами, приоритетами и повторами (см. модуль)."""
+
+    def request(self, method: str, endpoint: str, *args, **kwargs):
+        kind = "read" if method.upper() == "GET" else "write"
+        priority = sheets_priority.get()
+        deadline = sheets_deadline.get()
+        delay = 1.0
+        for attempt in range(limiter.retries + 1):
+            try:
+                waited = limiter.buckets[kind].acquire(priority, deadline)
+            except TimeoutError:
+                limiter.count(kind, "errors")
+                raise
+            if waited:
+                limiter.count(kind, "throttled")
+                limiter.count(kind, "wait_seconds", n=waited)
+            limiter.count(kind, "requests")
+            try:
+                return super().request(method, endpoint, *args, **kwargs)
+            except (gspread.exceptions.APIError, requests.ConnectionError, requests.Timeout) as e:
+                code = api_status(e)
+                # 429 — запрос отклонён целиком, его можно повторить всегда; прочее — только идемпотентный
+                retryable = code == 429 or (idempotent(method, endpoint) and (code is None or code in RETRYABLE))
+                pause = min(delay, 32) * random.uniform(0.5, 1.5)
+                out_of_time = deadline is not None and time.monotonic() + pause > deadline
+                if not retryable or attempt == limiter.retries or out_of_time:
+                    limiter.count(kind, "errors")
+                    raise
+                limiter.count(kind, "retries")
+                log.warning("Sheets %s %s -> %s, retry %d in %.1fs", method, kind, code or type(e).__name__,
+                            attempt + 1, pause)
+                time.sleep(pause)
+                delay *= 2
@@ -1,9 +1,30 @@
 from __future__ import annotations
+import asyncio
+import bisect
+import contextvars
+import functools
 import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from typing import Dict, List
 import gspread
 from google.oauth2 import service_account
+from gspread.utils import rowcol_to_a1
 from .config import cfg
+from .occupancy import ALL_DAY, DayOccupancy, fmt_minutes
+from .parsing import slot_to_minutes
+from .ratelimit import LimitedHTTPClient, background, sheets_deadline
+from .change_feed import ChangeFeed
+from .metrics import sheets_cache, sheets_errors, sheets_seconds
+from .write_queue import WriteOp, WriteQueue, first_appended_row
+
+log = logging.getLogger("qwesade.sheets")
 
 HEADERS_BOOK = [
     "Timestamp", "RequestID", "TelegramID", "Username", "Name",
@@ -15,48 +36,421 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive",
 ]
 
+_HHMM = re.compile(r"(\d{1,2}):(\d{2})")
+
+
+def _agenda_dt(row: Dict) -> datetime | None:
+    """Начало записи: DateISO + первое HH:MM из TimeSlot («Весь день» — полночь)."""
+    try:
+        dt = datetime.fromisoformat(str(row.get("DateISO") or ""))
+    except ValueError:
+        return None
+    m = _HHMM.search(str(row.get("TimeSlot") or ""))
+    if m and int(m.group(1)) < 24 and int(m.group(2)) < 60:
+        dt = dt.replace(hour=int(m.group(1)), minute=int(m.group(2)))
+    return dt
+
+
+def _busy_days(entries: Dict[str, tuple], statuses) -> set[int]:
+    """Дни из {RequestID: (день, статус)}, где есть заявка с одним из statuses."""
+    return {day for day, status in entries.values() if status in statuses}
+
+
+def _shift_month(y: int, m: int, delta: int) -> tuple[int, int]:
+    k = y * 12 + (m - 1) + delta
+    return k // 12, k % 12 + 1
+
+
+def _month_day(date_iso) -> tuple[tuple[int, int] | None, int | None]:
+    """"2026-10-17" -> ((2026, 10), 17); (None, None), если не разбирается."""
+    iso = str(date_iso or "")
+    try:
+        return (int(iso[:4]), int(iso[5:7])), int(iso[8:10])
+    except ValueError:
+        return None, None
+
+
+def _day_availability(headers: List[str], cells: List[str]) -> Dict[str, str]:
+    """Слот -> значение ячейки; "ALL_DAY", если день занят целиком, "OVERLAP" — пустая, но пересекается."""
+    occ = DayOccupancy(headers, cells)
+    # если «Весь день» уже стоит — все занято
+    if occ.all_day:
+        return {h: "ALL_DAY" for h in headers[1:]}
+    day = {h: (cells[i] if i < len(cells) else "") for i, h in enumerate(headers[1:], start=1)}
+    # пустая колонка, пересекающаяся с занятым интервалом (напр. кастомным 11:23–14:45), тоже занята
+    return {h: v if (v or "").strip() or not occ.conflicts(h) else "OVERLAP" for h, v in day.items()}
+
+
+def suggest_dates(date_iso: str, days: int) -> List[str]:
+    """date_iso и days дней после него (пусто, если дата не разбирается)."""
+    try:
+        d0 = date.fromisoformat(date_iso)
+    except ValueError:
+        return []
+    return [(d0 + timedelta(days=k)).isoformat() for k in range(days + 1)]
+
+
+def rank_suggestions(date_iso: str, slot: str, day_occ: List[tuple[str, DayOccupancy]],
+                     limit: int) -> List[tuple[str, str]]:
+    """Подсказки свободного времени (см. Sheets.suggest_slots) по занятости дней [(date_iso, DayOccupancy)]."""
+    req = slot_to_minutes(slot)
+    whole_day = not req or req[0] == "all_day"
+    work = slot_to_minutes(cfg.suggest_hours)
+    lo, hi = work if work and work[0] != "all_day" else (0, 24 * 60)
+    if not whole_day:
+        length, target = req[1] - req[0], req[0]
+    now = datetime.now()
+    today = now.date().isoformat()
+
+    ranked = []
+    for k, (d, occ) in enumerate(day_occ):
+        if d < today:
+            continue
+        if whole_day:
+            if not occ.any_busy and d != date_iso:
+                ranked.append(((k, 0), d, ALL_DAY))
+            continue
+        start = max(lo, now.hour * 60 + now.minute) if d == today else lo
+        for s, e in occ.nearest_free(length, max(target, start), start, hi, cfg.suggest_step):
+            ranked.append(((k, abs(s - target)), d, fmt_minutes(s, e)))
+    ranked.sort()
+    return [(d, s) for _, d, s in ranked[:limit]]
+
+
 class Sheets:
     def __init__(self):
-        raw_json = cfg.google_creds_json
-        try:
-            info = json.loads(raw_json)
-        except Exception as e:
-            raise RuntimeError(f"GOOGLE_CREDS_JSON невалиден: {e}")
+        # подключение к Google — лениво, при первом обращении к листам (см. _connect)
+        self._conn_lock = threading.Lock()
+        self._gc = self._sh = self._ws_book = self._ws_cal = None
+
+        # индекс листа «Календарь»: дата -> номер строки, значения строки + шапка; общий для всех потоков пула
+        self._lock = threading.RLock()
+        self._cal_rows: Dict[str, int] = {}
+        self._cal_cells: Dict[str, List[str]] = {}
+        self._cal_headers: List[str] = []
+        self._cal_last_row = 0
+        self._cal_loaded_at = 0.0
+        self._cal_write_lock = threading.Lock()
+        # лист читается и дописывается вне self._lock; эти локи берутся до него (никогда под ним):
+        # _cal_append_lock -> _cal_load_lock -> self._lock
+        self._cal_append_lock = threading.Lock()
+        self._cal_load_lock = threading.Lock()
+        self._cal_gen = 0  # растёт при invalidate_calendar: прочитанное до сброса свежим не считается
+        self._cal_reading = False
+        self._cal_touched: set = set()  # дни, записанные ботом за время перечитки листа
+
+        # индекс «Заявок»: RequestID -> row; колонка читается вне self._lock (под _book_load_lock)
+        self._book_rows: Dict[str, int] = {}
+        self._book_last_row = 0
+        self._book_loaded_at = 0.0
+        self._book_read_at = 0.0  # когда начали читать колонку, из которой собран индекс
+        self._book_load_lock = threading.Lock()
+        self._book_idx_gen = 0
+        self._book_reading = False
+        self._book_landed: Dict[str, int] = {}  # дописанное очередью за время чтения колонки
+
+        # полные пересборки производных индексов «Заявок» читают таблицу вне self._lock; правки,
+        # пришедшие за это время, копятся в журнале (RequestID, поля) и накладываются на прочитанное
+        self._rebuild_lock = threading.Lock()  # берётся до self._lock, никогда под ним
+        self._rebuilding = 0
+        self._journal: List[tuple[str, Dict]] = []
+        self._book_gen = 0  # растёт, когда производные индексы сбрасывают (resync, ручные правки)
+
+        # последние заявки по TelegramID для «📋 Мои заявки»
+        self._recent: Dict[str, deque] = {}
+        self._recent_by_rid: Dict[str, Dict] = {}
+        self._recent_loaded = False
+
+        # /agenda: подтверждённые заявки по времени начала
+        self._agenda: List[tuple] = []
+        self._agenda_by_rid: Dict[str, tuple] = {}
+        self._agenda_loaded = False
+
+        # кэш для точек календарика: (y, m) -> ({RequestID: (день, статус)}, когда прочитали), LRU;
+        # _rid_month — в каком закэшированном месяце заявка (вытесняется вместе с месяцем),
+        # _month_epoch — счётчик явных сбросов по месяцу (чтобы не положить в кэш прочитанное до сброса)
+        self._month_busy: OrderedDict = OrderedDict()
+        self._month_epoch: Dict[tuple, int] = {}
+        self._rid_month: Dict[str, tuple] = {}
+
+        # отложенные записи в «Заявки» (см. write_queue.py)
+        self.writes = WriteQueue(self, flush_ms=cfg.write_flush_ms, batch_max=cfg.write_batch_max)
+
+        # лента ручных правок (см. change_feed.py): курсор, когда последний раз удалось её прочитать
+        self.feed = ChangeFeed(self)
+        self._feed_cursor = None
+        self._feed_ok_at = 0.0
+        self._follow_stop = threading.Event()
+
+    # --------------------- connection ---------------------------
 
-        pk = info.get("private_key", "")
-        # если в значении встречается литеральная последовательность \n — заменим на реальный перевод строки
-        if isinstance(pk, str) and "\\n" in pk:
-            info["private_key"] = pk.replace("\\n", "\n").replace("\r\n", "\n")
+    def _connect(self):
+        """
+        Подключиться к Google (один раз). Порядок локов: под self._lock _conn_lock не берётся
+        (см. _locked), а сам _connect self._lock не трогает — иначе поток, строящий индекс,
+        и поток, который подключается, ждут друг друга вечно.
+        """
+        if self._ws_cal is not None:
+            return  # уже подключены — без лока
+        with self._conn_lock:
+            if self._ws_cal is not None:
+                return
+            raw_json = cfg.validate().google_creds_json
+            try:
+                info = json.loads(raw_json)
+            except Exception as e:
+                raise RuntimeError(f"GOOGLE_CREDS_JSON невалиден: {e}")
 
-        creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+            pk = info.get("private_key", "")
+            # если в значении встречается литеральная последовательность \n — заменим на реальный перевод строки
+            if isinstance(pk, str) and "\\n" in pk:
+                info["private_key"] = pk.replace("\\n", "\n").replace("\r\n", "\n")
 
-        self.gc = gspread.authorize(creds)
-        self.sh = self.gc.open_by_key(cfg.spreadsheet_id)
-        self.ws_book = self._get_or_create_ws(cfg.sheet_bookings, cols=len(HEADERS_BOOK))
-        self.ws_cal = self._get_or_create_ws(cfg.sheet_calendar, cols=1 + len(cfg.time_slots))
-        self._ensure_headers()
+            creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+
+            t0 = time.monotonic()
+            gc = gspread.authorize(creds, http_client=LimitedHTTPClient)
+            sh = gc.open_by_key(cfg.spreadsheet_id)
+            self._gc, self._sh = gc, sh
+            self._ws_book = self._get_or_create_ws(cfg.sheet_bookings, cols=len(HEADERS_BOOK))
+            ws_cal = self._get_or_create_ws(cfg.sheet_calendar, cols=1 + len(cfg.time_slots))
+            self._ensure_headers(self._ws_book, ws_cal)
+            self._ws_cal = ws_cal  # последним: по нему проверяем, что подключение готово
+            log.info("Sheets connected in %.2fs", time.monotonic() - t0)
+
+    @contextmanager
+    def _locked(self):
+        """self._lock, но сперва подключение: сетевые вызовы под локом уже не ждут _conn_lock."""
+        self._connect()
+        with self._lock:
+            yield
+
+    @property
+    def gc(self):
+        self._connect()
+        return self._gc
+
+    @property
+    def sh(self):
+        self._connect()
+        return self._sh
+
+    @property
+    def ws_book(self):
+        self._connect()
+        return self._ws_book
+
+    @property
+    def ws_cal(self):
+        self._connect()
+        return self._ws_cal
+
+    def stop(self):
+        """Дописать отложенные записи в таблицу (хук для on_shutdown)."""
+        self._follow_stop.set()
+        self.writes.stop()
+
+    def backlog(self) -> int:
+        """Сколько записей ещё не дошло до таблицы."""
+        return self.writes.depth()
+
+    def warmup(self):
+        """Подключиться и построить индексы заранее (фоном после старта вебхука), с таймингом фаз."""
+        for name, fn in (("connect", self._connect), ("change feed", self.follow_changes),
+                         ("calendar index", self._cal_index), ("bookings index", self._book_index)):
+            t0 = time.monotonic()
+            fn()
+            log.info("Sheets warmup: %s %.2fs", name, time.monotonic() - t0)
+
+    # --------------------- change feed ---------------------
+
+    def _ttl(self) -> float:
+        """Сколько доверять индексам: пока лента правок читается — долго (она и так их обновляет), иначе CACHE_TTL."""
+        if self._feed_ok_at and time.monotonic() - self._feed_ok_at < 3 * cfg.changes_poll_s + 30:
+            return max(cfg.changes_resync_s, cfg.cache_ttl)
+        return cfg.cache_ttl
+
+    def follow_changes(self):
+        """Запомнить конец ленты правок (до чтения листов) и опрашивать её фоном раз в CHANGES_POLL_S."""
+        if cfg.changes_poll_s <= 0 or self._feed_cursor is not None:
+            return
+        self._feed_cursor = self.feed.head()
+        if self._feed_cursor is None:
+            return
+        self._feed_ok_at = time.monotonic()
+        threading.Thread(target=self._follow_loop, name="sheets-changes", daemon=True).start()
+
+    def _follow_loop(self):
+        with background():
+            while not self._follow_stop.wait(cfg.changes_poll_s):
+                try:
+                    self.pull_changes()
+                except Exception as e:
+                    log.warning("Change feed poll failed: %s", e)
+
+    def pull_changes(self):
+        """Дочитать ленту и применить изменённые строки к индексам (или сбросить их, если догнать нельзя)."""
+        cursor, changes = self.feed.read(self._feed_cursor)
+        if changes is None:
+            log.info("Change feed: structural edit or gap, full reread")
+            self.resync()
+        elif changes:
+            book, cal_headers, cal = self.feed.fetch(changes)
+            self.apply_book_rows(book)
+            self.apply_cal_rows(cal_headers, cal)
+        self._feed_cursor = cursor
+        self._feed_ok_at = time.monotonic()
+
+    def resync(self):
+        """Забыть все индексы: перечитаются при следующем обращении."""
+        with self._lock:
+            self.invalidate_calendar()
+            self.invalidate_bookings()
+            self._recent_loaded = self._agenda_loaded = False
+            self._book_gen += 1
+            self._month_busy.clear()
+            self._rid_month.clear()
+
+    def apply_book_rows(self, rows: Dict[int, List[str]]):
+        """Строки «Заявок», изменённые руками (номер строки -> значения), — в индексы и кэши."""
+        records = {}
+        for i, vals in rows.items():
+            rec = dict(zip(HEADERS_BOOK, list(vals) + [""] * (len(HEADERS_BOOK) - len(vals))))
+            rid = str(rec["RequestID"]).strip()
+            records[i] = self._with_pending(rid, rec) if rid else None
+        with self._lock:
+            for i, rec in records.items():
+                if rec is None:
+                    self.invalidate_bookings()  # строку очистили — номера строк в индексе под вопросом
+                    self._recent_loaded = self._agenda_loaded = False
+                    self._book_gen += 1
+                    continue
+                rid = str(rec["RequestID"]).strip()
+                self._journal_put(rid, rec)
+                is_new = rid not in self._book_rows
+                if self._book_loaded_at and self._book_rows.get(rid) != i:
+                    if not is_new:
+                        self.invalidate_bookings()  # RequestID переехал в другую строку
+                    else:
+                        self._book_index_row(i, rid)
+                        self._book_last_row = max(self._book_last_row, i)
+                if self._recent_loaded:
+                    old = self._recent_by_rid.get(rid)
+                    if old is not None and str(old.get("TelegramID")) == str(rec["TelegramID"]):
+                        old.clear()
+                        old.update(rec)
+                    elif old is not None or is_new:
+                        self._recent_loaded = False  # новая/переназначенная заявка — соберём заново
+                        self._book_gen += 1
+                if self._agenda_loaded:
+                    self._agenda_put(rec)
+                self._month_put(rid, rec)
+
+    def apply_cal_rows(self, headers: List[str] | None, rows: Dict[int, List[str]]):
+        """Строки «Календаря», изменённые руками, — в индекс дня и кэш ячеек."""
+        with self._lock:
+            if not self._cal_loaded_at:
+                return
+            if headers is not None:
+                self._cal_headers = list(headers)
+            by_row = {r: d for d, r in self._cal_rows.items()}
+            for i, cells in rows.items():
+                d = cells[0] if cells else ""
+                if by_row.get(i, d) != d or self._cal_rows.get(d, i) != i:
+                    self.invalidate_calendar()  # дату в строке поменяли/перенесли — перестроим индекс
+                    return
+                if d:
+                    self._cal_put(d, cells, row=i)
 
     # --------------------- internal utils ---------------------
 
     def _get_or_create_ws(self, title: str, cols: int):
         try:
-            return self.sh.worksheet(title)
+            return self._sh.worksheet(title)
         except gspread.WorksheetNotFound:
-            return self.sh.add_worksheet(title=title, rows=1000, cols=cols)
+            return self._sh.add_worksheet(title=title, rows=1000, cols=cols)
 
-    def _ensure_headers(self):
-        vals = self.ws_book.get_values("1:1")
+    @staticmethod
+    def _ensure_headers(ws_book, ws_cal):
+        """Шапки обоих листов. Зовётся из _connect, поэтому индексов (и self._lock) не касается."""
+        vals = ws_book.get_values("1:1")
         if not vals or vals[0] != HEADERS_BOOK:
-            self.ws_book.update("A1", [HEADERS_BOOK])
+            ws_book.update("A1", [HEADERS_BOOK])
 
         cal_hdrs = ["Date"] + cfg.time_slots
-        vals_c = self.ws_cal.get_values("1:1")
+        vals_c = ws_cal.get_values("1:1")
         if not vals_c or vals_c[0] != cal_hdrs:
-            self.ws_cal.update("A1", [cal_hdrs])
+            ws_cal.update("A1", [cal_hdrs])
+
+    def _cal_index(self) -> Dict[str, int]:
+        """
+        date -> row для «Календаря». Строится одним чтением листа (строка в день, лист небольшой),
+        заодно запоминаем значения строк — по ним подсказки свободного времени (suggest_slots)
+        считаются без обращений к API. Дальше поддерживается инкрементально (каждое чтение/запись дня
+        обновляет свою строку); перестраивается по TTL (ручные правки в таблице) или после invalidate_calendar().
+        Лист читается вне self._lock, дни, записанные за это время, берутся из памяти, а не из прочитанного.
+        Под self._lock не вызывать (см. порядок локов в __init__).
+        """
+        with self._locked():
+            if self._cal_fresh():
+                return self._cal_rows
+        with self._cal_load_lock:
+            with self._lock:
+                if self._cal_fresh():
+                    return self._cal_rows  # перечитал соседний поток, пока ждали
+                gen = self._cal_gen
+                self._cal_reading = True
+                self._cal_touched.clear()
+            sheets_cache.inc("calendar", "reload")
+            try:
+                vals = self.ws_cal.get_all_values()
+            finally:
+                with self._lock:
+                    self._cal_reading = False
+            headers = list(vals[0]) if vals else []
+            rows, cells = {}, {}
+            for i, r in enumerate(vals[1:], start=2):
+                if r and r[0]:
+                    rows[r[0]] = i
+                    cells[r[0]] = list(r)
+            with self._lock:
+                for d in self._cal_touched:
+                    if d in self._cal_rows:
+                        rows[d] = self._cal_rows[d]
+                    if d in self._cal_cells:
+                        cells[d] = self._cal_cells[d]
+                old = self._cal_headers
+                if len(old) > len(headers) and old[:len(headers)] == headers:
+                    headers = list(old)  # колонку под кастомный слот дописали, пока читали
+                self._cal_headers, self._cal_rows, self._cal_cells = headers, rows, cells
+                self._cal_last_row = max([len(vals)] + list(rows.values()))
+                self._cal_loaded_at = time.monotonic() if gen == self._cal_gen else 0.0
+                return rows
+
+    def _cal_fresh(self) -> bool:
+        return bool(self._cal_loaded_at) and time.monotonic() - self._cal_loaded_at < self._ttl()
+
+    def _cal_put(self, date_iso: str, cells: List[str], row: int | None = None):
+        """Строка дня в индекс (под self._lock); идёт перечитка листа — пометить день, чтобы она его не затёрла."""
+        if row is not None:
+            self._cal_rows[date_iso] = row
+            self._cal_last_row = max(self._cal_last_row, row)
+        self._cal_cells[date_iso] = list(cells)
+        if self._cal_reading:
+            self._cal_touched.add(date_iso)
+
+    def invalidate_calendar(self):
+        with self._lock:
+            self._cal_loaded_at = 0.0
+            self._cal_gen += 1
+
+    def _cal_headers_list(self) -> List[str]:
+        self._cal_index()
+        with self._lock:
+            return list(self._cal_headers)
 
     def _cal_header_map(self) -> dict:
-        headers = self.ws_cal.row_values(1)
-        return {h: i + 1 for i, h in enumerate(headers)}
+        return {h: i + 1 for i, h in enumerate(self._cal_headers_list())}
 
     def _book_header_map(self) -> dict:
         # индексы колонок на листе заявок
@@ -64,181 +458,543 @@ class Sheets:
 
     # --------------------- bookings ---------------------------
 
+    def _book_index(self, force: bool = False) -> Dict[str, int]:
+        """
+        RequestID -> row для «Заявок». Один batch_get колонки RequestID при старте/по TTL,
+        дальше обновляется из ответов append_rows. Колонка читается вне self._lock — запись заявок
+        и статусов чтения не ждёт; строки, дописанные очередью за это время, переносятся из старого
+        индекса. force — перечитать, если индекс собран из чтения, начатого раньше этого вызова.
+        Под self._lock не вызывать.
+        """
+        called = time.monotonic()
+        with self._locked():
+            if not force and self._book_fresh():
+                return self._book_rows
+        with self._book_load_lock:
+            with self._lock:
+                if self._book_loaded_at and (self._book_read_at >= called if force else self._book_fresh()):
+                    return self._book_rows  # перечитал соседний поток, пока ждали
+                gen, started = self._book_idx_gen, time.monotonic()
+                self._book_reading = True
+                self._book_landed = {}
+            sheets_cache.inc("bookings", "reload")
+            col = rowcol_to_a1(1, self._book_header_map()['RequestID'])[:-1]
+            try:
+                cols = self.ws_book.batch_get([f"{col}:{col}"])[0]
+            finally:
+                with self._lock:
+                    self._book_reading = False
+            rows: Dict[str, int] = {}
+            for i, r in enumerate(cols[1:], start=2):
+                rid = str(r[0] if r else "").strip()
+                if rid:
+                    rows[rid] = i
+            with self._lock:
+                # дописанное очередью, пока читали, могло в прочитанное не попасть
+                rows.update((rid, i) for rid, i in self._book_landed.items() if rid not in rows)
+                old_rows, self._book_rows = self._book_rows, rows
+                self._book_last_row = max([len(cols)] + list(rows.values()))
+                fresh = gen == self._book_idx_gen
+                self._book_loaded_at = time.monotonic() if fresh else 0.0
+                self._book_read_at = started
+                if old_rows and old_rows != rows:
+                    # строки добавили/удалили/переставили руками — производные индексы собрать заново
+                    self._recent_loaded = False
+                    self._agenda_loaded = False
+                    self._book_gen += 1
+                return rows
+
+    def _book_fresh(self) -> bool:
+        return bool(self._book_loaded_at) and time.monotonic() - self._book_loaded_at < self._ttl()
+
+    def _book_index_row(self, row: int, request_id):
+        rid = str(request_id).strip()
+        if rid:
+            self._book_rows[rid] = row
+            if self._book_reading:
+                self._book_landed[rid] = row
+
+    def _book_appended(self, first_row: int | None, rows: List[List[str]]):
+        """Хук write-behind очереди: строки легли в таблицу начиная с first_row."""
+        with self._lock:
+            if not first_row:
+                self.invalidate_bookings()  # не знаем куда легло — перечитаем при следующем обращении
+                return
+            rid_i = HEADERS_BOOK.index("RequestID")
+            for i, vals in enumerate(rows):
+                self._book_index_row(first_row + i, vals[rid_i])
+            self._book_last_row = max(self._book_last_row, first_row + len(rows) - 1)
+
+    def invalidate_bookings(self):
+        with self._lock:
+            self._book_loaded_at = 0.0
+            self._book_idx_gen += 1
+
     def find_row_by_request_id(self, request_id: str) -> int | None:
-        ws = self.ws_book
+        rid = str(request_id).strip()
+        row = self._book_index().get(rid)
+        if row is None and self._book_loaded_at and time.monotonic() - self._book_loaded_at > 1:
+            # промах: возможно, строку добавили руками — перечитаем индекс (не чаще раза в секунду)
+            row = self._book_index(force=True).get(rid)
+        return row
+
+    def _book_rows_for(self, request_ids) -> Dict[str, int]:
+        """
+        RequestID -> номер строки для нескольких заявок. Строки из индекса сверяем одним
+        batch_get ячеек RequestID: если таблицу сдвинули руками — перестраиваем индекс.
+        """
+        wanted = sorted({str(r) for r in request_ids})
         col = self._book_header_map()['RequestID']
-        values = ws.col_values(col)
-        for i, v in enumerate(values[1:], start=2):  # пропускаем шапку
-            if str(v).strip() == str(request_id):
-                return i
-        return None
+        for attempt in range(2):
+            rows = {rid: self.find_row_by_request_id(rid) for rid in wanted}
+            rows = {rid: r for rid, r in rows.items() if r}
+            if not rows:
+                return rows
+            got = self.ws_book.batch_get([rowcol_to_a1(r, col) for r in rows.values()])
+            if all(g and g[0] and str(g[0][0]).strip() == rid for rid, g in zip(rows, got)):
+                return rows
+            self._book_index(force=True)
+        return rows
+
+    def _with_pending(self, request_id: str, row: dict | None) -> dict | None:
+        """Накладываем ещё не записанные (write-behind) операции поверх строки из таблицы."""
+        for op in self.writes.pending(request_id):
+            if op.kind == "append":
+                row = dict(zip(HEADERS_BOOK, op.values))
+            elif row is not None:
+                row.update(op.fields)
+        return row
 
     def get_by_request_id(self, request_id: str) -> dict | None:
-        row_i = self.find_row_by_request_id(request_id)
-        if not row_i:
-            return None
-        row_vals = self.ws_book.row_values(row_i)
-        if len(row_vals) < len(HEADERS_BOOK):
-            row_vals += [""] * (len(HEADERS_BOOK) - len(row_vals))
-        return dict(zip(HEADERS_BOOK, row_vals))
+        pending = self.writes.pending(request_id)
+        row = None
+        if not (pending and pending[0].kind == "append"):
+            for attempt in range(2):
+                row_i = self.find_row_by_request_id(request_id)
+                if not row_i:
+                    break
+                row_vals = self.ws_book.row_values(row_i)
+                if len(row_vals) < len(HEADERS_BOOK):
+                    row_vals += [""] * (len(HEADERS_BOOK) - len(row_vals))
+                cand = dict(zip(HEADERS_BOOK, row_vals))
+                if str(cand["RequestID"]).strip() == str(request_id):
+                    row = cand
+                    break
+                self._book_index(force=True)  # строка уехала — индекс устарел
+        return self._with_pending(request_id, row)
 
     def set_status(self, request_id: str, status: str,
                    admin_comment: str | None = None,
                    date_iso: str | None = None,
-                   time_slot: str | None = None):
-        row = self.find_row_by_request_id(request_id)
-        if not row:
+                   time_slot: str | None = None) -> WriteOp:
+        if not self.writes.pending(request_id) and not self.find_row_by_request_id(request_id):
             raise ValueError("RequestID not found")
 
-        ws = self.ws_book
-        h = self._book_header_map()
-
-        if status is not None:
-            ws.update_cell(row, h['Status'], status)
-        if admin_comment is not None:
-            ws.update_cell(row, h['AdminComment'], admin_comment)
-        if date_iso is not None:
-            ws.update_cell(row, h['DateISO'], date_iso)
-        if time_slot is not None:
-            ws.update_cell(row, h['TimeSlot'], time_slot)
+        fields = {"Status": status, "AdminComment": admin_comment, "DateISO": date_iso, "TimeSlot": time_slot}
+        # все изменённые ячейки строки уйдут одним batch_update при ближайшем сливе очереди
+        changed = {k: v for k, v in fields.items() if v is not None}
+        op = self.writes.update(request_id, changed)
+        rid = str(request_id)
+        with self._lock:
+            self._journal_put(rid, changed)
+            self._month_put(rid, changed)
+            if rid in self._recent_by_rid:
+                self._recent_by_rid[rid].update(changed)
+            known = self._agenda_by_rid.get(rid, (None, None))[1] or self._recent_by_rid.get(rid)
+            if not self._agenda_loaded:
+                return op
+        # подтверждённая заявка попадает в /agenda; строку берём из памяти, иначе (редко) — из таблицы
+        row = {**known, **changed} if known else self.get_by_request_id(rid)
+        if row:
+            with self._lock:
+                self._agenda_put(row)
+        return op
 
-    def append_booking(self, row: Dict):
-        ordered = [row.get(h, "") for h in HEADERS_BOOK]
-        self.ws_book.append_row(ordered, value_input_option="USER_ENTERED")
+    def append_booking(self, row: Dict) -> WriteOp:
+        """Строка в write-behind очередь; по возвращённой операции (op.ok) видно, легла ли она в таблицу."""
+        ordered = [str(row.get(h, "")) for h in HEADERS_BOOK]
+        op = self.writes.append(row.get("RequestID", ""), ordered)
+        with self._lock:
+            self._journal_put(str(row.get("RequestID", "")), dict(zip(HEADERS_BOOK, ordered)))
+            self._month_put(str(row.get("RequestID", "")), dict(zip(HEADERS_BOOK, ordered)))
+            if self._recent_loaded:
+                self._recent_push(str(row.get("TelegramID", "")), dict(zip(HEADERS_BOOK, ordered)))
+            if self._agenda_loaded:
+                self._agenda_put(dict(zip(HEADERS_BOOK, ordered)))
+        return op
 
     def update_status(self, request_id: str, status: str, admin_comment: str = "") -> bool:
-        cells = self.ws_book.findall(request_id)
-        target_row = None
-        for c in cells:
-            if c.col == HEADERS_BOOK.index("RequestID")+1:
-                target_row = c.row
-                break
-        if not target_row:
+        try:
+            self.set_status(request_id, status, admin_comment=admin_comment or None)
+        except ValueError:
             return False
-        self.ws_book.update_cell(target_row, HEADERS_BOOK.index("Status")+1, status)
-        if admin_comment:
-            self.ws_book.update_cell(target_row, HEADERS_BOOK.index("AdminComment")+1, admin_comment)
         return True
 
-    def user_recent(self, telegram_id: int, limit: int = 5) -> List[Dict]:
+    def _all_bookings(self) -> List[Dict]:
+        """Все строки «Заявок» (get_all_records) + ещё не записанные из write-behind очереди."""
         values = self.ws_book.get_all_records()
-        rows = [r for r in values if str(r.get("TelegramID")) == str(telegram_id)]
-        rows.sort(key=lambda r: r.get("Timestamp",""), reverse=True)
-        return rows[:limit]
+        values += [dict(zip(HEADERS_BOOK, op.values)) for op in self.writes.pending_appends()]
+        return [self._with_pending(str(r.get("RequestID")), dict(r)) for r in values]
+
+    def _journal_put(self, request_id: str, fields: Dict):
+        """Правка заявки (под self._lock): если сейчас идёт полная пересборка — запомнить для неё."""
+        if self._rebuilding:
+            self._journal.append((request_id, dict(fields)))
+
+    def _rebuild_from_bookings(self, build):
+        """
+        Полная пересборка производного индекса «Заявок». Таблица читается вне self._lock — запись
+        слотов и заявок чтения всей таблицы не ждёт; правки, пришедшие за время чтения, накладываются
+        из журнала, и build(rows, fresh) вызывается уже под локом. fresh=False — пока читали, индексы
+        сбросили (resync, ручные правки): собранное годится для ответа, но загруженным не считается.
+        """
+        with self._locked():
+            self._rebuilding += 1
+            mark, gen = len(self._journal), self._book_gen
+        try:
+            rows = self._all_bookings()
+        except BaseException:
+            with self._lock:
+                self._rebuild_done()
+            raise
+        with self._lock:
+            by_rid = {str(r.get("RequestID")): r for r in rows}
+            for rid, fields in self._journal[mark:]:
+                if rid in by_rid:
+                    by_rid[rid].update(fields)
+                elif "RequestID" in fields:  # целая строка (добавление), а не правка полей
+                    by_rid[rid] = dict(fields)
+                    rows.append(by_rid[rid])
+            self._rebuild_done()
+            build(rows, gen == self._book_gen)
+
+    def _rebuild_done(self):
+        self._rebuilding -= 1
+        if not self._rebuilding:
+            self._journal.clear()
+
+    def _recent_index(self) -> Dict[str, deque]:
+        """
+        TelegramID -> последние заявки (deque, слева самые свежие по Timestamp, не длиннее
+        cfg.user_recent_max). Полная сборка — на старте и когда индекс «Заявок» заметил
+        ручные правки (см. _rebuild_from_bookings); дальше поддерживается из append_booking/set_status.
+        """
+        if self._recent_loaded:
+            return self._recent
+        with self._rebuild_lock:
+            if not self._recent_loaded:
+                self._rebuild_from_bookings(self._recent_build)
+        return self._recent
+
+    def _recent_build(self, rows: List[Dict], fresh: bool):
+        by_user: Dict[str, List[Dict]] = {}
+        for r in rows:
+            by_user.setdefault(str(r.get("TelegramID")), []).append(r)
+        self._recent, self._recent_by_rid = {}, {}
+        for tg, user_rows in by_user.items():
+            user_rows.sort(key=lambda r: r.get("Timestamp", ""))
+            for r in user_rows:
+                self._recent_push(tg, r)
+        self._recent_loaded = fresh
+
+    def _recent_push(self, telegram_id: str, row: Dict):
+        d = self._recent.setdefault(telegram_id, deque(maxlen=cfg.user_recent_max))
+        if len(d) == d.maxlen:
+            self._recent_by_rid.pop(str(d[-1].get("RequestID")), None)
+        d.appendleft(row)
+        self._recent_by_rid[str(row.get("RequestID"))] = row
+
+    def user_recent(self, telegram_id: int, limit: int = 5) -> List[Dict]:
+        if limit > cfg.user_recent_max:
+            rows = [r for r in self._all_bookings() if str(r.get("TelegramID")) == str(telegram_id)]
+            rows.sort(key=lambda r: r.get("Timestamp",""), reverse=True)
+            return rows[:limit]
+        self._recent_index()
+        with self._lock:
+            d = self._recent.get(str(telegram_id)) or ()
+            return [dict(r) for r in list(d)[:limit]]
+
+    # --------------------- agenda timeline ---------------------------
+
+    def _agenda_index(self):
+        """Подтверждённые заявки, отсортированные по времени начала: [(dt, RequestID)].
+        Полная сборка читает таблицу вне self._lock (см. _rebuild_from_bookings)."""
+        if self._agenda_loaded:
+            return
+        with self._rebuild_lock:
+            if not self._agenda_loaded:
+                self._rebuild_from_bookings(self._agenda_build)
+
+    def _agenda_build(self, rows: List[Dict], fresh: bool):
+        self._agenda, self._agenda_by_rid = [], {}
+        for r in rows:
+            self._agenda_put(r)
+        self._agenda_loaded = fresh
+
+    def _agenda_put(self, row: Dict):
+        rid = str(row.get("RequestID"))
+        old = self._agenda_by_rid.pop(rid, None)
+        if old:
+            i = bisect.bisect_left(self._agenda, (old[0], rid))
+            if i < len(self._agenda) and self._agenda[i] == (old[0], rid):
+                del self._agenda[i]
+        if str(row.get("Status") or "").strip() != "Подтверждена":
+            return
+        dt = _agenda_dt(row)
+        if dt:
+            bisect.insort(self._agenda, (dt, rid))
+            self._agenda_by_rid[rid] = (dt, dict(row))
+
+    def agenda(self, start: datetime, end: datetime, offset: int = 0, limit: int = 20) -> tuple[List[tuple], int]:
+        """Срез подтверждённых записей в [start, end]: (страница [(dt, row)], сколько всего в диапазоне)."""
+        self._agenda_index()
+        with self._lock:
+            lo = bisect.bisect_left(self._agenda, (start, ""))
+            hi = bisect.bisect_right(self._agenda, (end, "\uffff"))
+            page = self._agenda[lo + offset: min(hi, lo + offset + limit)]
+            return [(dt, dict(self._agenda_by_rid[rid][1])) for dt, rid in page], hi - lo
+
+    # --------------------- month busy-day cache ---------------------------
+
+    def booked_days_for_month(self, year: int, month: int, statuses) -> set[int]:
+        """
+        Дни месяца, где есть заявки с одним из statuses (для точек в календаре).
+        LRU-кэш по месяцу (заявка -> день и статус, так что любые statuses считаются из одной записи);
+        промах — одно чтение «Заявок» вне self._lock (см. _rebuild_from_bookings), которым заодно
+        заполняем соседние месяцы. Добавления и смены статуса правят кэш на месте (_month_put).
+        """
+        ym, statuses = (year, month), frozenset(statuses)
+        with self._lock:
+            hit = self._month_busy.get(ym)
+            if hit and time.monotonic() - hit[1] < self._ttl():
+                self._month_busy.move_to_end(ym)
+                sheets_cache.inc("month", "hit")
+                return _busy_days(hit[0], statuses)
+            wanted = {_shift_month(year, month, d) for d in (-1, 0, 1)}
+            epochs = {k: self._month_epoch.get(k, 0) for k in wanted}
+        sheets_cache.inc("month", "miss")
+
+        result: Dict = {}
+
+        def build(rows: List[Dict], fresh: bool):
+            months: Dict[tuple, Dict] = {k: {} for k in wanted}
+            for i, r in enumerate(rows):
+                k, day = _month_day(r.get("DateISO"))
+                if k in months:
+                    rid = str(r.get("RequestID") or "").strip() or f"#{i}"
+                    months[k][rid] = (day, str(r.get("Status") or "").strip())
+            result.update(months[ym])
+            if not fresh:
+                return
+            now = time.monotonic()
+            for k, entries in months.items():
+                if self._month_epoch.get(k, 0) != epochs[k]:
+                    continue  # месяц сбросили, пока читали, — прочитанное могло устареть
+                self._month_drop(k)
+                self._month_busy[k] = (entries, now)
+                self._rid_month.update((rid, k) for rid in entries)
+            while len(self._month_busy) > cfg.month_cache_size:
+                self._month_drop(next(iter(self._month_busy)))
+
+        self._rebuild_from_bookings(build)
+        return _busy_days(result, statuses)
+
+    def month_cached(self, year: int, month: int, statuses=None) -> bool:
+        """Есть ли месяц в кэше. Зовётся из event loop, поэтому без self._lock (его держат через
+        запросы к Google): одиночный get по словарю атомарен, устаревший ответ — лишь лишняя подгрузка."""
+        hit = self._month_busy.get((year, month))
+        return bool(hit) and time.monotonic() - hit[1] < self._ttl()
+
+    def _month_put(self, request_id: str, fields: Dict):
+        """Заявке поменяли поля (DateISO/Status) — перенести её в закэшированных месяцах (под self._lock)."""
+        old_ym = self._rid_month.pop(request_id, None)
+        old = self._month_busy[old_ym][0].pop(request_id, None) if old_ym in self._month_busy else None
+        ym, (day, status) = old_ym, old or (None, None)
+        if fields.get("DateISO") is not None:
+            ym, day = _month_day(fields["DateISO"])
+        if fields.get("Status") is not None:
+            status = str(fields["Status"]).strip()
+        hit = self._month_busy.get(ym)
+        if hit is not None and day is not None and status is not None:
+            hit[0][request_id] = (day, status)
+            self._rid_month[request_id] = ym
+
+    def _month_drop(self, ym: tuple):
+        hit = self._month_busy.pop(ym, None)
+        for rid in hit[0] if hit else ():
+            if self._rid_month.get(rid) == ym:
+                del self._rid_month[rid]
+
+    def invalidate_month(self, date_iso: str | None = None, request_id: str | None = None):
+        """Сбросить кэш месяца по дате и/или по месяцу, где числилась заявка."""
+        with self._lock:
+            months = {_month_day(date_iso)[0], self._rid_month.get(str(request_id)) if request_id else None}
+            for ym in months - {None}:
+                self._month_epoch[ym] = self._month_epoch.get(ym, 0) + 1
+                self._month_drop(ym)
 
     # --------------------- calendar ---------------------------
 
     def ensure_day_row(self, date_iso: str) -> int:
-        all_vals = self.ws_cal.get_all_values()
-        idx = {r[0]: i+1 for i, r in enumerate(all_vals) if r}
-        if date_iso in idx:
-            return idx[date_iso]
-        next_row = len(all_vals) + 1
-        if next_row == 1:
-            self._ensure_headers()
-            next_row = 2
-        self.ws_cal.update(f"A{next_row}", [[date_iso] + [""]*len(cfg.time_slots)])
-        return next_row
+        """
+        Номер строки дня в «Календаре»; нет строки — дописываем её через values.append (как заявки):
+        номер из индекса мог устареть, а append сам найдёт конец листа и не затрёт чужую строку.
+        Дописывает один поток за раз (_cal_append_lock), запрос идёт вне self._lock.
+        """
+        row = self._cal_index().get(date_iso)
+        if row is None and time.monotonic() - self._cal_loaded_at > 1:
+            # промах: возможно, день уже дописал админ или другой инстанс — перечитаем индекс
+            self.invalidate_calendar()
+            row = self._cal_index().get(date_iso)
+        if row:
+            return row
+        with self._cal_append_lock:
+            row = self._cal_index().get(date_iso)  # пока ждали, день мог дописать соседний поток
+            if row:
+                return row
+            if not self._cal_last_row:
+                self._ensure_headers(self.ws_book, self.ws_cal)
+            resp = self.ws_cal.append_row([date_iso] + [""] * len(cfg.time_slots), table_range="A1")
+            row = first_appended_row(resp)
+            if not row:
+                self.invalidate_calendar()  # не знаем, куда легло, — найдём по индексу
+                row = self._cal_index().get(date_iso)
+                if not row:
+                    raise RuntimeError(f"Строка дня {date_iso} не найдена в «{cfg.sheet_calendar}»")
+                return row
+            with self._lock:
+                if row != self._cal_last_row + 1:
+                    self.invalidate_calendar()  # кто-то дописывал лист мимо нас — индекс перечитается
+                self._cal_put(date_iso, [date_iso], row=row)
+            return row
 
     def get_availability(self, date_iso: str) -> Dict[str, str]:
-        from .parsing import slot_to_minutes
-        row = self.ensure_day_row(date_iso)
-        headers = self.ws_cal.row_values(1)
-        hdr = {h: i + 1 for i, h in enumerate(headers)}
-        # если «Весь день» уже стоит — все занято
-        col_all = hdr.get("Весь день")
-        if col_all:
-            if (self.ws_cal.cell(row, col_all).value or "").strip():
-                return {h: "ALL_DAY" for h in headers[1:]}
-        # обычный случай
-        end_col = chr(ord('A') + len(headers) - 1)
-        cells = (self.ws_cal.get(f"A{row}:{end_col}{row}") or [[]])[0]
-        return {h: (cells[i] if i < len(cells) else "") for i, h in enumerate(headers[1:], start=1)}
+        _, headers, cells = self._read_day(date_iso)
+        return _day_availability(headers, cells)
+
+    def availability_range(self, start_iso: str, days: int) -> Dict[str, Dict[str, str]]:
+        """
+        Доступность на days дней с start_iso: date_iso -> то же, что get_availability.
+        Одно чтение: шапка + строки нужных дней одним batch_get (номера строк — из индекса);
+        дней без строки в «Календаре» не создаём — они просто свободны. Если строки дней так и
+        не сошлись с индексом (таблицу правят прямо сейчас) — RuntimeError, чужую строку не показываем.
+        """
+        d0 = date.fromisoformat(start_iso)
+        dates = [(d0 + timedelta(days=k)).isoformat() for k in range(days)]
+        for _ in range(2):
+            self._cal_index()
+            with self._lock:
+                rows = {d: self._cal_rows[d] for d in dates if d in self._cal_rows}
+            got = self.ws_cal.batch_get(["1:1"] + [f"{r}:{r}" for r in rows.values()])
+            headers = list(got[0][0]) if got[0] else []
+            cells = {d: list(v[0]) if v else [] for d, v in zip(rows, got[1:])}
+            moved = [d for d, c in cells.items() if not (c and c[0] == d)]
+            if not moved:
+                break
+            self.invalidate_calendar()  # строки сдвинули руками — перечитаем индекс и повторим
+        else:
+            raise RuntimeError(f"Строки дней {', '.join(moved)} не найдены в «{cfg.sheet_calendar}»")
+        with self._lock:
+            self._cal_headers = headers
+            for d, c in cells.items():
+                self._cal_put(d, c)
+        return {d: _day_availability(headers, cells.get(d, [])) for d in dates}
+
+    def _read_day(self, date_iso: str) -> tuple[int, List[str], List[str]]:
+        """Строка дня + шапка одним batch_get. Если строка уехала (ручная правка) — перестроим индекс."""
+        for _ in range(2):
+            row = self.ensure_day_row(date_iso)
+            hdr_vals, row_vals = self.ws_cal.batch_get(["1:1", f"{row}:{row}"])
+            headers = list(hdr_vals[0]) if hdr_vals else []
+            cells = list(row_vals[0]) if row_vals else []
+            if cells and cells[0] == date_iso:
+                with self._lock:
+                    self._cal_headers = headers
+                    self._cal_put(date_iso, cells)
+                return row, headers, cells
+            self.invalidate_calendar()
+        raise RuntimeError(f"Строка дня {date_iso} не найдена в «{cfg.sheet_calendar}»")
 
     def mark_slot(self, date_iso: str, slot: str, text: str) -> bool:
-        from .parsing import slot_to_minutes
-        row = self.ensure_day_row(date_iso)
-        hdr = self._cal_header_map()
-        # защита от «Весь день»
-        if slot != "Весь день":
-            col_all = hdr.get("Весь день")
-            if col_all and (self.ws_cal.cell(row, col_all).value or "").strip():
+        """
+        Бронирование слота: одно чтение (шапка + строка дня), проверка «Весь день» и пересечений
+        локально, одна пакетная запись. Чтение и запись идут под локом — в пределах процесса
+        между проверкой и записью никто не вклинится.
+        """
+        with self._cal_write_lock:
+            row, headers, cells = self._read_day(date_iso)
+            if DayOccupancy(headers, cells).conflicts(slot):
                 return False
-        # «Весь день» нельзя ставить, если есть что-то в день
-        if slot == "Весь день":
-            row_vals = self.ws_cal.row_values(row)
-            if any((c or "").strip() for c in (row_vals[1:] or [])):
-                return False
-        # проверка пересечений
-        if self.is_occupied(date_iso, slot):
-            return False
-        # найдём/создадим колонку слота
-        col = hdr.get(slot)
-        if not col:
-            headers = self.ws_cal.row_values(1)
-            self.ws_cal.update("A1", [headers + [slot]])
-            hdr = self._cal_header_map()
-            col = hdr.get(slot)
-        # финально пишем
-        cur = self.ws_cal.cell(row, col).value or ""
-        if cur.strip():
-            return False
-        self.ws_cal.update_cell(row, col, text)
-        return True
+            updates = []
+            if slot in headers:
+                col = headers.index(slot) + 1
+            else:
+                # новой колонки под кастомный интервал ещё нет — допишем в шапку тем же запросом
+                col = len(headers) + 1
+                updates.append({"range": rowcol_to_a1(1, col), "values": [[slot]]})
+            updates.append({"range": rowcol_to_a1(row, col), "values": [[text]]})
+            self.ws_cal.batch_update(updates)
+            with self._lock:
+                if col > len(headers):
+                    self._cal_headers = headers + [slot]
+                self._cal_cell_set(date_iso, cells, col, text)
+            return True
 
     def clear_slot(self, date_iso: str, slot: str) -> bool:
-        row = self.ensure_day_row(date_iso)
-        hdr = self._cal_header_map()
-        col = hdr.get(slot)
-        if not col:
-            return False
-        cur = self.ws_cal.cell(row, col).value or ""
-        if not cur.strip():
-            return False
-        self.ws_cal.update_cell(row, col, "")
-        return True
+        with self._cal_write_lock:
+            row, headers, cells = self._read_day(date_iso)
+            if slot not in headers:
+                return False
+            col = headers.index(slot) + 1
+            if not (cells[col - 1] if col - 1 < len(cells) else "").strip():
+                return False
+            self.ws_cal.update_cell(row, col, "")
+            with self._lock:
+                self._cal_cell_set(date_iso, cells, col, "")
+            return True
+
+    def _cal_cell_set(self, date_iso: str, cells: List[str], col: int, text: str):
+        cells = list(cells) + [""] * (col - len(cells))
+        cells[col - 1] = text
+        self._cal_put(date_iso, cells)
+
+    def suggest_slots(self, date_iso: str, slot: str, days: int | None = None,
+                      limit: int | None = None) -> List[tuple[str, str]]:
+        """
+        Ближайшее свободное время той же длины, что slot: этот день и ещё days дней вперёд,
+        в рабочих часах cfg.suggest_hours с шагом cfg.suggest_step. Считается по строкам из индекса
+        «Календаря» (без запросов к API), поэтому это подсказка — сам слот проверит mark_slot.
+        Ранжирование: раньше день, ближе к желаемому началу. Возвращает [(date_iso, slot)].
+        """
+        dates = suggest_dates(date_iso, cfg.suggest_days if days is None else days)
+        self._cal_index()
+        with self._lock:
+            headers = list(self._cal_headers)
+            day_occ = [(d, DayOccupancy(headers, self._cal_cells.get(d, ()))) for d in dates]
+        return rank_suggestions(date_iso, slot, day_occ, cfg.suggest_limit if limit is None else limit)
+
+    def put_slots(self, date_iso: str, values: Dict[str, str]):
+        """Записать ячейки дня как есть, без проверки занятости (зеркалирование из src/local_store.py)."""
+        with self._cal_write_lock:
+            row, headers, cells = self._read_day(date_iso)
+            updates, headers = [], list(headers)
+            for slot, text in values.items():
+                if slot not in headers:
+                    headers.append(slot)
+                    updates.append({"range": rowcol_to_a1(1, len(headers)), "values": [[slot]]})
+                col = headers.index(slot) + 1
+                updates.append({"range": rowcol_to_a1(row, col), "values": [[text]]})
+                cells = list(cells) + [""] * (col - len(cells))
+                cells[col - 1] = text
+            if updates:
+                self.ws_cal.batch_update(updates)
+            with self._lock:
+                self._cal_headers = headers
+                self._cal_put(date_iso, cells)
 
     def is_occupied(self, date_iso: str, slot: str) -> bool:
-        from .parsing import slot_to_minutes
-        row = self.ensure_day_row(date_iso)
-        hdr = self._cal_header_map()
-        # день целиком?
-        if slot == "Весь день":
-            row_vals = self.ws_cal.row_values(row)
-            # занято, если что-то уже стоит в любом слоте
-            return any((c or "").strip() for c in (row_vals[1:] or []))
-        # если в дне уже «Весь день» — любой слот занят
-        col_all = hdr.get("Весь день")
-        if col_all and (self.ws_cal.cell(row, col_all).value or "").strip():
-            return True
-        # проверка пересечений интервалов
-        req = slot_to_minutes(slot)
-        if not req:
-            # если не распознали — fallback: занято, если ячейка слота непуста
-            col = hdr.get(slot)
-            if not col: return False
-            return bool((self.ws_cal.cell(row, col).value or "").strip())
-        rs, re = req if isinstance(req, tuple) else (None, None)
-        # пробегаем все занятые слоты дня
-        headers = self.ws_cal.row_values(1)
-        row_vals = self.ws_cal.row_values(row)
-        for i, h in enumerate(headers[1:], start=2):
-            val = (row_vals[i - 1] if i - 1 < len(row_vals) else "") or ""
-            if not val.strip():
-                continue
-            if h == "Весь день":
-                return True
-            existed = slot_to_minutes(h)
-            if not existed:
-                # неподдающийся парсингу слот — считаем конфликтным с кастомным
-                if hdr.get(slot) == i:
-                    return True
-                continue
-            es, ee = existed
-            # проверка пересечения [rs,re) & [es,ee)
-            if not (re <= es or ee <= rs):
-                return True
-        return False
+        _, headers, cells = self._read_day(date_iso)
+        return DayOccupancy(headers, cells).conflicts(slot)
 
     # NEW: список занятых дат в месяце (есть хотя бы одно занятие в день)
     def busy_dates_for_month(self, year:int, month:int) -> set[str]:
@@ -253,4 +1009,60 @@ class Sheets:
                     busy.add(d)
         return busy
 
+class AsyncSheets:
+    """
+    Асинхронный фасад над Sheets с той же поверхностью: await asheets.is_occupied(...).
+    gspread синхронный, поэтому каждый вызов уходит в ограниченный пул потоков —
+    медленный ответ Google не блокирует event loop и чужие апдейты.
+    """
+
+    RETRY_SHARE = 0.75  # остаток таймаута — на последний запрос, начатый до дедлайна
+
+    def __init__(self, backend: Sheets, workers: int, timeout: float):
+        self._backend = backend
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sheets")
+        self.timeout = timeout
+
+    async def run(self, fn, *args, timeout: float | None = None, **kwargs):
+        """Выполнить любой синхронный вызов (метод Sheets, ws.get_all_records и т.п.) в пуле.
+        Ожидания квоты и повторы в потоке укладываются в RETRY_SHARE таймаута (см. ratelimit.sheets_deadline):
+        вызов сдаётся сам и не доделывает запись после того, как хендлер получил asyncio.TimeoutError."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        timeout = timeout or self.timeout
+        # контекст (приоритет для лимитера, см. ratelimit.background) едет в поток вместе с вызовом
+        ctx = contextvars.copy_context()
+        ctx.run(sheets_deadline.set, time.monotonic() + timeout * self.RETRY_SHARE)
+        return await asyncio.wait_for(loop.run_in_executor(self._pool, ctx.run, call), timeout)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._backend, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await self.run(attr, *args, **kwargs)
+            except Exception:  # включая asyncio.TimeoutError пула
+                sheets_errors.inc(name)
+                raise
+            finally:
+                sheets_seconds.observe(time.perf_counter() - t0, name)
+
+        call.__name__ = name
+        return call
+
+    def queued(self) -> int:
+        """Сколько вызовов ждут свободного потока пула."""
+        return self._pool._work_queue.qsize()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
 sheets = Sheets()
+if cfg.store == "sqlite":
+    from .local_store import LocalStore
+    sheets = LocalStore(sheets, cfg.store_path, push_ms=cfg.store_push_ms, pull_s=cfg.store_pull_s)
+asheets = AsyncSheets(sheets, workers=cfg.sheets_workers, timeout=cfg.sheets_timeout)
@@ -0,0 +1,112 @@
+# src/slot_locks.py
+"""
+Блокировки слотов для on_confirm.
+
+Ключ — (дата, интервал в минутах). Ждут друг друга только пересекающиеся интервалы одной даты:
+10:00–12:00 и 11:00–13:00 сериализуются, 10:00–12:00 и 13:00–15:00 или другие даты — нет.
+«Весь день» и нераспознанные слоты занимают весь день.
+
+Между процессами (несколько инстансов за вебхуком) — опциональная аренда в Redis
+(SLOT_LEASE=redis): SET NX PX на дату, с автоистечением, если инстанс умер посреди записи.
+Аренда берётся на дату целиком, а не на интервал: пересечение интервалов одним ключом Redis
+не выразить. Поэтому между инстансами подтверждения одного дня идут по очереди даже для
+непересекающихся слотов. Держится она только на время mark_slot + append_booking (доли секунды),
+так что при записи на одну услугу это дешевле, чем аренда по набору ключей с упорядочиванием.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+
+from src.config import cfg
+from src.parsing import slot_to_minutes
+
+log = logging.getLogger("qwesade.bot")
+
+WHOLE_DAY = (0, 24 * 60)
+
+
+def slot_interval(slot: str) -> Tuple[int, int]:
+    """[start, end) в минутах; «Весь день» и всё нераспознанное — весь день."""
+    m = slot_to_minutes(slot)
+    if not m or m[0] == "all_day":
+        return WHOLE_DAY
+    return m
+
+
+class RedisLease:
+    """Аренда даты в Redis: SET key token NX PX ttl; снимаем только свою (сравнение токена в Lua)."""
+
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, url: str, ttl_ms: int, wait_s: float):
+        from redis.asyncio import Redis  # опциональная зависимость: pip install redis
+        self._redis = Redis.from_url(url)
+        self.ttl_ms = ttl_ms
+        self.wait_s = wait_s
+
+    async def acquire(self, date_iso: str) -> str:
+        key, token = f"qwesade:slot:{date_iso}", uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_s
+        delay = 0.02
+        while not await self._redis.set(key, token, nx=True, px=self.ttl_ms):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"slot lease for {date_iso} is busy")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        return token
+
+    async def release(self, date_iso: str, token: str):
+        try:
+            await self._redis.eval(self._RELEASE, 1, f"qwesade:slot:{date_iso}", token)
+        except Exception as e:
+            # не страшно: аренда истечёт сама через ttl
+            log.warning("Slot lease release failed for %s: %s", date_iso, e)
+
+
+class SlotLocks:
+    def __init__(self, lease: RedisLease | None = None):
+        self._held: Dict[str, List[Tuple[int, int, asyncio.Event]]] = {}
+        self._lease = lease
+
+    @asynccontextmanager
+    async def hold(self, date_iso: str, slot: str):
+        s, e = slot_interval(slot)
+        while True:
+            held = self._held.setdefault(date_iso, [])
+            waits = [ev for hs, he, ev in held if not (e <= hs or he <= s)]
+            if not waits:
+                break
+            tasks = [asyncio.create_task(ev.wait()) for ev in waits]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                # и когда отменили самого ждущего — иначе задачи ev.wait() висят до освобождения слота
+                for t in tasks:
+                    t.cancel()
+        entry = (s, e, asyncio.Event())
+        held.append(entry)
+        token = None
+        try:
+            if self._lease:
+                token = await self._lease.acquire(date_iso)
+            yield
+        finally:
+            if token:
+                await self._lease.release(date_iso, token)
+            held.remove(entry)
+            if not held:
+                self._held.pop(date_iso, None)
+            entry[2].set()
+
+
+def _build_lease() -> RedisLease | None:
+    if cfg.slot_lease == "redis":
+        return RedisLease(cfg.redis_url, ttl_ms=int(cfg.sheets_timeout * 3 * 1000), wait_s=cfg.sheets_timeout)
+    return None
+
+
+slot_locks = SlotLocks(lease=_build_lease())
@@ -0,0 +1,153 @@
+# src/tg_outbox.py
+"""
+Исходящие запросы к Bot API с учётом flood control Telegram.
+
+Outbox — request middleware сессии aiogram (bot.session.middleware(outbox)), через него идут все вызовы
+бота: send_step, якорь reply-клавиатуры, уведомления админов, message.answer, cb.answer...
+- отправка/правка сообщений берёт токен из ведра чата (TG_CHAT_PER_S, запас TG_CHAT_BURST)
+  и из общего ведра бота (TG_GLOBAL_PER_S): при всплеске заявок ждём, а не ловим 429;
+- TelegramRetryAfter — чат (или весь бот, если чата нет) замолкает на retry_after, запрос
+  повторяется до TG_RETRIES раз; если ждать дольше TG_MAX_WAIT_S — запрос отбрасывается;
+  5xx повторяются только для идемпотентных методов (правки, удаления, чтения): отправка после 5xx
+  могла уже дойти, и повтор задвоил бы сообщение;
+- правки одного сообщения одним методом, ждущие очереди, схлопываются: уходит только последняя,
+  остальные сразу возвращают True (так step_msg_id при быстрых кликах правится один раз);
+- ничего не теряется молча: счётчики sent / delayed / coalesced / retried / dropped (stats(), /quota)
+  и warning в лог на каждую отброшенную отправку; время и ошибки запросов — в /metrics.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from .config import cfg
+from .metrics import telegram_errors, telegram_seconds
+
+log = logging.getLogger("qwesade.telegram")
+
+LIMITED = ("Send", "Edit", "Copy", "Forward")   # методы, на которые у Telegram лимиты сообщений
+COALESCE = {"EditMessageText", "EditMessageReplyMarkup"}
+IDEMPOTENT = ("Edit", "Delete", "Get")           # повтор после 5xx не задвоит результат
+MAX_CHATS = 10_000                              # сколько вёдер чатов держать (LRU)
+
+
+class Bucket:
+    """Token bucket для asyncio: токен резервируется сразу (в долг), возвращается, сколько ждать."""
+
+    def __init__(self, per_second: float, burst: float):
+        self.rate = per_second
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.blocked_until = 0.0   # после RetryAfter
+        self._ts = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._ts) * self.rate)
+        self._ts = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Outbox(BaseRequestMiddleware):
+    def __init__(self, global_per_s: float, chat_per_s: float, chat_burst: float, retries: int, max_wait: float):
+        self.glob = Bucket(global_per_s, global_per_s)
+        self.chat_per_s, self.chat_burst = chat_per_s, chat_burst
+        self.retries, self.max_wait = retries, max_wait
+        self._chats: OrderedDict[int, Bucket] = OrderedDict()
+        self._edits: dict[tuple, int] = {}   # (метод, chat_id, message_id) -> номер последней поставленной правки
+        self._counts: Counter = Counter()
+
+    def _chat(self, chat_id: int) -> Bucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            b = self._chats[chat_id] = Bucket(self.chat_per_s, self.chat_burst)
+            while len(self._chats) > MAX_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return b
+
+    def stats(self) -> dict:
+        out = dict(self._counts)
+        out["global.tokens"] = round(self.glob.tokens, 1)
+        return out
+
+    async def _throttle(self, bucket: Bucket | None) -> float:
+        waited = 0.0
+        for b in (bucket, self.glob):
+            if b is not None:
+                pause = b.reserve()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    waited += pause
+        return waited
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> TelegramType:
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        limited = name.startswith(LIMITED) and isinstance(chat_id, int)
+        bucket = self._chat(chat_id) if limited else None
+        key = gen = None
+        if name in COALESCE and limited and getattr(method, "message_id", None):
+            key = (name, chat_id, method.message_id)  # правка разметки не отменяет правку текста
+            gen = self._edits[key] = self._edits.get(key, 0) + 1
+
+        t0 = time.perf_counter()
+        try:
+            for attempt in range(self.retries + 1):
+                if limited:
+                    waited = await self._throttle(bucket)
+                    if waited:
+                        self._counts["delayed"] += 1
+                        self._counts["wait_seconds"] += waited
+                if key and self._edits.get(key) != gen:
+                    # пока ждали очереди, то же сообщение поправили ещё раз — эта правка уже не нужна
+                    self._counts["coalesced"] += 1
+                    return True
+                try:
+                    result = await make_request(bot, method)
+                    self._counts["sent" if limited else "calls"] += 1
+                    return result
+                except TelegramRetryAfter as e:
+                    if e.retry_after > self.max_wait or attempt == self.retries:
+                        self._drop(name, chat_id, e)
+                        raise
+                    (bucket or self.glob).block(e.retry_after)
+                    self._counts["retried"] += 1
+                    log.warning("Telegram %s chat=%s: flood control, retry in %ss", name, chat_id, e.retry_after)
+                    if not limited:
+                        await asyncio.sleep(e.retry_after)
+                except TelegramServerError as e:
+                    if attempt == self.retries or not name.startswith(IDEMPOTENT):
+                        self._drop(name, chat_id, e)
+                        raise
+                    self._counts["retried"] += 1
+                    await asyncio.sleep(min(2 ** attempt, 30))
+        except Exception:
+            telegram_errors.inc(name)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - t0, name)
+            if key and self._edits.get(key) == gen:
+                del self._edits[key]
+
+    def _drop(self, name: str, chat_id, e: Exception):
+        self._counts["dropped"] += 1
+        log.warning("Telegram %s chat=%s dropped: %s", name, chat_id, e)
+
+
+outbox = Outbox(cfg.tg_global_per_s, cfg.tg_chat_per_s, cfg.tg_chat_burst,
+                retries=cfg.tg_retries, max_wait=cfg.tg_max_wait_s)
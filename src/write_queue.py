@@ -0,0 +1,218 @@
+# src/write_queue.py
+"""
+Write-behind очередь для листа «Заявки».
+
+append_booking / set_status не ходят в Google сразу, а кладут операцию в очередь.
+Фоновый поток раз в flush_ms (или как только набралось batch_max операций) сливает её:
+подряд идущие добавления — одним append_rows, подряд идущие правки ячеек — одним batch_update.
+Порядок операций сохраняется. Повторы на 429/5xx делает LimitedHTTPClient (src/ratelimit.py);
+не записанное остаётся в голове очереди до следующего слива. Добавления заявок не выбрасываются
+никогда (пользователь уже видел «✅»), правки ячеек — после MAX_ATTEMPTS неудачных сливов; и о том,
+и о другом сообщает хук on_failure. В write-through режиме (WRITE_FLUSH_MS=0) ошибка записи
+поднимается в вызывающего, а операция из очереди убирается — он сам откатит то, что успел сделать.
+"""
+from __future__ import annotations
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, TYPE_CHECKING
+
+from gspread.utils import rowcol_to_a1
+
+from .ratelimit import BACKGROUND, sheets_priority
+
+if TYPE_CHECKING:
+    from .sheets import Sheets
+
+log = logging.getLogger("qwesade.sheets")
+
+MAX_ATTEMPTS = 5  # после стольких неудачных сливов правка выкидывается, а добавление — попадает в on_failure
+
+
+@dataclass
+class WriteOp:
+    kind: str                      # "append" | "update"
+    request_id: str
+    values: List[str] | None = None            # для append — строка целиком
+    fields: Dict[str, str] = field(default_factory=dict)  # для update — колонка -> значение
+    attempts: int = 0
+    ok: bool | None = None         # None — ещё в очереди, True — записана, False — выброшена
+    error: Exception | None = None  # последняя ошибка записи
+
+
+def first_appended_row(resp) -> int | None:
+    """Номер первой строки из ответа values.append ("'Заявки'!A120:M121" -> 120)."""
+    try:
+        rng = resp["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    m = re.search(r"![A-Z]+(\d+)", rng)
+    return int(m.group(1)) if m else None
+
+
+class WriteQueue:
+    def __init__(self, sheets: "Sheets", flush_ms: int, batch_max: int):
+        self._sheets = sheets
+        self.flush_interval = max(flush_ms, 0) / 1000
+        self.batch_max = max(batch_max, 1)
+        self._ops: List[WriteOp] = []
+        self._inflight: List[WriteOp] = []
+        self._cv = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        # зовётся из потока записи: правка выброшена (op.ok False) или добавление застряло (op.ok None)
+        self.on_failure: Callable[[WriteOp], None] | None = None
+
+    # --------------------- enqueue ---------------------------
+
+    def append(self, request_id: str, values: List[str]) -> WriteOp:
+        return self._put(WriteOp("append", str(request_id), values=values))
+
+    def update(self, request_id: str, fields: Dict[str, str]) -> WriteOp:
+        return self._put(WriteOp("update", str(request_id), fields=dict(fields)))
+
+    def _put(self, op: WriteOp) -> WriteOp:
+        """Поставить операцию в очередь; по op.ok потом видно, дошла ли она до таблицы."""
+        if not self.flush_interval or self._stopping:
+            # write-through режим (WRITE_FLUSH_MS=0) или очередь уже остановлена
+            with self._cv:
+                self._ops.append(op)
+            self.flush()
+            with self._flush_lock:  # чужой слив, подхвативший op, уже закончился
+                if op.ok is None:
+                    with self._cv:
+                        self._ops = [o for o in self._ops if o is not op]
+                    op.ok = False
+                    raise op.error or RuntimeError(f"Запись {op.request_id} не дошла до таблицы")
+            return op
+        with self._cv:
+            self._ops.append(op)
+            if self._thread is None and not self._stopping:
+                self._thread = threading.Thread(target=self._loop, name="sheets-writer", daemon=True)
+                self._thread.start()
+            if len(self._ops) >= self.batch_max:
+                self._cv.notify()
+        return op
+
+    # --------------------- read-your-writes ---------------------------
+
+    def pending(self, request_id: str) -> List[WriteOp]:
+        """Ещё не записанные операции по заявке — в порядке постановки."""
+        rid = str(request_id)
+        with self._cv:
+            return [op for op in self._inflight + self._ops if op.request_id == rid]
+
+    def pending_appends(self) -> List[WriteOp]:
+        with self._cv:
+            return [op for op in self._inflight + self._ops if op.kind == "append"]
+
+    def depth(self) -> int:
+        with self._cv:
+            return len(self._ops) + len(self._inflight)
+
+    # --------------------- flush ---------------------------
+
+    def _loop(self):
+        sheets_priority.set(BACKGROUND)  # слив очереди уступает интерактивным запросам
+        while True:
+            with self._cv:
+                if not self._stopping and len(self._ops) < self.batch_max:
+                    self._cv.wait(self.flush_interval)
+                if self._stopping and not self._ops:
+                    return
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cv:
+                ops, self._ops = self._ops, []
+                self._inflight = ops
+            try:
+                i = 0
+                while i < len(ops):
+                    j = i
+                    while j < len(ops) and ops[j].kind == ops[i].kind:
+                        j += 1
+                    chunk = ops[i:j]
+                    write = self._write_appends if chunk[0].kind == "append" else self._write_updates
+                    try:
+                        write(chunk)
+                    except Exception as e:
+                        log.exception("Sheets write-behind flush failed: %s", e)
+                        failed = []
+                        for op in chunk:  # остальные операции не пробовали — их попытки не тратим
+                            op.attempts += 1
+                            op.error = e
+                            if op.attempts < MAX_ATTEMPTS:
+                                continue
+                            if op.kind == "update":
+                                op.ok = False
+                                log.error("Dropping write for %s after %d attempts: %s", op.request_id, op.attempts, op)
+                                failed.append(op)
+                            elif op.attempts == MAX_ATTEMPTS:  # сообщаем один раз, повторы идут дальше
+                                log.error("Append for %s still not written after %d attempts, keeps retrying: %s",
+                                          op.request_id, op.attempts, op.values)
+                                failed.append(op)
+                        with self._cv:
+                            self._ops[:0] = [op for op in ops[i:] if op.ok is None]
+                        for op in failed:
+                            self._failed(op)
+                        return
+                    for op in chunk:
+                        op.ok = True
+                    i = j
+            finally:
+                with self._cv:
+                    self._inflight = []
+
+    def _failed(self, op: WriteOp):
+        if self.on_failure:
+            try:
+                self.on_failure(op)
+            except Exception as e:
+                log.warning("Write failure hook failed: %s", e)
+
+    def _write_appends(self, chunk: List[WriteOp]):
+        if any(op.attempts for op in chunk):
+            # прошлый слив мог дописать строки, хоть ответ и потерялся, — второй раз их не добавляем
+            landed = self._sheets._book_index(force=True)
+            chunk = [op for op in chunk if op.request_id not in landed]
+            if not chunk:
+                return
+        rows = [op.values for op in chunk]
+        resp = self._sheets.ws_book.append_rows(rows, value_input_option="USER_ENTERED")
+        self._sheets._book_appended(first_appended_row(resp), rows)
+
+    def _write_updates(self, chunk: List[WriteOp]):
+        rows = self._sheets._book_rows_for({op.request_id for op in chunk})
+        h = self._sheets._book_header_map()
+        cells: Dict[tuple, str] = {}
+        for op in chunk:
+            row = rows.get(op.request_id)
+            if not row:
+                log.warning("Write for unknown RequestID %s skipped", op.request_id)
+                continue
+            for name, value in op.fields.items():
+                cells[(row, h[name])] = value  # поздняя правка той же ячейки перекрывает раннюю
+        if cells:
+            self._sheets.ws_book.batch_update(
+                [{"range": rowcol_to_a1(r, c), "values": [[v]]} for (r, c), v in cells.items()],
+                value_input_option="USER_ENTERED",
+            )
+
+    # --------------------- shutdown ---------------------------
+
+    def stop(self, timeout: float = 30):
+        """Дописать всё, что накопилось, и остановить фоновый поток (хук для on_shutdown)."""
+        with self._cv:
+            self._stopping = True
+            self._cv.notify()
+            thread = self._thread
+        if thread:
+            thread.join(timeout)
+        self.flush()
+        for op in self._ops:
+            # процесс завершается — незаписанное остаётся только в логе, откуда его можно восстановить
+            log.error("Unwritten at shutdown: %s %s %s", op.kind, op.request_id, op.values or op.fields)
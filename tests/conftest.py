@@ -0,0 +1,43 @@
+# tests/conftest.py
+"""
+Общие фикстуры: Google Sheets — bench/fake_gspread в памяти, как у бенчмарка.
+Окружение ставится до импорта src: Config читает его при импорте.
+"""
+import pytest
+
+from bench.run import _setup_env
+
+_setup_env("sheets")
+
+from bench.fake_gspread import FakeClient, install  # noqa: E402
+from src.sheets import HEADERS_BOOK, Sheets  # noqa: E402
+
+
+@pytest.fixture
+def client() -> FakeClient:
+    c = FakeClient()
+    install(c)
+    return c
+
+
+@pytest.fixture
+def sheets(client) -> Sheets:
+    s = Sheets()
+    s._connect()
+    yield s
+    s.stop()
+
+
+def booking(rid: str, **fields) -> dict:
+    """Строка «Заявок» с разумными значениями по умолчанию."""
+    row = {h: "" for h in HEADERS_BOOK}
+    row.update(Timestamp="2026-10-17 12:00:00", RequestID=rid, TelegramID="100", Service="Кафе",
+               DateISO="2026-10-20", DateText="20.10", TimeSlot="12:00–14:00", Status="Новая")
+    row.update(fields)
+    return row
+
+
+def sheet_ids(ws) -> list:
+    """RequestID строк листа «Заявки» по порядку (без шапки)."""
+    i = HEADERS_BOOK.index("RequestID")
+    return [r[i] for r in ws.data[1:] if len(r) > i and r[i]]
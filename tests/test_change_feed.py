@@ -0,0 +1,92 @@
+# tests/test_change_feed.py
+import pytest
+
+from conftest import booking
+from src.change_feed import MAX_ROWS, ChangeFeed
+from src.config import cfg
+from src.sheets import HEADERS_BOOK
+
+BOOK, CAL = cfg.sheet_bookings, cfg.sheet_calendar
+
+
+@pytest.fixture
+def log_ws(client):
+    ws = client.spreadsheet.add_worksheet(cfg.sheet_changes)
+    ws.update("A1", [["Seq", "Sheet", "FromRow", "ToRow", "At"]])
+    return ws
+
+
+@pytest.fixture
+def feed(sheets, log_ws):
+    f = ChangeFeed(sheets)
+    assert f.head() == (0, 1)  # лог пуст; head() заодно находит лист лога
+    return f
+
+
+def _log(ws, *entries):
+    """Дописать записи [Sheet, FromRow, ToRow] с очередными Seq."""
+    seq = max([int(r[0]) for r in ws.data[1:] if r and r[0]] or [0])
+    ws.append_rows([[str(seq + i + 1), sheet, str(a), str(b), ""] for i, (sheet, a, b) in enumerate(entries)])
+
+
+def _trim(ws, n: int):
+    """Apps Script подрезает лог сверху: удалить n первых записей."""
+    ws.data[1:] = ws.data[1 + n:]
+
+
+def test_no_log_sheet_means_no_feed(sheets):
+    feed = ChangeFeed(sheets)
+    assert feed.head() is None and not feed.available
+
+
+def test_head_and_incremental_read(feed, log_ws):
+    _log(log_ws, (BOOK, 5, 6), (CAL, 3, 3))
+    cursor, changes = feed.read((0, 1))
+    assert cursor == (2, 3)
+    assert changes == {BOOK: {5, 6}, CAL: {3}}
+    _log(log_ws, (BOOK, 7, 7))
+    assert feed.read(cursor) == ((3, 4), {BOOK: {7}})
+    assert feed.read((3, 4)) == ((3, 4), {})
+
+
+def test_trimmed_log_is_found_again(feed, log_ws):
+    _log(log_ws, (BOOK, 2, 2), (BOOK, 3, 3), (BOOK, 4, 4))
+    _trim(log_ws, 1)  # курсор (2, 3) теперь указывает на запись 3
+    assert feed.read((2, 3)) == ((3, 3), {BOOK: {4}})
+
+
+@pytest.mark.parametrize("entries, trim", [
+    ([(BOOK, 2, 2), (BOOK, 3, 3), (BOOK, 4, 4)], 2),  # подрезали дальше курсора — пропуск
+    ([(BOOK, 2, 2), ("*", 0, 0)], 0),                # структурная правка
+    ([(BOOK, 2, MAX_ROWS + 2)], 0),                  # слишком много строк
+])
+def test_gap_or_structural_edit_asks_for_full_reread(feed, log_ws, entries, trim):
+    _log(log_ws, *entries)
+    _trim(log_ws, trim)
+    cursor, changes = feed.read((0, 1) if not trim else (1, 2))
+    assert changes is None
+    assert cursor[0] == len(entries)  # курсор всё равно двигается: эти записи больше не нужны
+
+
+def test_fetch_returns_changed_rows(sheets, feed):
+    sheets.ws_book.append_rows([[booking("RQ-1")[h] for h in HEADERS_BOOK]])
+    book, cal_headers, cal = feed.fetch({BOOK: {2, 3}, CAL: {1}})
+    assert book[2][1] == "RQ-1"
+    assert book[3] == []                      # очищенная строка — пустой список
+    assert cal_headers == ["Date"] + cfg.time_slots and cal == {}
+
+
+def test_sheets_resyncs_indexes_on_gap(sheets, log_ws):
+    sheets.ws_book.append_rows([[booking("RQ-1")[h] for h in HEADERS_BOOK]])
+    assert sheets.find_row_by_request_id("RQ-1") == 2
+    sheets._feed_cursor = sheets.feed.head()
+    gen = sheets._book_idx_gen
+
+    _log(log_ws, (BOOK, 2, 2))
+    sheets.pull_changes()
+    assert sheets._book_idx_gen == gen  # точечная правка — индекс не сбрасываем
+
+    _log(log_ws, ("*", 0, 0))
+    sheets.pull_changes()
+    assert sheets._book_idx_gen > gen and sheets._feed_cursor == (2, 3)
+    assert sheets.find_row_by_request_id("RQ-1") == 2  # перечитан с листа
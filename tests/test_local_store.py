@@ -0,0 +1,174 @@
+# tests/test_local_store.py
+import pytest
+
+from conftest import booking, sheet_ids
+from src.config import cfg
+from src.local_store import ALL_MUTABLE, LocalStore
+from src.sheets import HEADERS_BOOK
+from src.write_queue import MAX_ATTEMPTS, WriteQueue
+
+
+@pytest.fixture
+def store(sheets, tmp_path):
+    sheets.writes = WriteQueue(sheets, flush_ms=60_000, batch_max=1000)
+    s = LocalStore(sheets, str(tmp_path / "store.sqlite3"), push_ms=3_600_000, pull_s=0)
+    # импорт без потока-репликатора: push/pull в тестах зовутся руками
+    s.pull()
+    s._meta_set("imported", "test")
+    s._ready.set()
+    yield s
+    s.stop()
+
+
+def _local(store, rid):
+    with store._lock:
+        return store._db.execute("SELECT status, dirty, in_sheet, rev FROM bookings WHERE request_id=?",
+                                 (rid,)).fetchone()
+
+
+def _status(ws, rid):
+    row = next(r for r in ws.data if len(r) > 1 and r[1] == rid)
+    return row[HEADERS_BOOK.index("Status")]
+
+
+def _fail(monkeypatch, ws, name, times=10**9):
+    real, left = getattr(ws, name), [times]
+
+    def flaky(*a, **kw):
+        if left[0] > 0:
+            left[0] -= 1
+            raise RuntimeError(f"{name} down")
+        return real(*a, **kw)
+    monkeypatch.setattr(ws, name, flaky)
+
+
+def _during_flush(monkeypatch, store, fn):
+    """fn() выполнится, пока push ждёт очередь записи: правка, пришедшая во время отправки."""
+    writes = store.remote.writes
+    real = writes.flush
+
+    def flush():
+        fn()
+        monkeypatch.setattr(writes, "flush", real)
+        real()
+    monkeypatch.setattr(writes, "flush", flush)
+
+
+def test_append_is_clean_only_after_queue_wrote_it(store):
+    op = store.append_booking(booking("RQ-1"))
+    assert op.ok is True  # заявка уже в базе
+    assert tuple(_local(store, "RQ-1"))[1:3] == ("*", 0)
+    assert store._count_backlog() == 1
+
+    store.push()
+    assert sheet_ids(store.remote.ws_book) == ["RQ-1"]
+    assert tuple(_local(store, "RQ-1"))[1:3] == ("", 1)
+    assert store._count_backlog() == 0 and not store._sent
+
+
+def test_unwritten_append_stays_dirty_and_is_not_resent(store, monkeypatch):
+    _fail(monkeypatch, store.remote.ws_book, "append_rows", times=1)
+    store.append_booking(booking("RQ-1"))
+
+    store.push()
+    assert _local(store, "RQ-1")["dirty"] == "*"
+    assert "RQ-1" in store._sent and store.remote.writes.depth() == 1
+
+    store.push()  # та же операция ещё в очереди — второй раз не ставим, она дописывается
+    assert sheet_ids(store.remote.ws_book) == ["RQ-1"]
+    assert _local(store, "RQ-1")["dirty"] == "" and not store._sent
+
+
+def test_edit_during_append_is_sent_as_update(store, monkeypatch):
+    store.append_booking(booking("RQ-1"))
+    _during_flush(monkeypatch, store, lambda: store.set_status("RQ-1", "Подтверждена"))
+
+    store.push()
+    row = _local(store, "RQ-1")
+    # строка легла в таблицу в старом виде: in_sheet, но правка после снимка ещё не отправлена
+    assert (row["in_sheet"], row["dirty"]) == (1, ALL_MUTABLE)
+    assert _status(store.remote.ws_book, "RQ-1") == "Новая"
+
+    store.push()
+    assert _local(store, "RQ-1")["dirty"] == ""
+    assert _status(store.remote.ws_book, "RQ-1") == "Подтверждена"
+    assert sheet_ids(store.remote.ws_book) == ["RQ-1"]
+
+
+def test_update_superseded_in_flight_stays_dirty(store, monkeypatch):
+    store.append_booking(booking("RQ-1"))
+    store.push()
+    store.set_status("RQ-1", "Подтверждена")
+    _during_flush(monkeypatch, store, lambda: store.set_status("RQ-1", "Отклонена", admin_comment="занято"))
+
+    store.push()
+    assert _local(store, "RQ-1")["dirty"] == "admin_comment,status"  # rev новее отправленного
+    store.push()
+    assert _local(store, "RQ-1")["dirty"] == ""
+    assert _status(store.remote.ws_book, "RQ-1") == "Отклонена"
+
+
+def test_dropped_update_is_sent_again(store, monkeypatch):
+    store.append_booking(booking("RQ-1"))
+    store.push()
+    _fail(monkeypatch, store.remote.ws_book, "batch_update", times=MAX_ATTEMPTS)
+    store.set_status("RQ-1", "Подтверждена")
+
+    for _ in range(MAX_ATTEMPTS):
+        store.push()
+    assert _local(store, "RQ-1")["dirty"] == "status"  # очередь выбросила правку — строка осталась dirty
+    assert not store._sent
+
+    store.push()
+    assert _local(store, "RQ-1")["dirty"] == ""
+    assert _status(store.remote.ws_book, "RQ-1") == "Подтверждена"
+
+
+def test_slots_are_pushed_and_cleared(store):
+    assert store.mark_slot("2026-10-20", "10:00–12:00", "RQ-1")
+    assert not store.mark_slot("2026-10-20", "11:00–13:00", "RQ-2")  # пересечение — мимо таблицы
+    store.push()
+    ws = store.remote.ws_cal
+    col = ws.data[0].index("10:00–12:00")
+    day = next(r for r in ws.data if r and r[0] == "2026-10-20")
+    assert day[col] == "RQ-1"
+    assert store._count_backlog() == 0
+
+    assert store.clear_slot("2026-10-20", "10:00–12:00")
+    store.push()
+    day = next(r for r in ws.data if r and r[0] == "2026-10-20")
+    assert (day + [""] * col)[col] == ""
+    with store._lock:
+        assert store._scalar("SELECT COUNT(*) FROM slots") == 0
+
+
+def test_pull_keeps_unsent_local_changes(store):
+    store.append_booking(booking("RQ-1"))
+    store.push()
+    store.set_status("RQ-1", "Подтверждена")
+    ws = store.remote.ws_book
+    row = next(r for r in ws.data if len(r) > 1 and r[1] == "RQ-1")
+    row[HEADERS_BOOK.index("Status")] = "Отклонена"  # админ поправил руками
+
+    store.pull()
+    assert _local(store, "RQ-1")["status"] == "Подтверждена"  # dirty — таблица не перетирает
+    store.push()
+    store.pull()
+    assert _local(store, "RQ-1")["status"] == "Подтверждена"
+
+
+def test_change_feed_gap_falls_back_to_full_pull(store, client):
+    log_ws = client.spreadsheet.add_worksheet(cfg.sheet_changes)
+    log_ws.update("A1", [["Seq", "Sheet", "FromRow", "ToRow", "At"]])
+    store.append_booking(booking("RQ-1"))
+    store.push()
+    store._set_feed_cursor(store.remote.feed.head())
+
+    ws = store.remote.ws_book
+    row = next(r for r in ws.data if len(r) > 1 and r[1] == "RQ-1")
+    row[HEADERS_BOOK.index("Status")] = "Подтверждена"
+    log_ws.append_rows([["1", "*", "0", "0", ""]])  # структурная правка: по строкам не догнать
+
+    store.pull_changes()
+    assert _local(store, "RQ-1")["status"] == "Подтверждена"
+    assert store._feed_cursor == (1, 2) and store._meta("feed_cursor") == "1:2"
@@ -0,0 +1,105 @@
+# tests/test_ratelimit.py
+import json
+
+import gspread
+import pytest
+import requests
+
+from src import ratelimit
+from src.ratelimit import BACKGROUND, LimitedHTTPClient, SheetsLimiter, TokenBucket
+
+VALUES = "https://sheets.googleapis.com/v4/spreadsheets/x/values/A1"
+APPEND = VALUES + ":append"
+
+
+def _response(code: int) -> requests.Response:
+    r = requests.Response()
+    r.status_code = code
+    r._content = json.dumps({"error": {"code": code, "message": "x", "status": "x"}} if code >= 400 else {}).encode()
+    return r
+
+
+class Session:
+    """requests.Session-заглушка: отдаёт коды по очереди, последний — дальше всегда."""
+
+    def __init__(self, *codes: int):
+        self.codes = list(codes)
+        self.calls = 0
+
+    def request(self, **kw):
+        self.calls += 1
+        code = self.codes.pop(0) if len(self.codes) > 1 else self.codes[0]
+        if code == 0:
+            raise requests.ConnectionError("reset")
+        return _response(code)
+
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+    lim = SheetsLimiter(read_per_min=6000, write_per_min=6000, retries=3)
+    monkeypatch.setattr(ratelimit, "limiter", lim)
+    monkeypatch.setattr(ratelimit.time, "sleep", lambda s: None)  # паузы между повторами не ждём
+    return lim
+
+
+def _call(method, url, *codes):
+    session = Session(*codes)
+    client = LimitedHTTPClient(auth=None, session=session)
+    try:
+        return client.request(method, url), session.calls
+    except Exception as e:
+        return e, session.calls
+
+
+@pytest.mark.parametrize("codes", [(500, 200), (503, 200), (0, 200), (429, 200)])
+def test_get_retries_transient_errors(limiter, codes):
+    resp, calls = _call("get", VALUES, *codes)
+    assert resp.status_code == 200 and calls == 2
+    assert limiter.stats()["read.retries"] == 1
+
+
+@pytest.mark.parametrize("code", [500, 503, 0])
+def test_append_is_not_retried_after_5xx_or_reset(limiter, code):
+    # строки могли уже лечь — повтор задвоил бы заявку
+    err, calls = _call("post", APPEND, code, 200)
+    assert isinstance(err, (gspread.exceptions.APIError, requests.ConnectionError))
+    assert calls == 1
+    assert limiter.stats()["write.errors"] == 1
+
+
+def test_append_is_retried_on_429(limiter):
+    resp, calls = _call("post", APPEND, 429, 429, 200)
+    assert resp.status_code == 200 and calls == 3
+
+
+def test_other_writes_retry_5xx():
+    resp, calls = _call("post", VALUES + ":batchUpdate", 502, 200)
+    assert resp.status_code == 200 and calls == 2
+
+
+def test_client_errors_are_not_retried():
+    err, calls = _call("get", VALUES, 400, 200)
+    assert ratelimit.api_status(err) == 400 and calls == 1
+
+
+def test_retries_are_bounded(limiter):
+    err, calls = _call("get", VALUES, 503)
+    assert ratelimit.api_status(err) == 503
+    assert calls == limiter.retries + 1
+
+
+def test_deadline_stops_retrying():
+    token = ratelimit.sheets_deadline.set(ratelimit.time.monotonic())  # уже поздно
+    try:
+        err, calls = _call("get", VALUES, 503, 200)
+    finally:
+        ratelimit.sheets_deadline.reset(token)
+    assert ratelimit.api_status(err) == 503 and calls == 1
+
+
+def test_background_keeps_reserve_for_interactive():
+    b = TokenBucket(per_minute=60, reserve=0.25)
+    b.tokens = 10  # в резерве 15 токенов: фоновому не хватает, интерактивный берёт сразу
+    assert b.acquire("interactive") == 0
+    with pytest.raises(TimeoutError):
+        b.acquire(BACKGROUND, deadline=ratelimit.time.monotonic())
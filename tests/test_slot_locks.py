@@ -0,0 +1,91 @@
+# tests/test_slot_locks.py
+import asyncio
+
+import pytest
+
+from src.slot_locks import WHOLE_DAY, SlotLocks, slot_interval
+
+
+def test_slot_interval():
+    assert slot_interval("10:00–12:00") == (600, 720)
+    assert slot_interval("Весь день") == WHOLE_DAY
+    assert slot_interval("после обеда") == WHOLE_DAY
+
+
+async def _entered(locks: SlotLocks, date_iso: str, slot: str, timeout: float = 0.05) -> bool:
+    """Удалось ли взять слот, пока его держат (за timeout)."""
+    async def take():
+        async with locks.hold(date_iso, slot):
+            pass
+    try:
+        await asyncio.wait_for(take(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+@pytest.mark.parametrize("date_iso, slot, free", [
+    ("2026-10-20", "11:00–13:00", False),  # пересекается
+    ("2026-10-20", "Весь день", False),
+    ("2026-10-20", "12:00–14:00", True),   # стык — не пересечение
+    ("2026-10-20", "13:00–15:00", True),
+    ("2026-10-21", "10:00–12:00", True),   # другая дата
+])
+def test_only_overlapping_slots_wait(date_iso, slot, free):
+    async def run():
+        locks = SlotLocks()
+        async with locks.hold("2026-10-20", "10:00–12:00"):
+            return await _entered(locks, date_iso, slot)
+    assert asyncio.run(run()) is free
+
+
+def test_waiter_enters_after_release_in_order():
+    async def run():
+        locks, log = SlotLocks(), []
+
+        async def confirm(name, slot, pause):
+            async with locks.hold("2026-10-20", slot):
+                log.append(f"{name}+")
+                await asyncio.sleep(pause)
+                log.append(f"{name}-")
+
+        first = asyncio.create_task(confirm("a", "10:00–12:00", 0.02))
+        await asyncio.sleep(0)
+        await asyncio.gather(first, confirm("b", "11:00–13:00", 0))
+        assert not locks._held
+        return log
+    assert asyncio.run(run()) == ["a+", "a-", "b+", "b-"]
+
+
+def test_cancelled_waiter_leaves_nothing_behind():
+    async def run():
+        locks = SlotLocks()
+        async with locks.hold("2026-10-20", "10:00–12:00"):
+            assert not await _entered(locks, "2026-10-20", "Весь день")  # wait_for отменил ждущего
+            await asyncio.sleep(0)
+            stray = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            assert stray == []  # задачи ev.wait() отменены вместе с ним
+            assert len(locks._held["2026-10-20"]) == 1
+        assert not locks._held
+        assert await _entered(locks, "2026-10-20", "Весь день")
+    asyncio.run(run())
+
+
+def test_cancelled_holder_releases_slot():
+    async def run():
+        locks = SlotLocks()
+        inside = asyncio.Event()
+
+        async def stuck():
+            async with locks.hold("2026-10-20", "10:00–12:00"):
+                inside.set()
+                await asyncio.sleep(60)
+
+        task = asyncio.create_task(stuck())
+        await inside.wait()
+        waiter = asyncio.create_task(_entered(locks, "2026-10-20", "11:00–13:00", timeout=1))
+        await asyncio.sleep(0)
+        task.cancel()
+        assert await waiter
+        assert not locks._held
+    asyncio.run(run())
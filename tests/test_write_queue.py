@@ -0,0 +1,161 @@
+# tests/test_write_queue.py
+import pytest
+
+from conftest import booking, sheet_ids
+from src.sheets import HEADERS_BOOK
+from src.write_queue import MAX_ATTEMPTS, WriteQueue
+
+
+@pytest.fixture
+def wq(sheets):
+    # слив только руками: поток ждёт минуту, пачка — тысяча операций
+    q = sheets.writes = WriteQueue(sheets, flush_ms=60_000, batch_max=1000)
+    return q
+
+
+def _append(wq, rid, **fields):
+    return wq.append(rid, [booking(rid, **fields)[h] for h in HEADERS_BOOK])
+
+
+def _status(ws, rid):
+    row = next(r for r in ws.data if len(r) > 1 and r[1] == rid)
+    return row[HEADERS_BOOK.index("Status")]
+
+
+def _fail(monkeypatch, ws, name, times=10**9):
+    """Первые times вызовов ws.name падают."""
+    real, left = getattr(ws, name), [times]
+
+    def flaky(*a, **kw):
+        if left[0] > 0:
+            left[0] -= 1
+            raise RuntimeError(f"{name} down")
+        return real(*a, **kw)
+    monkeypatch.setattr(ws, name, flaky)
+
+
+def _record(monkeypatch, ws, calls: list):
+    for name in ("append_rows", "batch_update"):
+        def call(*a, _name=name, _real=getattr(ws, name), **kw):
+            calls.append(_name)
+            return _real(*a, **kw)
+        monkeypatch.setattr(ws, name, call)
+
+
+def test_runs_of_same_kind_are_batched_in_order(wq, sheets, monkeypatch):
+    calls = []
+    ws = sheets.ws_book
+    _record(monkeypatch, ws, calls)
+
+    a, b = _append(wq, "RQ-1"), _append(wq, "RQ-2")
+    u = wq.update("RQ-1", {"Status": "Подтверждена"})
+    c = _append(wq, "RQ-3")
+    v = wq.update("RQ-3", {"Status": "Отклонена"})
+    assert [op.ok for op in (a, b, u, c, v)] == [None] * 5
+    assert wq.depth() == 5
+
+    wq.flush()
+    # подряд идущие добавления — одним append_rows, порядок операций сохранён
+    assert calls == ["append_rows", "batch_update", "append_rows", "batch_update"]
+    assert [op.ok for op in (a, b, u, c, v)] == [True] * 5
+    assert sheet_ids(ws) == ["RQ-1", "RQ-2", "RQ-3"]
+    assert _status(ws, "RQ-1") == "Подтверждена"
+    assert _status(ws, "RQ-3") == "Отклонена"
+    assert wq.depth() == 0
+
+
+def test_pending_overlays_unwritten_ops(wq, sheets):
+    _append(wq, "RQ-1")
+    wq.update("RQ-1", {"Status": "Подтверждена"})
+    assert [op.kind for op in wq.pending("RQ-1")] == ["append", "update"]
+    assert sheets.get_by_request_id("RQ-1")["Status"] == "Подтверждена"
+
+
+def test_failed_chunk_retries_and_only_it_is_charged(wq, sheets, monkeypatch):
+    _append(wq, "RQ-0")
+    wq.flush()
+    _fail(monkeypatch, sheets.ws_book, "batch_update", times=1)
+    u = wq.update("RQ-0", {"Status": "Подтверждена"})
+    a = _append(wq, "RQ-1")
+
+    wq.flush()
+    assert (u.ok, u.attempts, str(u.error)) == (None, 1, "batch_update down")
+    # до добавления за упавшей правкой очередь не дошла — попытка ему не засчитана
+    assert (a.ok, a.attempts) == (None, 0)
+    assert [op.request_id for op in wq.pending_appends()] == ["RQ-1"]
+
+    wq.flush()
+    assert u.ok and a.ok
+    assert sheet_ids(sheets.ws_book) == ["RQ-0", "RQ-1"]
+    assert _status(sheets.ws_book, "RQ-0") == "Подтверждена"
+
+
+def test_lost_append_response_does_not_duplicate_row(wq, sheets, monkeypatch):
+    ws = sheets.ws_book
+    real = ws.append_rows
+    lost = [RuntimeError("response lost")]
+
+    def lands_then_fails(*a, **kw):
+        resp = real(*a, **kw)
+        if lost:
+            raise lost.pop()  # строки легли, а ответ — нет
+        return resp
+    monkeypatch.setattr(ws, "append_rows", lands_then_fails)
+
+    op = _append(wq, "RQ-1")
+    wq.flush()
+    assert op.ok is None and op.attempts == 1
+    wq.flush()
+    assert op.ok is True
+    assert sheet_ids(ws) == ["RQ-1"]
+
+
+def test_update_dropped_after_max_attempts(wq, sheets, monkeypatch):
+    _append(wq, "RQ-1")
+    wq.flush()
+    failed = []
+    wq.on_failure = failed.append
+    _fail(monkeypatch, sheets.ws_book, "batch_update")
+
+    u = wq.update("RQ-1", {"Status": "Подтверждена"})
+    for _ in range(MAX_ATTEMPTS):
+        wq.flush()
+    assert u.ok is False and u.attempts == MAX_ATTEMPTS
+    assert failed == [u]
+    assert wq.depth() == 0
+    assert _status(sheets.ws_book, "RQ-1") == "Новая"
+
+
+def test_append_is_never_dropped_and_reported_once(wq, sheets, monkeypatch):
+    failed = []
+    wq.on_failure = failed.append
+    _fail(monkeypatch, sheets.ws_book, "append_rows", times=MAX_ATTEMPTS + 2)
+
+    op = _append(wq, "RQ-1")
+    for _ in range(MAX_ATTEMPTS + 2):
+        wq.flush()
+    assert op.ok is None and op.attempts == MAX_ATTEMPTS + 2
+    assert failed == [op]  # хук — один раз, на MAX_ATTEMPTS; повторы идут дальше
+
+    wq.flush()
+    assert op.ok is True
+    assert sheet_ids(sheets.ws_book) == ["RQ-1"]
+
+
+def test_write_through_raises_to_caller(sheets, monkeypatch):
+    wq = sheets.writes = WriteQueue(sheets, flush_ms=0, batch_max=1000)
+    op = _append(wq, "RQ-1")
+    assert op.ok is True and sheet_ids(sheets.ws_book) == ["RQ-1"]
+
+    _fail(monkeypatch, sheets.ws_book, "append_rows")
+    with pytest.raises(RuntimeError, match="append_rows down"):
+        _append(wq, "RQ-2")
+    assert wq.depth() == 0  # вызывающий откатит своё сам, в очереди операции не остаётся
+
+
+def test_stop_flushes_what_is_queued(wq, sheets):
+    _append(wq, "RQ-1")
+    wq.update("RQ-1", {"Status": "Подтверждена"})
+    wq.stop()
+    assert sheet_ids(sheets.ws_book) == ["RQ-1"]
+    assert _status(sheets.ws_book, "RQ-1") == "Подтверждена"